@@ -1,20 +1,251 @@
-#include <AccelStepper.h>
+#include <Arduino.h>
 
-AccelStepper stepper(AccelStepper::DRIVER, 2, 3); // step, dir pins
-long targetPos = 0;
+// Framed motion protocol, see python/MotionLink.py
+// Frame: "<payload>*<checksum>\n", checksum is the XOR of the payload bytes as two hex digits.
+//
+// Queued segments are chained without stopping: the speed at the end of a segment is handed to
+// the next one, as high as the corner between them and the braking distance of the queue allow.
+// The gantry only stops where the magnet switches and after the last queued segment.
+// python/MotionProfile.py models the same profile for the planner's time estimates.
+// The steppers are driven directly from a step clock rather than through AccelStepper, which
+// brings every move to a standstill at its target and cannot hand its speed on to the next one.
+
+const float MAX_SPEED = 1000;     // steps/s
+const float ACCELERATION = 500;   // steps/s^2
+const float JUNCTION_JUMP = 200;  // steps/s a motor's speed may change by at once, at a corner
+const float MIN_SPEED = 20;       // steps/s, so the last steps before a stop are still taken
+const int QUEUE_SIZE = 8;         // Must match MotionLink.WINDOW
+const int MAX_FRAME_BYTES = 28;   // Longest segment frame: "S 255 -999999 -999999 1*XX\n"
+
+// The host may send a whole window of frames at once, they must fit the serial receive buffer.
+// The AVR core only buffers 64 bytes by default, platformio.ini raises it.
+#ifdef SERIAL_RX_BUFFER_SIZE
+static_assert(SERIAL_RX_BUFFER_SIZE >= QUEUE_SIZE * MAX_FRAME_BYTES,
+              "Serial receive buffer too small for a window of frames, see platformio.ini");
+#endif
+
+// Pins. CNChess_KiCad carries a XIAO ESP32-C3 wired to two TMC2209 drivers:
+//   D0 STEP1, D1 DIR1, D2 STEP2, D3 DIR2, D4 SW1, D5 SW2 (end stops, unused here), D6 SERVO (J4)
+// The Mega 2560 this project builds for uses D0 and D1 for the USB serial port, so its bench wiring
+// keeps the first motor on D2/D3 like the original single-motor sketch and moves the rest up.
+// MAGNET_PIN is switched on and off; the servo connector J4 on the PCB needs a servo pulse instead.
+#if defined(ARDUINO_ARCH_ESP32)
+const int STEP_PINS[2] = {D0, D2};
+const int DIR_PINS[2] = {D1, D3};
+const int MAGNET_PIN = D6;
+#else
+const int STEP_PINS[2] = {2, 4};
+const int DIR_PINS[2] = {3, 5};
+const int MAGNET_PIN = 6;
+#endif
+
+struct Segment {
+  uint8_t seq;
+  long steps[2];
+  bool magnet;
+  float length;     // Steps of the busier motor, speeds are counted in its steps
+  float exitSpeed;  // Planned speed at the end of the segment
+};
+
+Segment queue[QUEUE_SIZE];
+int queueHead = 0;   // Next segment to run
+int queueCount = 0;
+uint8_t expectedSeq = 0;
+bool moving = false;
+Segment current;
+float progress = 0;         // Steps of the busier motor done in the current segment
+float speed = 0;            // steps/s of the busier motor
+long stepsDone[2];
+unsigned long lastMicros = 0;
+uint8_t lastDoneSeq = 255;  // Sequence number before 0, nothing done yet
+String input;
+
+uint8_t checksum(const String &payload) {
+  uint8_t value = 0;
+  for (unsigned int i = 0; i < payload.length(); i++) {
+    value ^= payload[i];
+  }
+  return value;
+}
+
+void sendFrame(const String &payload) {
+  char cs[3];
+  snprintf(cs, sizeof(cs), "%02X", checksum(payload));
+  Serial.print(payload);
+  Serial.print('*');
+  Serial.println(cs);
+}
+
+Segment &queued(int i) {
+  return queue[(queueHead + i) % QUEUE_SIZE];
+}
+
+// Highest speed at the corner from a into b: neither motor's speed may jump by more than JUNCTION_JUMP
+float junctionSpeed(const Segment &a, const Segment &b) {
+  if (a.magnet != b.magnet || a.length == 0 || b.length == 0) {
+    return 0;  // Pieces are picked up and dropped at standstill
+  }
+  float jump = 0;
+  for (int m = 0; m < 2; m++) {
+    jump = max(jump, fabs(a.steps[m] / a.length - b.steps[m] / b.length));
+  }
+  return jump > 0 ? min(MAX_SPEED, JUNCTION_JUMP / jump) : MAX_SPEED;
+}
+
+// Fastest entry into seg from which it still brakes to its exit speed
+float entryLimit(const Segment &seg) {
+  return sqrt(seg.exitSpeed * seg.exitSpeed + 2 * ACCELERATION * seg.length);
+}
+
+// Backward pass over the queue whenever a segment arrives: the last one ends at standstill
+void planSpeeds() {
+  for (int i = queueCount - 1; i >= 0; i--) {
+    Segment &seg = queued(i);
+    seg.exitSpeed = i == queueCount - 1 ? 0 : min(junctionSpeed(seg, queued(i + 1)), entryLimit(queued(i + 1)));
+  }
+  if (moving) {
+    current.exitSpeed = queueCount > 0 ? min(junctionSpeed(current, queued(0)), entryLimit(queued(0))) : 0;
+  }
+}
+
+void startSegment(const Segment &seg) {
+  digitalWrite(MAGNET_PIN, seg.magnet ? HIGH : LOW);
+  for (int m = 0; m < 2; m++) {
+    digitalWrite(DIR_PINS[m], seg.steps[m] < 0 ? LOW : HIGH);
+    stepsDone[m] = 0;
+  }
+  if (speed == 0) {
+    lastMicros = micros();  // Starting from standstill, otherwise the clock runs on from the last segment
+  }
+  current = seg;
+  progress = 0;
+  moving = true;
+}
+
+void pulse(int motor) {
+  digitalWrite(STEP_PINS[motor], HIGH);
+  delayMicroseconds(2);
+  digitalWrite(STEP_PINS[motor], LOW);
+}
+
+// Advance along the current segment; both motors follow the busier one so the gantry moves straight
+void stepMotors() {
+  unsigned long now = micros();
+  float dt = (now - lastMicros) * 1e-6;
+  lastMicros = now;
+  float brake = sqrt(current.exitSpeed * current.exitSpeed + 2 * ACCELERATION * (current.length - progress));
+  speed = max(min(min(speed + ACCELERATION * dt, MAX_SPEED), brake), MIN_SPEED);
+  progress = min(progress + speed * dt, current.length);
+  for (int m = 0; m < 2; m++) {
+    long target = lround(progress * labs(current.steps[m]) / current.length);
+    while (stepsDone[m] < target) {
+      pulse(m);
+      stepsDone[m]++;
+    }
+  }
+}
+
+void handleFrame(const String &line) {
+  int star = line.lastIndexOf('*');
+  if (star < 0) {
+    sendFrame("N " + String(expectedSeq));
+    return;
+  }
+  String payload = line.substring(0, star);
+  uint8_t received = (uint8_t)strtol(line.substring(star + 1).c_str(), NULL, 16);
+  if (checksum(payload) != received) {
+    sendFrame("N " + String(expectedSeq));
+    return;
+  }
+
+  if (payload == "R") {
+    queueHead = 0;
+    queueCount = 0;
+    expectedSeq = 0;
+    lastDoneSeq = 255;
+    moving = false;
+    speed = 0;
+    digitalWrite(MAGNET_PIN, LOW);
+    sendFrame("R");
+    return;
+  }
+
+  if (payload == "Q") {
+    sendFrame("D " + String(lastDoneSeq));
+    return;
+  }
+
+  if (payload.startsWith("S ")) {
+    Segment seg;
+    long seq;
+    int magnet;
+    if (sscanf(payload.c_str(), "S %ld %ld %ld %d", &seq, &seg.steps[0], &seg.steps[1], &magnet) != 4) {
+      sendFrame("N " + String(expectedSeq));
+      return;
+    }
+    seg.seq = (uint8_t)seq;
+    seg.magnet = magnet != 0;
+    seg.length = max(labs(seg.steps[0]), labs(seg.steps[1]));
+    seg.exitSpeed = 0;
+    if (seg.seq != expectedSeq || queueCount >= QUEUE_SIZE) {
+      // Duplicate of an accepted frame: acknowledge again, anything else: ask for a resend
+      if ((uint8_t)(expectedSeq - seg.seq) <= QUEUE_SIZE * 2 && seg.seq != expectedSeq) {
+        sendFrame("A " + String((uint8_t)(expectedSeq - 1)) + " " + String(QUEUE_SIZE - queueCount));
+      } else {
+        sendFrame("N " + String(expectedSeq));
+      }
+      return;
+    }
+    queue[(queueHead + queueCount) % QUEUE_SIZE] = seg;
+    queueCount++;
+    expectedSeq++;
+    planSpeeds();
+    sendFrame("A " + String(seg.seq) + " " + String(QUEUE_SIZE - queueCount));
+  }
+}
 
 void setup() {
   Serial.begin(115200);
-  stepper.setMaxSpeed(1000);
-  stepper.setAcceleration(500);
+  pinMode(MAGNET_PIN, OUTPUT);
+  digitalWrite(MAGNET_PIN, LOW);
+  for (int m = 0; m < 2; m++) {
+    pinMode(STEP_PINS[m], OUTPUT);
+    pinMode(DIR_PINS[m], OUTPUT);
+  }
 }
 
 void loop() {
-  if (Serial.available()) {
-    String input = Serial.readStringUntil('\n');
-    targetPos = input.toInt();
-    stepper.moveTo(targetPos);
+  while (Serial.available()) {
+    char c = Serial.read();
+    if (c == '\n') {
+      input.trim();
+      if (input.length() > 0) {
+        handleFrame(input);
+      }
+      input = "";
+    } else {
+      input += c;
+    }
   }
 
-  stepper.run();  // non-blocking motion
+  if (moving) {
+    if (current.length > 0) {
+      stepMotors();  // non-blocking motion
+    }
+    if (progress >= current.length) {
+      moving = false;
+      speed = min(speed, current.exitSpeed);  // Handed to the next segment, 0 when it stops here
+      lastDoneSeq = current.seq;
+      sendFrame("D " + String(current.seq));
+    }
+  }
+
+  if (!moving && queueCount > 0) {
+    Segment seg = queue[queueHead];
+    queueHead = (queueHead + 1) % QUEUE_SIZE;
+    queueCount--;
+    startSegment(seg);
+  } else if (!moving) {
+    speed = 0;
+  }
 }
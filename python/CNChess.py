@@ -1,5 +1,47 @@
+import os
+import time
 import chess
-import stockfish
+from EnginePool import EnginePool
+from EngineCache import EngineCache
+from Metrics import metrics
+from OpeningBook import OpeningBook
+from SearchBudget import LatencyBudget, SearchLimits, SearchStats
+from UciEngine import UciEngine, UciInfo, UciSearch
+
+
+class BoardSnapshot:
+    # Read-only view of one position, shared by the UI and the controller until the board changes
+    version: int
+    turn: chess.Color
+    pieces: dict[chess.Square, chess.Piece]
+    legal_moves: dict[chess.Square, list[chess.Move]]
+
+    def __init__(self, board: chess.Board, version: int):
+        self.version = version
+        self.turn = board.turn
+        self.pieces = board.piece_map()
+        # Legal moves grouped by from-square, promotions to every piece included
+        self.legal_moves = {}
+        for move in board.legal_moves:
+            self.legal_moves.setdefault(move.from_square, []).append(move)
+
+    def piece_at(self, square: chess.Square) -> chess.Piece:
+        return self.pieces.get(square)
+
+    def moves_from(self, square: chess.Square) -> list[chess.Move]:
+        return self.legal_moves.get(square, [])
+
+    def find_move(self, from_square: chess.Square, to_square: chess.Square,
+                  promotion: chess.PieceType = chess.QUEEN) -> chess.Move:
+        # Legal move between the squares, or None; pawns reaching the last rank promote to `promotion`
+        found = None
+        for move in self.moves_from(from_square):
+            if move.to_square == to_square:
+                if move.promotion is None or move.promotion == promotion:
+                    return move
+                found = found or move
+        return found
+
 
 class CNChess:
 
@@ -10,20 +52,66 @@ class CNChess:
     next_player_move: chess.Move
 
     stockfish_path: str = "/usr/games/stockfish"  # Adjust path as necessary
-    stockfish_depth: int = 10
-    computer: stockfish.Stockfish
+    stockfish_depth: int = 10  # Used when search_mode is "depth"
+    search_mode: str = "latency"  # "latency", "depth" or "nodes"
+    node_budget: int = 200000  # Used when search_mode is "nodes"
+    candidate_depth: int = 6  # Depth from which the search's MultiPV lines are announced as candidate moves
+    candidate_count: int = 3
+    limited_samples: int = 4  # Searches cached per position before a strength-limited engine replays them
+    candidate_moves: list[chess.Move]
+    budget: LatencyBudget
+    last_search_stats: SearchStats
+    engine_pool: EnginePool
+    elo: int
+    book_path: str = os.path.join(os.path.dirname(__file__), "opening_book.bin")
+    cache_path: str = os.path.join(os.path.dirname(__file__), "engine_cache.sqlite")
+    book: OpeningBook
+    cache: EngineCache
+    version: int
+    snapshot: BoardSnapshot
+    board_listeners: list
+    ponder_hint: tuple
+    ponder_engine: UciEngine
+    ponder_search: UciSearch
+    ponder_fen: str
+    ponder_limits: SearchLimits
+    active_search: UciSearch
 
-    def __init__(self):
+    def __init__(self, engine_pool: EnginePool = None, book_path: str = None, cache_path: str = None):
+        # book_path and cache_path default to the class settings, "" runs without a book or result file
+        if book_path is not None:
+            self.book_path = book_path
+        if cache_path is not None:
+            self.cache_path = cache_path
         self.board = chess.Board()
         self.computer_color = chess.BLACK
         self.player_color = chess.WHITE
         self.next_computer_move = None
         self.next_player_move = None
-        self.computer = stockfish.Stockfish(path=self.stockfish_path, depth=self.stockfish_depth)
-
+        # Sessions on the same host share warm engines through a pool, otherwise use a private one.
+        # It starts in the background, the first search waits for it only if it is not ready yet.
+        if engine_pool is None:
+            engine_pool = EnginePool(size=1, path=self.stockfish_path, depth=self.stockfish_depth, background=True)
+        self.engine_pool = engine_pool
+        self.elo = -1  # Full strength until set_elo is called
+        self.book = OpeningBook(self.book_path)
+        self.cache = EngineCache(filename=self.cache_path or None)
+        self.budget = LatencyBudget()
+        self.last_search_stats = None
+        self.candidate_moves = []
+        self.version = 0  # Bumped on every board change
+        self.snapshot = None
+        self.board_listeners = []
+        self.ponder_hint = None    # (FEN after the last engine move, reply the engine expects)
+        self.ponder_engine = None  # Engine checked out for the running ponder search
+        self.ponder_search = None
+        self.ponder_fen = None     # Position the ponder search is about
+        self.ponder_limits = None
+        self.active_search = None  # Search get_best_move_for waits for, stop_search may come from another thread
 
     def set_elo(self, elo: int):
-        self.computer.set_elo_rating(elo)
+        # Applied to whichever pooled engine runs this session's next search
+        self.elo = elo
 
     def set_player_color(self, color: chess.Color):
         self.player_color = color
@@ -45,21 +133,212 @@ class CNChess:
         return self.next_computer_move
     
     def get_next_best_move(self):
-        print("Calculating next best move...")
-        self.computer.set_fen_position(self.board.fen())
-        best_move_uci = self.computer.get_best_move()
-        if best_move_uci:
-            return chess.Move.from_uci(best_move_uci)
-        else:
+        return self.get_best_move_for(self.board)
+
+    def set_latency_target(self, seconds: float):
+        # Time from the player's move until the gantry has played the answer
+        self.budget.latency_target = seconds
+
+    def set_expected_motion_time(self, seconds: float):
+        # The gantry's share of the latency target, the search gets the rest
+        self.budget.expected_motion_time = seconds
+
+    def get_search_limits(self, board: chess.Board) -> SearchLimits:
+        if self.search_mode == "depth":
+            return SearchLimits(depth=self.stockfish_depth)
+        if self.search_mode == "nodes":
+            return SearchLimits(nodes=self.node_budget)
+        return self.budget.limits_for(board)
+
+    def get_search_stats(self) -> SearchStats:
+        return self.last_search_stats
+
+    def get_latency_percentile(self, percent: float = 95) -> float:
+        return self.budget.percentile(percent)
+
+    def get_candidate_moves(self) -> list[chess.Move]:
+        # Likely answers of the running search, best first
+        return list(self.candidate_moves)
+
+    @metrics.timed("engine.search")
+    def get_best_move_for(self, position, on_candidates=None):
+        # Searches any position without touching self.board, so it can run from a worker thread.
+        # position is a FEN or a chess.Board; a board's move history lets the engine keep its hash warm.
+        # on_candidates(moves) is called with the likely answers while the search runs, from the
+        # engine's reader thread; the search then keeps candidate_count lines (MultiPV) for them.
+        started = time.perf_counter()
+        board = position.copy() if isinstance(position, chess.Board) else chess.Board(position)
+        pondered_move = self._finish_ponder(board, started)
+        if pondered_move is not None:
+            return pondered_move
+        book_move = self.book.get_move(board)
+        if book_move is not None:
+            self._record_search(SearchStats("book"), started)
+            return book_move
+        limits = self.get_search_limits(board)
+        cached_move = self.cache.get(board, limits.key(), self.elo, self._cache_samples())
+        if cached_move is not None:
+            self._record_search(SearchStats("cache"), started)
+            return cached_move
+
+        with self.engine_pool.checkout(self, self.elo) as engine:
+            engine.set_position(board)
+            if on_candidates is not None:
+                search = self._go(engine, limits, multipv=self.candidate_count,
+                                  on_info=self._candidate_listener(board, on_candidates))
+            else:
+                search = self._go(engine, limits)
+            self.active_search = search
+            try:
+                search.wait()
+            finally:
+                self.active_search = None
+        return self._search_done(board, limits, search, SearchStats("engine"), started)
+
+    def _cache_samples(self) -> int:
+        # A strength-limited engine picks its weaker moves at random, replaying only one would repeat its games
+        return 1 if self.elo is None or self.elo < 0 else self.limited_samples
+
+    def _go(self, engine: UciEngine, limits: SearchLimits, ponder: bool = False, multipv: int = 1,
+            on_info=None) -> UciSearch:
+        if limits.movetime_ms is not None:
+            return engine.go(movetime_ms=limits.movetime_ms, ponder=ponder, multipv=multipv, on_info=on_info)
+        if limits.nodes is not None:
+            return engine.go(nodes=limits.nodes, ponder=ponder, multipv=multipv, on_info=on_info)
+        return engine.go(depth=limits.depth or engine.depth, ponder=ponder, multipv=multipv,
+                         on_info=on_info)
+
+    def _search_done(self, board: chess.Board, limits: SearchLimits, search: UciSearch, stats: SearchStats,
+                     started: float) -> chess.Move:
+        if search.last_info is not None:
+            stats.parse_info(search.last_info.line)
+        self._record_search(stats, started)
+        if not search.best_move:
             return chess.Move.null()
+        best_move = chess.Move.from_uci(search.best_move)
+        if not search.stopped:
+            # A stopped search did not finish its budget, its move is not worth replaying
+            self.cache.put(board, limits.key(), self.elo, best_move)
+        # The engine's expected reply is what start_ponder thinks about on the opponent's time
+        board.push(best_move)
+        self.ponder_hint = (board.fen(), search.ponder_move) if search.ponder_move else None
+        return best_move
+
+    def _candidate_listener(self, board: chess.Board, on_candidates):
+        # on_info for the search: once every MultiPV line reached candidate_depth, their first moves
+        # are announced, a single time per search
+        line_count = min(self.candidate_count, board.legal_moves.count())
+        first_moves = {}  # MultiPV rank -> first move of its line
+        announced = []
+
+        def on_info(info: UciInfo):
+            if announced or not info.pv or info.bound is not None or info.depth < self.candidate_depth:
+                return
+            first_moves[info.multipv] = info.pv[0]
+            if len(first_moves) == line_count:
+                announced.append(True)
+                self.candidate_moves = [chess.Move.from_uci(first_moves[rank]) for rank in sorted(first_moves)]
+                on_candidates(self.get_candidate_moves())
+        return on_info
+
+    def start_ponder(self, position) -> bool:
+        # Searches the engine's expected reply to its last move on the opponent's time ("go ponder").
+        # The next get_best_move_for sends ponderhit when the opponent played it, and stops it otherwise.
+        board = position.copy() if isinstance(position, chess.Board) else chess.Board(position)
+        self.stop_ponder()
+        if self.ponder_hint is None or self.ponder_hint[0] != board.fen() or board.is_game_over():
+            return False
+        reply = chess.Move.from_uci(self.ponder_hint[1])
+        if not board.is_legal(reply):
+            return False
+        board.push(reply)
+        if board.is_game_over() or self.book.get_move(board) is not None:
+            return False
+        limits = self.get_search_limits(board)
+        engine = self.engine_pool.acquire(self)
+        try:
+            self.engine_pool.configure(engine, self, self.elo)
+            engine.set_position(board)
+            self.ponder_search = self._go(engine, limits, ponder=True)
+        except Exception:
+            self.engine_pool.release(engine)
+            raise
+        self.ponder_engine = engine
+        self.ponder_fen = board.fen()
+        self.ponder_limits = limits
+        return True
+
+    def stop_search(self):
+        # Cuts the running search short, e.g. when its result is no longer wanted; thread-safe
+        search = self.active_search
+        if search is not None:
+            search.stop()
+
+    def stop_ponder(self):
+        # Drops the ponder search, e.g. because the opponent played another move
+        if self.ponder_engine is None:
+            return
+        self.ponder_search.stop()
+        self.ponder_search.wait()
+        self.engine_pool.release(self.ponder_engine)
+        self.ponder_engine = None
+        self.ponder_search = None
+        self.ponder_fen = None
+
+    def _finish_ponder(self, board: chess.Board, started: float) -> chess.Move:
+        # Best move from the ponder search when it was about this position, None otherwise
+        if self.ponder_engine is None or self.ponder_fen != board.fen():
+            self.stop_ponder()
+            return None
+        engine, search = self.ponder_engine, self.ponder_search
+        search.ponderhit()
+        search.wait()
+        self.engine_pool.release(engine)
+        self.ponder_engine = None
+        self.ponder_search = None
+        self.ponder_fen = None
+        return self._search_done(board, self.ponder_limits, search, SearchStats("ponder"), started)
+
+    def _record_search(self, stats: SearchStats, started: float):
+        stats.wall_time = time.perf_counter() - started
+        self.last_search_stats = stats
+        self.budget.record(stats)
 
     def make_move(self, move):
-        print(f"Executing move: {move}")
+        pieces = self.board.piece_map()
         self.board.push(move)
+        self._board_changed(pieces)
     
     def get_board_state(self):
         return self.board.fen()
 
+    def get_board(self):
+        return self.board
+
+    def get_version(self) -> int:
+        return self.version
+
+    def get_snapshot(self) -> BoardSnapshot:
+        # Built at most once per board version
+        if self.snapshot is None or self.snapshot.version != self.version:
+            self.snapshot = BoardSnapshot(self.board, self.version)
+        return self.snapshot
+
+    def add_board_listener(self, listener):
+        # listener(version, changed squares as a chess.SquareSet) is called after every board change
+        self.board_listeners.append(listener)
+
+    def remove_board_listener(self, listener):
+        self.board_listeners.remove(listener)
+
+    def _board_changed(self, old_pieces: dict[chess.Square, chess.Piece]):
+        new_pieces = self.board.piece_map()
+        changed = chess.SquareSet(square for square in old_pieces.keys() | new_pieces.keys()
+                                  if old_pieces.get(square) != new_pieces.get(square))
+        self.version += 1
+        for listener in list(self.board_listeners):
+            listener(self.version, changed)
+
     def validate_move(self, move):
         return self.board.is_legal(move)
     
@@ -68,7 +347,11 @@ class CNChess:
     
     def reset_game(self):
         print("Resetting the game...")
+        pieces = self.board.piece_map()
         self.board.reset()
+        self.ponder_hint = None
+        self.engine_pool.new_game(self)
+        self._board_changed(pieces)
 
     def get_turn(self):
         # print("Current turn:", "White" if self.board.turn == chess.WHITE else "Black")
@@ -2,10 +2,17 @@
 
 # It will take a chess move and transform it into physical actions and send it via serial bus
 
-from time import time
+import heapq
+import itertools
+import math
 import numpy as np
 import chess
 import serial
+from PathCache import PathCache, CachedPath
+from Graveyard import Graveyard
+from MotionLink import MotionLink, Segment
+from MotionProfile import junction_speed, segment_time, segment_times
+from Metrics import metrics
 
 # Here is all the object for a* pathfinding algorithm
 class Position:
@@ -30,167 +37,461 @@ class Command:
         self.magnet_state = magnet_state
 
 
-class Node:
+class Leg:
+    # One magnet-on transfer of a single piece, part of a compiled chess move
+    start: Position
+    end: Position
+    piece: chess.Piece
+    path: list[Position]
+    duration: float
+
+    def __init__(self, start: Position, end: Position, piece: chess.Piece = None):
+        self.start = start
+        self.end = end
+        self.piece = piece
+        self.path = []
+        self.duration = 0.0  # Estimated seconds for the transfer, once planned
+
+
+# Cost of one half-step move on the roadmap, in board squares
+STRAIGHT_COST = 0.5
+DIAGONAL_COST = 0.5 * math.sqrt(2)
+# Roadmap moves in half-steps (column, row), indexed by direction number
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1),
+              (-1, -1), (-1, 1), (1, -1), (1, 1)]
+# Closest a smoothed segment may pass to an occupied square center, in board squares.
+# Half a square is what the grid lanes between two neighboring pieces already allow.
+SMOOTHING_CLEARANCE = 0.5
+
+
+def castling_squares(board: chess.Board, move: chess.Move) -> tuple[chess.Square, chess.Square, chess.Square]:
+    # (king target, rook origin, rook target) of a castling move on `board`, the position before it.
+    # Standard castling gives the king's target, chess960 castling gives the rook's square.
+    rank = chess.square_rank(move.from_square)
+    kingside = board.is_kingside_castling(move)
+    if board.color_at(move.to_square) == board.turn:
+        rook_from = move.to_square
+    else:
+        rook_from = chess.square(7 if kingside else 0, rank)
+    return chess.square(6 if kingside else 2, rank), rook_from, chess.square(5 if kingside else 3, rank)
+
+
+class DistanceCost:
+    # Planner objective: path length in board squares
+    name: str = "distance"
+    turn_penalty: float = 0.0
+    step_costs: list[float]
 
-    position: Position
-    gCost: float
-    hCost: float
-    fCost: float
-    parent: 'Node'
-    neighbors: list['Node']
+    def __init__(self):
+        self.step_costs = [DIAGONAL_COST if d_col and d_row else STRAIGHT_COST for d_col, d_row in DIRECTIONS]
 
-    def __init__(self, position: Position = Position(0.0, 0.0)):
-        self.position = position
-        self.gCost = 0.0
-        self.hCost = 0.0
-        self.fCost = 0.0
-        self.parent = None
-        self.neighbors = []
+    def heuristic(self, d_col: int, d_row: int) -> float:
+        # Octile distance over half-steps, exact on an obstacle-free 8-connected grid
+        return STRAIGHT_COST * (d_col + d_row) + (DIAGONAL_COST - 2 * STRAIGHT_COST) * min(d_col, d_row)
 
-    def __eq__(self, value):
-        return self.position == value.position
+    def segment_cost(self, a: Position, b: Position) -> float:
+        return math.dist((a.x, a.y), (b.x, b.y))
 
-    def __hash__(self):
-        # Hash by position so Nodes can live in sets/dicts during pathfinding
-        return hash(self.position)
+    def path_cost(self, path: list[Position]) -> float:
+        cost = 0.0
+        for i in range(1, len(path)):
+            cost += self.segment_cost(path[i - 1], path[i])
+        return cost
+
+
+class MotorTimeCost(DistanceCost):
+    # Planner objective: seconds of motor time.
+    # Motor 1 turns with x+y and motor 2 with x-y, so the busier motor needs
+    # steps_per_square * (|dx| + |dy|) steps and straight moves are twice as fast as diagonals.
+    # The firmware runs through corners at the speed MotionProfile allows and only stops where the
+    # magnet switches, so a turn costs the time lost slowing down to the corner speed and back.
+    name: str = "motor_time_chained"
+    steps_per_square: float
+    max_speed: float
+    acceleration: float
+    max_jump: float
+    turn_costs: list[list[float]]
+
+    def __init__(self, steps_per_square: float, max_speed: float, acceleration: float, max_jump: float = 0.0):
+        self.steps_per_square = steps_per_square
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.max_jump = max_jump
+        self.cruise = steps_per_square / max_speed  # Seconds per square of |dx| + |dy| at full speed
+        self.turn_penalty = max_speed / acceleration  # Extra seconds of a full speed trapezoid
+        self.step_costs = [self.cruise * 0.5 * (abs(d_col) + abs(d_row)) for d_col, d_row in DIRECTIONS]
+        # Extra seconds when a straight run in one direction turns into the next, the last row starting from rest
+        directions = [(d_col + d_row, d_col - d_row, True) for d_col, d_row in DIRECTIONS]
+        self.turn_costs = [[self.turn_penalty * (1 - junction_speed(a, b, max_speed, max_jump) / max_speed) ** 2
+                            for b in directions] for a in directions]
+        self.turn_costs.append([self.turn_penalty] * len(DIRECTIONS))
+
+    def heuristic(self, d_col: int, d_row: int) -> float:
+        return self.cruise * 0.5 * (d_col + d_row)
+
+    def steps(self, a: Position, b: Position) -> float:
+        return self.steps_per_square * (abs(b.x - a.x) + abs(b.y - a.y))
+
+    def segment_cost(self, a: Position, b: Position) -> float:
+        # Trapezoid from and back to standstill, a triangle when max speed is never reached
+        return segment_time(self.steps(a, b), 0.0, 0.0, self.max_speed, self.acceleration)
+
+    def segment_times(self, path: list[Position], magnets: list[bool] = None) -> list[float]:
+        # Seconds of each segment of a path run in one go, stopping only where the magnet switches
+        if magnets is None:
+            magnets = [True] * (len(path) - 1)
+        segments = [(self.steps_per_square * (b.x - a.x + b.y - a.y), self.steps_per_square * (b.x - a.x - b.y + a.y),
+                     magnet) for a, b, magnet in zip(path, path[1:], magnets)]
+        return segment_times(segments, self.max_speed, self.acceleration, self.max_jump)
+
+    def path_cost(self, path: list[Position]) -> float:
+        return sum(self.segment_times(path))
+
+
+class Roadmap:
+    # Static half-step graph: node ids, coordinates and the neighbor table.
+    # It never changes, so it is built once per grid size and shared by every Grid.
+    # `margin` half-step lanes run around the board's edge lanes, off the board.
+    width: int
+    height: int
+    margin: int
+    size: int
+    cols: list[int]
+    rows: list[int]
+    positions: list[Position]
+    neighbors: list[tuple[tuple[int, int], ...]]
+    squares: list[int]
+    square_nodes: list[int]
+    slot_nodes: list[int]
+
+    _shared: dict[tuple[int, int, int], 'Roadmap'] = {}
+
+    def __init__(self, width: int, height: int, margin: int = 0):
+        self.width = width
+        self.height = height
+        self.margin = margin
+        self.size = width * height
+        self.cols = [node_id % width for node_id in range(self.size)]
+        self.rows = [node_id // width for node_id in range(self.size)]
+        # Use half-step coordinates so intermediate nodes land between board squares
+        self.positions = [Position((col - margin + 1) / 2, (row - margin + 1) / 2)
+                          for col, row in zip(self.cols, self.rows)]
+
+        # Board square under each node (-1 between squares) and the node at each square center
+        board_width = width - 2 * margin
+        board_height = height - 2 * margin
+        files = (board_width - 1) // 2
+        self.squares = [-1] * self.size
+        self.square_nodes = [-1] * (files * ((board_height - 1) // 2))
+        for node_id in range(self.size):
+            col = self.cols[node_id] - margin
+            row = self.rows[node_id] - margin
+            if 0 <= col < board_width and 0 <= row < board_height and col % 2 == 1 and row % 2 == 1:
+                square = (row // 2) * files + col // 2
+                self.squares[node_id] = square
+                self.square_nodes[square] = node_id
+
+        # Graveyard slots: outermost nodes level with a rank or file. They are numbered after the board
+        # squares so parked pieces share the occupancy bitboard, squares and square_nodes included.
+        self.slot_nodes = []
+        for node_id in range(self.size):
+            col = self.cols[node_id]
+            row = self.rows[node_id]
+            level_with_rank = 0 <= row - margin < board_height and (row - margin) % 2 == 1
+            level_with_file = 0 <= col - margin < board_width and (col - margin) % 2 == 1
+            on_side = col in (0, width - 1) and level_with_rank
+            on_end = row in (0, height - 1) and level_with_file
+            if on_side or on_end:
+                self.slot_nodes.append(node_id)
+                self.squares[node_id] = len(self.square_nodes)
+                self.square_nodes.append(node_id)
+
+        # (neighbor id, direction number) for every move, diagonals included
+        self.neighbors = []
+        for node_id in range(self.size):
+            col = self.cols[node_id]
+            row = self.rows[node_id]
+            links = []
+            for direction, (d_col, d_row) in enumerate(DIRECTIONS):
+                n_col = col + d_col
+                n_row = row + d_row
+                if 0 <= n_col < width and 0 <= n_row < height:
+                    links.append((n_row * width + n_col, direction))
+            self.neighbors.append(tuple(links))
+
+    @classmethod
+    def shared(cls, width: int, height: int, margin: int = 0) -> 'Roadmap':
+        roadmap = cls._shared.get((width, height, margin))
+        if roadmap is None:
+            roadmap = cls(width, height, margin)
+            cls._shared[(width, height, margin)] = roadmap
+        return roadmap
 
 
 class Grid:   
-    nodes: list[list[Node]]
+    roadmap: Roadmap
+    cost_model: DistanceCost
+    blocked: bytearray
+    occupancy: int
     width: int
     height: int
+    margin: int
     obstacle_remove_position: Position
 
-    def __init__(self, width: int, height: int):
-        self.obstacle_remove_position = Position(8.5, 4.5)  # Position to remove obstacle for captured pieces
-        self.width = width * 2 + 1
-        self.height = height * 2 + 1
-        # Use half-step coordinates so intermediate nodes land between board squares
-        self.nodes = [[Node(Position((x + 1) / 2, (y + 1) / 2)) for x in range(self.width)] for y in range(self.height)]
-    
-    def get_node(self, position: Position) -> Node:
-        if position.x < 0.5 or position.x > self.width/2 or position.y < 0.5 or position.y > self.height/2:
-            return None
-        return self.nodes[int(position.y*2)-1][int(position.x*2)-1]
+    def __init__(self, width: int, height: int, margin: int = 1):
+        # One lane around the board holds the graveyard slots, half a square off the board's edge
+        self.margin = margin
+        self.width = width * 2 + 1 + 2 * margin
+        self.height = height * 2 + 1 + 2 * margin
+        self.roadmap = Roadmap.shared(self.width, self.height, margin)
+        # Spare pieces, and captured pieces once the graveyard is full: the far corner, clear of every slot
+        self.obstacle_remove_position = self.get_position(self.width - 1)
+        self.cost_model = DistanceCost()
+        # One byte per roadmap node, non-zero when a piece sits on it
+        self.blocked = bytearray(self.roadmap.size)
+        # Same obstacles as a bitboard over the board squares (bit = chess square index),
+        # graveyard slots above bit 63
+        self.occupancy = 0
     
-    def get_neighbors(self, node: Node) -> list[Node]:
-        neighbors = []
-        # direction with diagonals
-        directions = [(-0.5, 0), (0.5, 0), (0, -0.5), (0, 0.5),
-                      (-0.5, -0.5), (-0.5, 0.5), (0.5, -0.5), (0.5, 0.5)]
-
-        for direction in directions:
-            neighbor_x = node.position.x + direction[0]
-            neighbor_y = node.position.y + direction[1]
-            neighbor_node = self.get_node(Position(neighbor_x, neighbor_y))
-            if neighbor_node is not None:
-                neighbors.append(neighbor_node)
-
-        return neighbors
-    
-    def add_link(self, from_node: Node, to_node: Node):
-        from_node.neighbors.append(to_node)
+    def get_node_id(self, position: Position) -> int:
+        low = (1 - self.margin) / 2
+        if (position.x < low or position.x > (self.width - self.margin) / 2
+                or position.y < low or position.y > (self.height - self.margin) / 2):
+            return -1
+        return (int(position.y*2)-1+self.margin) * self.width + int(position.x*2)-1+self.margin
 
-    def initialize_links(self):
-        for i in range(self.height):
-            for j in range(self.width):
-                node = self.nodes[i][j]
-                node.neighbors = self.get_neighbors(node)
+    def get_position(self, node_id: int) -> Position:
+        return self.roadmap.positions[node_id]
 
     def add_obstacle(self, position: Position):
-        node = self.get_node(position)
-        if node:
-            node.neighbors = []  # Remove all neighbors to create an obstacle
+        node_id = self.get_node_id(position)
+        if node_id >= 0:
+            self.blocked[node_id] = 1
+            square = self.roadmap.squares[node_id]
+            if square >= 0:
+                self.occupancy |= 1 << square
     
     def remove_obstacle(self, position: Position):
-        node = self.get_node(position)
-        if node:
-            node.neighbors = self.get_neighbors(node)  # Restore neighbors to remove obstacle
+        node_id = self.get_node_id(position)
+        if node_id >= 0:
+            self.blocked[node_id] = 0
+            square = self.roadmap.squares[node_id]
+            if square >= 0:
+                self.occupancy &= ~(1 << square)
+
+    def heuristic(self, node_id: int, goal_id: int) -> float:
+        d_col = abs(self.roadmap.cols[node_id] - self.roadmap.cols[goal_id])
+        d_row = abs(self.roadmap.rows[node_id] - self.roadmap.rows[goal_id])
+        return self.cost_model.heuristic(d_col, d_row)
+
+    def has_line_of_sight(self, a: Position, b: Position, ignore: int = 0) -> bool:
+        # True when segment a-b keeps SMOOTHING_CLEARANCE from every occupied square not in `ignore`
+        occupied = self.occupancy & ~ignore
+        d_x = b.x - a.x
+        d_y = b.y - a.y
+        length_sq = d_x * d_x + d_y * d_y
+        limit_sq = SMOOTHING_CLEARANCE * SMOOTHING_CLEARANCE - 1e-9
+        positions = self.roadmap.positions
+        square_nodes = self.roadmap.square_nodes
+        while occupied:
+            lowest = occupied & -occupied
+            center = positions[square_nodes[lowest.bit_length() - 1]]
+            occupied ^= lowest
+            # Distance from the square center to the closest point of the segment
+            t = 0.0
+            if length_sq > 0:
+                t = min(1.0, max(0.0, ((center.x - a.x) * d_x + (center.y - a.y) * d_y) / length_sq))
+            c_x = a.x + t * d_x - center.x
+            c_y = a.y + t * d_y - center.y
+            if c_x * c_x + c_y * c_y < limit_sq:
+                return False
+        return True
 
-    def heuristic(a: Node, b: Node) -> float:
-        return np.sqrt((a.position.x - b.position.x) ** 2 + (a.position.y - b.position.y) ** 2)
+    def smooth_path(self, path: list[Position]) -> list[Position]:
+        # Greedy string pulling: keep a waypoint only where the straight line would lose clearance.
+        # Collinear runs collapse too, since they are always in sight of each other.
+        if len(path) < 3:
+            return list(path)
+        ignore = 0
+        for position in (path[0], path[-1]):
+            node_id = self.get_node_id(position)
+            square = self.roadmap.squares[node_id] if node_id >= 0 else -1
+            if square >= 0:
+                ignore |= 1 << square
+
+        smoothed = [path[0]]
+        anchor = 0
+        while anchor < len(path) - 1:
+            reach = anchor + 1
+            while reach + 1 < len(path) and self.has_line_of_sight(path[anchor], path[reach + 1], ignore):
+                reach += 1
+            smoothed.append(path[reach])
+            anchor = reach
+        return smoothed
+
+    def corridor_mask(self, start_id: int, end_id: int, cost: float) -> int:
+        # Squares through which a path could be strictly shorter than `cost`.
+        # Freeing a square outside this mask can never improve on a path of that cost.
+        # Every path pays turn_penalty to start from rest, so it is no slack for a detour.
+        bound = cost - self.cost_model.turn_penalty - 1e-9
+        mask = 0
+        for square, node_id in enumerate(self.roadmap.square_nodes):
+            if self.heuristic(start_id, node_id) + self.heuristic(node_id, end_id) < bound:
+                mask |= 1 << square
+        return mask
+
+    def path_mask(self, path: list[Position]) -> int:
+        # Squares a path passes through, excluding its goal (which may stay occupied)
+        mask = 0
+        for position in path[:-1]:
+            square = self.roadmap.squares[self.get_node_id(position)]
+            if square >= 0:
+                mask |= 1 << square
+        return mask
     
     def a_star(self, start_pos: Position, end_pos: Position) -> list[Position]:
-        start_node = self.get_node(start_pos)
-        end_node = self.get_node(end_pos)
-
-        if start_node is None or end_node is None:
-            return []
-
-        # Reset all node states to avoid stale data from previous searches
-        for row in self.nodes:
-            for node in row:
-                node.gCost = float('inf')
-                node.hCost = 0.0
-                node.fCost = float('inf')
-                node.parent = None
-
-        open_set = []
-        closed_set = set()
-
-        start_node.gCost = 0.0
-        start_node.fCost = Grid.heuristic(start_node, end_node)
-        open_set.append(start_node)
-
-        while open_set:
-            current_node = min(open_set, key=lambda node: node.fCost)
-
-            if current_node == end_node:
+        return self.search(start_pos, end_pos)[0]
+
+    @metrics.timed("planner.a_star")
+    def search(self, start_pos: Position, end_pos: Position) -> tuple[list[Position], float]:
+        # Returns the cheapest path under cost_model and its cost, ([], inf) when there is none
+        start_id = self.get_node_id(start_pos)
+        end_id = self.get_node_id(end_pos)
+
+        if start_id < 0 or end_id < 0:
+            return [], math.inf
+        return self._search(start_id, (end_id,), self.roadmap.cols[end_id], self.roadmap.rows[end_id],
+                            self.cost_model.heuristic)
+
+    @metrics.timed("planner.nearest")
+    def search_nearest(self, start_pos: Position, goal_ids) -> tuple[list[Position], float]:
+        # Cheapest path to whichever of the goal nodes is cheapest to reach, ([], inf) when none is.
+        # One Dijkstra search: without a single goal there is no heuristic to aim with.
+        start_id = self.get_node_id(start_pos)
+        goal_ids = frozenset(goal_ids)
+        if start_id < 0 or not goal_ids:
+            return [], math.inf
+        return self._search(start_id, goal_ids, 0, 0, lambda d_col, d_row: 0.0)
+
+    def _search(self, start_id: int, goal_ids, end_col: int, end_row: int, heuristic) -> tuple[list[Position], float]:
+        roadmap = self.roadmap
+        neighbors = roadmap.neighbors
+        cols = roadmap.cols
+        rows = roadmap.rows
+        blocked = self.blocked
+        model = self.cost_model
+        step_costs = model.step_costs
+        turn_penalty = model.turn_penalty
+        turn_costs = model.turn_costs if turn_penalty else None
+
+        # With a turn penalty a search state is (node, incoming direction), direction 8 meaning at rest
+        n_dirs = len(DIRECTIONS) + 1 if turn_penalty else 1
+        size = roadmap.size * n_dirs
+
+        # Search state lives in flat arrays indexed by state id, fresh for every search
+        g_cost = [math.inf] * size
+        parent = [-1] * size
+        closed = bytearray(size)
+
+        start_state = start_id * n_dirs + n_dirs - 1
+        g_cost[start_state] = 0.0
+        # Heap entries are (fCost, insertion order, state id); the counter keeps ties FIFO
+        open_heap = [(heuristic(abs(cols[start_id] - end_col), abs(rows[start_id] - end_row)), 0, start_state)]
+        counter = 1
+
+        while open_heap:
+            _, _, state = heapq.heappop(open_heap)
+            current = state // n_dirs
+
+            if current in goal_ids:
                 path = []
-                node = current_node
-                while node is not None:
-                    path.append(node.position)
-                    node = node.parent
-                return path[::-1]  # Return reversed path
-
-            open_set.remove(current_node)
-            closed_set.add(current_node)
-
-            for neighbor in current_node.neighbors:
-                if neighbor in closed_set:
+                path_state = state
+                while path_state >= 0:
+                    path.append(roadmap.positions[path_state // n_dirs])
+                    path_state = parent[path_state]
+                return path[::-1], g_cost[state]  # Return reversed path
+
+            if closed[state]:
+                continue  # Stale heap entry
+            closed[state] = 1
+
+            # An occupied node can be the goal but a piece cannot be crossed
+            if blocked[current]:
+                continue
+
+            current_g = g_cost[state]
+            incoming = state % n_dirs
+            for neighbor, direction in neighbors[current]:
+                if blocked[neighbor] and neighbor not in goal_ids:
                     continue
 
-                tentative_gCost = current_node.gCost + Grid.heuristic(current_node, neighbor)
-
-                if neighbor not in open_set:
-                    open_set.append(neighbor)
-                elif tentative_gCost >= neighbor.gCost:
+                tentative_gCost = current_g + step_costs[direction]
+                if turn_penalty:
+                    tentative_gCost += turn_costs[incoming][direction]  # Slowing down for the corner
+                    neighbor_state = neighbor * n_dirs + direction
+                else:
+                    neighbor_state = neighbor
+                if closed[neighbor_state] or tentative_gCost >= g_cost[neighbor_state]:
                     continue
 
-                neighbor.parent = current_node
-                neighbor.gCost = tentative_gCost
-                neighbor.hCost = Grid.heuristic(neighbor, end_node)
-                neighbor.fCost = neighbor.gCost + neighbor.hCost
+                parent[neighbor_state] = state
+                g_cost[neighbor_state] = tentative_gCost
+                hCost = heuristic(abs(cols[neighbor] - end_col), abs(rows[neighbor] - end_row))
+                heapq.heappush(open_heap, (tentative_gCost + hCost, counter, neighbor_state))
+                counter += 1
 
-        return []  # No path found
+        return [], math.inf  # No path found
     
     def update_obstacles(self, boardState: str):
-        board = chess.Board(boardState)
-        for i in range(8):
-            for j in range(8):
-                piece = board.piece_at(chess.square(i, j))
-                position = Position(i + 1, j + 1)
-                if piece is not None:
-                    self.add_obstacle(position)
-                else:
-                    self.remove_obstacle(position)
+        # Kept for FEN callers, prefer set_occupancy with a chess.Board
+        self.set_occupancy(chess.BaseBoard(boardState.split(' ')[0]))
+
+    def set_occupancy(self, occupied):
+        # Accepts a chess.Board, a chess.SquareSet or a raw bitboard; only changed squares are touched.
+        # Boards and square sets only cover the 64 squares, the graveyard slots are kept as they are.
+        if isinstance(occupied, chess.BaseBoard):
+            occupied = occupied.occupied | (self.occupancy & ~chess.BB_ALL)
+        elif isinstance(occupied, chess.SquareSet):
+            occupied = int(occupied) | (self.occupancy & ~chess.BB_ALL)
+        occupied = int(occupied)
+        changed = self.occupancy ^ occupied
+        square_nodes = self.roadmap.square_nodes
+        while changed:
+            lowest = changed & -changed
+            square = lowest.bit_length() - 1
+            self.blocked[square_nodes[square]] = 1 if occupied & lowest else 0
+            changed ^= lowest
+        self.occupancy = occupied
+
+    def apply_move(self, board: chess.Board, move: chess.Move):
+        # Update obstacles for a move about to be pushed on `board` (call before board.push)
+        cleared = chess.BB_SQUARES[move.from_square]
+        filled = chess.BB_SQUARES[move.to_square]
+        if board.is_castling(move):
+            king_to, rook_from, rook_to = castling_squares(board, move)
+            cleared |= chess.BB_SQUARES[rook_from]
+            filled = chess.BB_SQUARES[king_to] | chess.BB_SQUARES[rook_to]
+        elif board.is_en_passant(move):
+            captured = chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square))
+            cleared |= chess.BB_SQUARES[captured]
+        # Captures and promotions leave the destination occupied, nothing more to do
+        self.set_occupancy((self.occupancy & ~cleared) | filled)
 
     def print_grid(self):
         # inverted y-axis for printing
         for i in range(self.height-1, -1, -1):
             row = ""
             for j in range(self.width):
-                node = self.nodes[i][j]
-                if len(node.neighbors) == 0:
+                if self.blocked[i * self.width + j]:
                     row += " X "
                 else:
                     row += " . "
             print(row)
 
     def is_obstacle(self, position: Position) -> bool:
-        node = self.get_node(position)
-        if node:
-            return len(node.neighbors) == 0
+        node_id = self.get_node_id(position)
+        if node_id >= 0:
+            return self.blocked[node_id] != 0
         return False
 
 
@@ -198,57 +499,245 @@ class Control:
     SQUARE_SIZE_MM = 50.8  # Size of a chess square in millimeters
     STEP_ANGLE_DEGREES = 1.8  # Stepper motor step angle in degrees
     PULLEY_DIAMETER = 12.0  # Pulley diameter in millimeters
+    MAX_SPEED_STEPS = 1000.0  # Motor max speed in steps/s, as set in Embedded/src/main.cpp
+    ACCELERATION_STEPS = 500.0  # Motor acceleration in steps/s^2, as set in Embedded/src/main.cpp
+    JUNCTION_JUMP_STEPS = 200.0  # Speed change in steps/s a motor takes at a corner, as set in Embedded/src/main.cpp
     grid: Grid
+    motor_model: MotorTimeCost
+    estimated_move_time: float
+    path_cache: PathCache
+    graveyard: Graveyard
+    smooth_paths: bool
     mm_per_step: float
     circumference: float
     current_position: Position
+    step_matrix: np.ndarray
+    step_target: np.ndarray
+    step_position: np.ndarray
     ser: serial.Serial
+    link: MotionLink
 
-    def __init__(self):
+    def __init__(self, path_cache_file: str = None):
         self.circumference = np.pi * self.PULLEY_DIAMETER
         self.grid = Grid(8, 8)
-        self.grid.initialize_links()
+        # Steps of the busier motor per square of |dx| + |dy|, see convert_to_step
+        steps_per_square = 360 * self.SQUARE_SIZE_MM / (self.circumference * math.sqrt(2) * self.STEP_ANGLE_DEGREES)
+        self.motor_model = MotorTimeCost(steps_per_square, self.MAX_SPEED_STEPS, self.ACCELERATION_STEPS,
+                                         self.JUNCTION_JUMP_STEPS)
+        self.grid.cost_model = self.motor_model  # Plan for the path that finishes soonest
+        self.estimated_move_time = 0.0
+        self.path_cache = PathCache(filename=path_cache_file, namespace=self.motor_model.name)
+        self.graveyard = Graveyard(self.grid, self.grid.obstacle_remove_position)
+        self.smooth_paths = True  # Merge grid waypoints into straight segments before sending them
         self.current_position = Position(0, 0)  # Start at home position
-        # self.ser = serial.Serial('COM3', 115200, timeout=1)
-        # time.sleep(2) # attendre reset Arduino
+        # convert_to_step as a matrix: motor steps = step_matrix @ (x, y) in millimeters from home
+        steps_per_mm = 360 / (self.circumference * math.sqrt(2) * self.STEP_ANGLE_DEGREES)
+        self.step_matrix = np.array([[-steps_per_mm, -steps_per_mm], [-steps_per_mm, steps_per_mm]])
+        self.step_target = np.zeros(2)  # Exact motor position wanted, in fractional steps from home
+        self.step_position = np.zeros(2, dtype=np.int64)  # Whole steps sent to the motors, from home
+        self.ser = None
+        self.link = None
+
+    def connect(self, port: str = 'COM3', baudrate: int = 115200):
+        # Short read timeout so the link can resend lost frames without blocking for long
+        self.ser = serial.Serial(port, baudrate, timeout=0.1)
+        self.link = MotionLink(self.ser)
+        return self.link.reset()  # Also waits out the board reset on connection
     
-    def update_board_state(self, boardState: str):
-        self.grid.update_obstacles(boardState)
+    def set_cost_model(self, cost_model: DistanceCost):
+        # Cached paths were optimal for the previous objective only
+        self.grid.cost_model = cost_model
+        self.path_cache.clear()
+        self.path_cache.namespace = cost_model.name
+
+    def update_board_state(self, boardState):
+        # Accepts a chess.Board or SquareSet directly, FEN strings are still supported
+        if isinstance(boardState, str):
+            self.grid.update_obstacles(boardState)
+        else:
+            self.grid.set_occupancy(boardState)
+
+    def apply_move(self, board: chess.Board, move: chess.Move, by_gantry: bool = True):
+        # Incremental obstacle update, call before the move is pushed on `board`.
+        # Only the gantry parks pieces in the graveyard: a player's captures and promotions are
+        # made by hand, the slots stay as they are.
+        if not by_gantry:
+            self.grid.apply_move(board, move)
+            return
+        parked, released = self._graveyard_plan(move, board)
+        self.grid.apply_move(board, move)
+        self.graveyard.commit([(slot, piece) for slot, piece, _ in parked], released)
     
-    def get_path(self, move: chess.Move) -> list[Command]:
-        start_x = chess.square_file(move.from_square) + 1
-        start_y = chess.square_rank(move.from_square) + 1
-        end_x = chess.square_file(move.to_square) + 1
-        end_y = chess.square_rank(move.to_square) + 1
-
-        # Pathfinding expects 1-based board coordinates to align with 0.5 grid offsets
-        start_pos = Position(start_x, start_y)
-        end_pos = Position(end_x, end_y)
+    def find_path(self, start_pos: Position, end_pos: Position) -> list[Position]:
+        start_id = self.grid.get_node_id(start_pos)
+        end_id = self.grid.get_node_id(end_pos)
+        if start_id < 0 or end_id < 0:
+            return []
 
-        self.grid.remove_obstacle(start_pos)  # Ensure start position is not an obstacle
+        occupancy = self.grid.occupancy
+        cached = self.path_cache.lookup(start_id, end_id, occupancy)
+        if cached is not None:
+            return [self.grid.get_position(node_id) for node_id in cached.path]
 
-        path_to_obstacle_removal = []
-        if self.grid.is_obstacle(end_pos):
-            print("Obstacle detected at end position, planning path to obstacle removal point.")
-            self.grid.remove_obstacle(end_pos)
-            path_to_obstacle_removal = self.grid.a_star(end_pos, self.grid.obstacle_remove_position)
+        path, cost = self.grid.search(start_pos, end_pos)
+        entry = CachedPath(tuple(self.grid.get_node_id(pos) for pos in path), occupancy,
+                           self.grid.path_mask(path), self.grid.corridor_mask(start_id, end_id, cost))
+        self.path_cache.store(start_id, end_id, entry)
+        return path
 
-        path = self.grid.a_star(start_pos, end_pos)
-        full_path = path_to_obstacle_removal + path
+    def square_position(self, square: chess.Square) -> Position:
+        # Pathfinding expects 1-based board coordinates to align with 0.5 grid offsets
+        return Position(chess.square_file(square) + 1, chess.square_rank(square) + 1)
+
+    def _graveyard_plan(self, move: chess.Move, board: chess.Board = None) -> tuple[list, int]:
+        # Pieces leaving the board as (slot, piece, position they leave from), slot -1 meaning the
+        # overflow point, and the slot the promoted piece is taken from (-1: spare pieces)
+        to_pos = self.square_position(move.to_square)
+        parked = []
+        released = -1
+        if board is not None and board.is_castling(move):
+            return parked, released
+
+        leaving = []
+        if board is not None and board.is_en_passant(move):
+            captured = chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square))
+            leaving.append((self.square_position(captured), board.piece_at(captured)))
+        elif self.grid.is_obstacle(to_pos):
+            leaving.append((to_pos, board.piece_at(move.to_square) if board is not None else None))
+        moving = board.piece_at(move.from_square) if board is not None else None
+        if move.promotion:
+            leaving.append((self.square_position(move.from_square), moving))
+            if moving is not None:
+                released = self.graveyard.find_piece(chess.Piece(move.promotion, moving.color), to_pos)
+
+        taken = set()
+        for position, piece in leaving:
+            slot = self.graveyard.choose_slot(position, taken)
+            taken.add(slot)
+            parked.append((slot, piece, position))
+        return parked, released
+
+    def get_legs(self, move: chess.Move, board: chess.Board = None) -> list[Leg]:
+        # Unordered transfers needed to play `move`, board is the position before the move
+        from_pos = self.square_position(move.from_square)
+        to_pos = self.square_position(move.to_square)
+        moving = board.piece_at(move.from_square) if board is not None else None
+        legs = []
+
+        if board is not None and board.is_castling(move):
+            king_to, rook_from, rook_to = castling_squares(board, move)
+            if king_to != move.from_square:
+                legs.append(Leg(from_pos, self.square_position(king_to), moving))
+            if rook_to != rook_from:
+                legs.append(Leg(self.square_position(rook_from), self.square_position(rook_to), board.piece_at(rook_from)))
+            return legs
+
+        # Captured pieces, and a promoting pawn, go to their graveyard slots
+        parked, released = self._graveyard_plan(move, board)
+        for slot, piece, position in parked:
+            legs.append(Leg(position, self.graveyard.position(slot), piece))
+
+        if move.promotion:
+            # The promoted piece comes back from the graveyard, or from the spare pieces
+            color = moving.color if moving is not None else None
+            promoted = chess.Piece(move.promotion, color) if color is not None else None
+            legs.append(Leg(self.graveyard.position(released), to_pos, promoted))
+        else:
+            legs.append(Leg(from_pos, to_pos, moving))
+        return legs
+
+    def compile_move(self, move: chess.Move, board: chess.Board = None) -> list[Leg]:
+        # Order the legs so that the whole move, including empty-handed hops, is as short as possible
+        legs = self.get_legs(move, board)
+        saved_occupancy = self.grid.occupancy
+        best_cost = math.inf
+        best_legs = []
+        try:
+            for order in itertools.permutations(legs):
+                cost, planned = self._plan_legs(order, saved_occupancy)
+                if cost < best_cost:
+                    best_cost = cost
+                    best_legs = planned
+        finally:
+            self.grid.set_occupancy(saved_occupancy)
+        return best_legs
+
+    def _plan_legs(self, legs, occupancy: int) -> tuple[float, list[Leg]]:
+        # Simulate the board leg by leg; an ordering that lands on an occupied square is rejected
+        position = self.current_position
+        cost = 0.0
+        planned = []
+        for leg in legs:
+            start_id = self.grid.get_node_id(leg.start)
+            end_id = self.grid.get_node_id(leg.end)
+            start_square = self.grid.roadmap.squares[start_id] if start_id >= 0 else -1
+            end_square = self.grid.roadmap.squares[end_id] if end_id >= 0 else -1
+            if start_square >= 0:
+                occupancy &= ~(1 << start_square)
+            if end_square >= 0 and occupancy & (1 << end_square):
+                return math.inf, []
+
+            self.grid.set_occupancy(occupancy)
+            path = self.find_path(leg.start, leg.end)
+            if not path:
+                return math.inf, []
+            if self.smooth_paths:
+                path = self.grid.smooth_path(path)
+            if end_square >= 0:
+                occupancy |= 1 << end_square
+
+            # Empty-handed hops go straight under the pieces
+            planned_leg = Leg(leg.start, leg.end, leg.piece)
+            planned_leg.path = path
+            planned_leg.duration = self.motor_model.path_cost(path)
+            cost += self.motor_model.segment_cost(position, leg.start) + planned_leg.duration
+            planned.append(planned_leg)
+            position = leg.end
+        return cost, planned
+
+    def preplan(self, candidates: list[chess.Move], board: chess.Board = None) -> Position:
+        # Plans the likely engine answers (best first) ahead of time, which also fills the path cache,
+        # and returns where the gantry should wait so that the real move starts soonest on average
+        pickups = []
+        weights = []
+        for rank, move in enumerate(candidates):
+            legs = self.compile_move(move, board)
+            if legs:
+                pickups.append(legs[0].start)
+                weights.append(1.0 / (rank + 1))
+        if not pickups:
+            return self.current_position
+
+        total = sum(weights)
+        centroid = Position(sum(w * pos.x for w, pos in zip(weights, pickups)) / total,
+                            sum(w * pos.y for w, pos in zip(weights, pickups)) / total)
+        options = [centroid, self.current_position] + pickups
+        return min(options, key=lambda target: sum(w * self.motor_model.segment_cost(target, pos)
+                                                   for w, pos in zip(weights, pickups)))
+
+    def preposition(self, candidates: list[chess.Move], board: chess.Board = None) -> bool:
+        # Moves the empty gantry toward the likely pickup while the engine is still searching
+        target = self.preplan(candidates, board)
+        if self.link is None or target == self.current_position:
+            return False
+        return self.run_path([Command(target, False)])
 
-        # Convert path to commands with magnet states
+    @metrics.timed("planner.compile")
+    def get_path(self, move: chess.Move, board: chess.Board = None) -> list[Command]:
+        # Convert legs to commands; the magnet state applies while leaving each position
         commands = []
-        for i, pos in enumerate(full_path):
-            if i == 0:
-                # Turn magnet on at start position
-                commands.append(Command(pos, True))
-            elif i == len(path_to_obstacle_removal) - 1:
-                # Turn magnet off at end position
-                commands.append(Command(pos, False))
-            else:
-                # Keep magnet on during movement
+        for leg in self.compile_move(move, board):
+            for pos in leg.path[:-1]:
                 commands.append(Command(pos, True))
+            commands.append(Command(leg.path[-1], False))
+        self.estimated_move_time = self.estimate_time(commands)
         return commands
+
+    def estimate_time(self, path: list[Command]) -> float:
+        # Seconds of motion to follow `path` from the current position, as the firmware chains the segments
+        waypoints = [self.current_position] + [cmd.position for cmd in path]
+        magnets = [False] + [cmd.magnet_state for cmd in path[:-1]]
+        return sum(self.motor_model.segment_times(waypoints, magnets))
     
     def print_path(self, path: list[Command]):
         for cmd in path:
@@ -256,66 +745,126 @@ class Control:
             print(f"({pos.x}, {pos.y})", end=" -> ")
         print("END")
 
-    def calculate_trajectory(self, path: list[Command]):
+    @metrics.timed("control.trajectory")
+    def calculate_trajectory(self, path: list[Command]) -> list[Command]:
+        # Relative moves in millimeters, each with the magnet state held during that move
         trajectory = []
-        path.insert(0, Command(self.current_position, False))  # Start from current position
-        for i in range(1, len(path)):
-            start = path[i - 1]
-            end = path[i]
+        start = Command(self.current_position, False)  # Start from current position
+        for end in path:
             delta_x = (end.position.x - start.position.x) * self.SQUARE_SIZE_MM
             delta_y = (end.position.y - start.position.y) * self.SQUARE_SIZE_MM
 
-            pos = Position(delta_x, delta_y)
-
-            trajectory.append(pos)
+            trajectory.append(Command(Position(delta_x, delta_y), start.magnet_state))
             self.current_position = end.position
+            start = end
         return trajectory 
 
+    @metrics.timed("control.compile_steps")
+    def compile_steps(self, path: list[Command]) -> tuple[np.ndarray, np.ndarray]:
+        # Whole path to int32 motor step deltas (n x 2) and the magnet state held during each one.
+        # Targets are rounded in absolute steps, so the rounding error never adds up between segments.
+        if not path:
+            return np.zeros((0, 2), dtype=np.int32), np.zeros(0, dtype=bool)
+        coords = np.array([(cmd.position.x, cmd.position.y) for cmd in path]) * self.SQUARE_SIZE_MM
+        magnets = np.array([False] + [cmd.magnet_state for cmd in path[:-1]])
+        self.current_position = path[-1].position
+        return self._quantize(coords @ self.step_matrix.T), magnets
+
+    def _quantize(self, targets: np.ndarray) -> np.ndarray:
+        # Absolute fractional step targets to whole step deltas from the last position sent
+        absolute = np.rint(targets).astype(np.int64)
+        deltas = np.diff(absolute, axis=0, prepend=self.step_position[np.newaxis, :])
+        self.step_target = targets[-1]
+        self.step_position = absolute[-1]
+        return deltas.astype(np.int32)
+
     def goHome(self):
         # Placeholder for homing procedure
         pass
 
-    def make_move(self, move:chess.Move):
+    def set_home(self):
+        # The gantry is known to be at home, e.g. after the motor controller was powered up
+        self.current_position = Position(0, 0)
+        self.step_target = np.zeros(2)
+        self.step_position = np.zeros(2, dtype=np.int64)
+
+    def motion_state(self) -> tuple:
+        # Where the gantry will be once everything compiled so far has run, for stopped_after
+        return self.current_position, self.step_target.copy(), self.step_position.copy()
+
+    def stopped_after(self, state: tuple, steps: np.ndarray, waypoints: list[Position], done: int):
+        # Motion compiled from `state` failed after `done` of its segments, waypoints[i] being where
+        # segment i ends. Positions are committed when motion is compiled, so take back what never ran.
+        position, step_target, step_position = state
+        if done <= 0:
+            self.current_position = position
+            self.step_target = step_target.copy()
+            self.step_position = step_position.copy()
+            return
+        self.current_position = waypoints[done - 1]
+        self.step_position = step_position + steps[:done].sum(axis=0, dtype=np.int64)
+        self.step_target = self.step_position.astype(float)
+
+    def make_move(self, move: chess.Move, board: chess.Board = None) -> bool:
+        return self.run_path(self.get_path(move, board))
+
+    def run_path(self, path: list[Command]) -> bool:
+        # Blocks until the controller ran the path; on failure Control keeps what it reported done
+        state = self.motion_state()
+        steps, magnets = self.compile_steps(path)
+        if self.run_steps(steps, magnets):
+            return True
+        self.stopped_after(state, steps, [cmd.position for cmd in path], self.link.segments_done)
+        return False
+
+    def run_trajectory(self, trajectory: list[Command]) -> bool:
+        # Relative moves in millimeters, as returned by calculate_trajectory
+        if not trajectory:
+            return True
+        state = self.motion_state()
+        deltas = np.array([(cmd.position.x, cmd.position.y) for cmd in trajectory])
+        targets = self.step_target + np.cumsum(deltas @ self.step_matrix.T, axis=0)
+        steps = self._quantize(targets)
+        if self.run_steps(steps, [cmd.magnet_state for cmd in trajectory]):
+            return True
+        # calculate_trajectory already moved current_position to the end, walk back from there
+        end = self.current_position
+        left = np.vstack([np.cumsum(deltas[::-1], axis=0)[::-1], np.zeros((1, 2))]) / self.SQUARE_SIZE_MM
+        positions = [Position(round(end.x - d_x, 6), round(end.y - d_y, 6)) for d_x, d_y in left.tolist()]
+        self.stopped_after((positions[0],) + state[1:], steps, positions[1:], self.link.segments_done)
+        return False
 
-        path = self.get_path(move)
-        traj = self.calculate_trajectory(path)
+    def run_steps(self, steps: np.ndarray, magnets) -> bool:
+        # Upload the whole move at once, the link keeps the controller's queue full
+        return self.link.run(self.make_segments(steps, magnets))
 
-        for pos in traj : 
-            self.go_to_position(pos)
+    @staticmethod
+    def make_segments(steps: np.ndarray, magnets) -> list[Segment]:
+        return [Segment(steps1, steps2, bool(magnet)) for (steps1, steps2), magnet in zip(steps.tolist(), magnets)]
             
     def go_to_position(self, pos:Position): 
 
-        step_motors = self.convert_to_step(pos)
-        self.send_command(step_motors)
+        return self.run_trajectory([Command(pos, False)])
         
 
     def convert_to_step(self, pos:Position) -> tuple:
+        # Fractional motor steps for a relative move in millimeters
+        step_mot1, step_mot2 = self.step_matrix @ (pos.x, pos.y)
+        return (float(step_mot1), float(step_mot2))
+
+    def send_command(self, steps: tuple, magnet_state: bool = False) -> bool:
+        # Single segment, waits until the controller reports it done; fractions carry to the next one
+        state = self.motion_state()
+        target = self.step_target + np.asarray(steps, dtype=float)
+        if self.run_steps(self._quantize(target[np.newaxis, :]), [magnet_state]):
+            return True
+        self.stopped_after(state, None, [], 0)
+        return False
 
-        rot_step1 = -360 * (pos.x + pos.y) / (self.circumference * np.sqrt(2))
-        rot_step2 = -((2*pos.x * 360/(self.circumference*np.sqrt(2))) + rot_step1)
-        step_mot1 = rot_step1 / self.STEP_ANGLE_DEGREES
-        step_mot2 = rot_step2 / self.STEP_ANGLE_DEGREES
-
-        return (step_mot1, step_mot2)
-
-    def send_command(self, steps: tuple):
-        self.ser.write(f"MOVE {int(steps[0])} {int(steps[1])}\n".encode('utf-8'))
-        start_time = time.time()
-        while self.ser.in_waiting == 0:
-            if time.time() - start_time > 30:
-                print("Error: No response from motor controller.")
-                return False
-            pass
-
-        response = self.ser.readline().decode('utf-8').strip()
-        if response != "DONE":
-            print("Error: Unexpected response from motor controller:", response)
-            return False
-        return True
-
-    def print_trajectory(self, trajectory: list[tuple[float, float]]):
-        for step in trajectory:
-            print(f"Motor1: {step[0]}, Motor2: {step[1]}")
+    def print_trajectory(self, trajectory: list[Command]):
+        for cmd in trajectory:
+            step = self.convert_to_step(cmd.position)
+            print(f"Motor1: {step[0]}, Motor2: {step[1]}, Magnet: {cmd.magnet_state}")
     
     
     
\ No newline at end of file
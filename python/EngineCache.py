@@ -0,0 +1,100 @@
+# This file holds the engine result cache used by CNChess.
+
+# Best moves are keyed by (Zobrist hash, search limits, Elo setting). Recent results stay in memory
+# with LRU eviction and every result is also written to a SQLite file so it survives restarts.
+# A key can hold several results: a strength-limited engine picks its weaker moves at random, so
+# CNChess keeps searching until it has a few results and then replays them as often as they came up.
+
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+
+
+def position_key(board: chess.Board) -> int:
+    # Polyglot Zobrist hash as a signed 64-bit integer so SQLite can store it
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class EngineCache:
+    capacity: int
+    filename: str
+    hits: int
+    misses: int
+    entries: OrderedDict
+
+    def __init__(self, capacity: int = 4096, filename: str = None):
+        self.capacity = capacity
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        # The engine runs on a worker thread, the GUI may read stats from another
+        self.lock = threading.Lock()
+        self.db = None
+        if filename is not None:
+            try:
+                self.db = sqlite3.connect(filename, check_same_thread=False)
+                self.db.execute("CREATE TABLE IF NOT EXISTS search_moves ("
+                                "position INTEGER, limits TEXT, elo INTEGER, move TEXT, count INTEGER, "
+                                "PRIMARY KEY (position, limits, elo, move))")
+                self.db.commit()
+            except sqlite3.Error as e:
+                print("Warning: engine cache disabled on disk:", e)
+                self.db = None
+
+    def get(self, board: chess.Board, limits: str, elo: int, samples: int = 1) -> chess.Move:
+        # A stored move, picked as often as the searches found it; None until `samples` results are stored
+        key = (position_key(board), limits, elo)
+        with self.lock:
+            counts = self._counts(key)
+            if sum(counts.values()) < samples:
+                self.misses += 1
+                return None
+            self.hits += 1
+            move_uci = random.choices(list(counts), weights=list(counts.values()))[0]
+        move = chess.Move.from_uci(move_uci)
+        # Guard against hash collisions
+        return move if board.is_legal(move) else None
+
+    def put(self, board: chess.Board, limits: str, elo: int, move: chess.Move):
+        key = (position_key(board), limits, elo)
+        with self.lock:
+            counts = self._counts(key)
+            counts[move.uci()] = counts.get(move.uci(), 0) + 1
+            self._remember(key, counts)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO search_moves VALUES (?, ?, ?, ?, ?)",
+                                key + (move.uci(), counts[move.uci()]))
+                self.db.commit()
+
+    def _counts(self, key: tuple) -> dict:
+        # Move -> number of searches that found it
+        counts = self.entries.get(key)
+        if counts is not None:
+            self.entries.move_to_end(key)
+            return counts
+        counts = {}
+        if self.db is not None:
+            rows = self.db.execute("SELECT move, count FROM search_moves WHERE position = ? AND limits = ? AND elo = ?",
+                                   key).fetchall()
+            counts = dict(rows)
+            if counts:
+                self._remember(key, counts)
+        return counts
+
+    def _remember(self, key: tuple, counts: dict):
+        self.entries[key] = counts
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
@@ -0,0 +1,177 @@
+# This file holds a pool of warm Stockfish processes shared by CNChess sessions.
+
+# Sessions check an engine out for one search. When every engine is busy, requests wait in one
+# queue per session and engines are handed out round-robin between sessions, so a busy session
+# cannot starve the others. Past max_waiting queued requests, checkout raises EnginePoolBusy.
+# With background=True the engines start on a thread and the first checkout waits for them only
+# if they are not up yet, so the application does not wait for Stockfish to start.
+# An engine keeps its hash between checkouts of the same session, ucinewgame is only sent when it
+# changes hands, so a game's searches build on each other.
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from UciEngine import UciEngine
+
+
+class EnginePoolBusy(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.engine = None
+
+
+class EnginePool:
+    size: int
+    threads: int
+    hash_mb: int
+    max_waiting: int
+    checkouts: int
+    waits: int
+    rejected: int
+    wait_time: float
+    start_time: float
+
+    def __init__(self, size: int = 1, threads: int = None, hash_mb: int = 16,
+                 path: str = "/usr/games/stockfish", depth: int = 10, max_waiting: int = 32,
+                 background: bool = False):
+        self.size = size
+        # Split the cores between engines instead of oversubscribing them
+        self.threads = threads or max(1, (os.cpu_count() or 1) // size)
+        self.hash_mb = hash_mb
+        self.depth = depth
+        self.max_waiting = max_waiting
+        self.checkouts = 0
+        self.waits = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.start_time = 0.0
+
+        self.lock = threading.Lock()
+        self.engines = []
+        self.idle = []
+        self.last_session = {}
+        self.waiting: OrderedDict = OrderedDict()  # session -> deque of waiters, in round-robin order
+        self.waiting_count = 0
+        self.started = threading.Event()
+        self.start_error = None
+        if background:
+            threading.Thread(target=self._start, args=(path,), name="EnginePool start", daemon=True).start()
+        else:
+            self._start(path)
+            if self.start_error is not None:
+                raise self.start_error
+
+    def _start(self, path: str):
+        started = time.perf_counter()
+        try:
+            engines = [UciEngine(path, {"Threads": self.threads, "Hash": self.hash_mb}) for _ in range(self.size)]
+        except Exception as e:
+            self.start_error = e
+        else:
+            with self.lock:
+                self.engines = engines
+                self.idle = list(engines)
+                self.last_session = {id(engine): None for engine in engines}
+        self.start_time = time.perf_counter() - started
+        self.started.set()
+
+    def wait_started(self, timeout: float = None) -> bool:
+        # True once the engines run; raises what stopped them from starting
+        if not self.started.wait(timeout):
+            return False
+        if self.start_error is not None:
+            raise self.start_error
+        return True
+
+    def acquire(self, session, timeout: float = None) -> UciEngine:
+        if not self.wait_started(timeout):
+            raise EnginePoolBusy("Engines are still starting")
+        with self.lock:
+            if self.idle:
+                self.checkouts += 1
+                return self.idle.pop()
+            if self.waiting_count >= self.max_waiting:
+                self.rejected += 1
+                raise EnginePoolBusy(f"{self.waiting_count} searches already waiting for an engine")
+            waiter = _Waiter()
+            self.waiting.setdefault(session, deque()).append(waiter)
+            self.waiting_count += 1
+            self.waits += 1
+
+        started = time.monotonic()
+        got_engine = waiter.event.wait(timeout)
+        with self.lock:
+            self.wait_time += time.monotonic() - started
+            if not got_engine and waiter.engine is None:
+                # Gave up before an engine was handed over
+                queue = self.waiting.get(session)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    self.waiting_count -= 1
+                    if not queue:
+                        del self.waiting[session]
+                raise EnginePoolBusy("Timed out waiting for an engine")
+            self.checkouts += 1
+            return waiter.engine
+
+    def release(self, engine: UciEngine):
+        with self.lock:
+            if not self.waiting:
+                self.idle.append(engine)
+                return
+            # Next session in turn gets the engine, then goes to the back of the line
+            session, queue = next(iter(self.waiting.items()))
+            waiter = queue.popleft()
+            self.waiting_count -= 1
+            del self.waiting[session]
+            if queue:
+                self.waiting[session] = queue
+            waiter.engine = engine
+            waiter.event.set()
+
+    def configure(self, engine: UciEngine, session, elo: int = -1, skill: int = None, depth: int = None):
+        # Nothing from the previous checkout may leak: strength, depth limit, and the hash of another game.
+        # Options are only sent when they change, so this costs nothing between a session's searches.
+        if self.last_session[id(engine)] is not session:
+            engine.new_game()
+            self.last_session[id(engine)] = session
+        limit_strength = elo is not None and elo >= 0
+        engine.set_option("UCI_LimitStrength", limit_strength)
+        if limit_strength:
+            engine.set_option("UCI_Elo", elo)
+        engine.set_option("Skill Level", 20 if skill is None else skill)
+        engine.depth = self.depth if depth is None else depth
+
+    def new_game(self, session):
+        # The session starts another game, its next checkout clears the engine's hash
+        with self.lock:
+            for engine_id, last_session in self.last_session.items():
+                if last_session is session:
+                    self.last_session[engine_id] = None
+
+    @contextmanager
+    def checkout(self, session, elo: int = -1, skill: int = None, timeout: float = None, depth: int = None):
+        engine = self.acquire(session, timeout)
+        try:
+            self.configure(engine, session, elo, skill, depth)
+            yield engine
+        finally:
+            self.release(engine)
+
+    def close(self):
+        self.started.wait()
+        with self.lock:
+            for engine in self.engines:
+                engine.quit()
+            self.idle = []
+
+    def print_stats(self):
+        print(f"Engine pool: {self.size} engines x {self.threads} threads, started in {self.start_time:.2f} s, "
+              f"{self.checkouts} checkouts, {self.waits} waited ({self.wait_time:.2f} s), {self.rejected} rejected")
@@ -0,0 +1,247 @@
+# This file emulates the motor controller firmware on a pseudo-terminal.
+
+# It speaks the MotionLink protocol like Embedded/src/main.cpp and times every segment the way the
+# firmware chains them (MotionProfile), so Control can be exercised and benchmarked without the board.
+#
+# Benchmark: python FirmwareEmulator.py [moves] [time_scale]
+
+import math
+import os
+import random
+import re
+import select
+import sys
+import threading
+import time
+import tty
+
+from MotionLink import encode_frame, decode_frame
+from MotionProfile import exit_speeds, segment_length, segment_time
+
+FIRMWARE_SOURCE = os.path.join(os.path.dirname(__file__), '..', 'Embedded', 'src', 'main.cpp')
+
+
+def read_firmware_setting(name: str, default: float) -> float:
+    # Pick up the constants main.cpp configures so the emulator follows firmware changes
+    try:
+        with open(FIRMWARE_SOURCE) as f:
+            source = f.read()
+    except OSError:
+        return default
+    match = re.search(rf"\b{name}\s*=\s*([0-9.]+)", source)
+    return float(match.group(1)) if match else default
+
+
+class FirmwareEmulator:
+    BAUDRATE = 115200
+
+    max_speed: float
+    acceleration: float
+    junction_jump: float
+    queue_size: int
+    time_scale: float
+    corruption: float
+    port: str
+    position: list[int]
+    magnet_state: bool
+    frames_received: int
+    frames_rejected: int
+    bytes_received: int
+    bytes_sent: int
+    segments_done: int
+    motion_time: float
+
+    def __init__(self, time_scale: float = 1.0, corruption: float = 0.0):
+        self.max_speed = read_firmware_setting("MAX_SPEED", 1000.0)
+        self.acceleration = read_firmware_setting("ACCELERATION", 500.0)
+        self.junction_jump = read_firmware_setting("JUNCTION_JUMP", 200.0)
+        self.queue_size = int(read_firmware_setting("QUEUE_SIZE", 8))
+        self.time_scale = time_scale    # Scales emulated motion time, 0.01 runs 100x faster
+        self.corruption = corruption    # Probability of corrupting a received frame
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+
+        self.position = [0, 0]
+        self.magnet_state = False
+        self.frames_received = 0
+        self.frames_rejected = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.segments_done = 0
+        self.motion_time = 0.0
+
+        self._reset_queue()
+        self._running = False
+        self._thread = None
+
+    def _reset_queue(self):
+        self.queue = []
+        self.expected_seq = 0
+        self.last_done_seq = 255
+        self.current = None
+        self.current_start = 0.0
+        self.current_end = 0.0
+        self.current_duration = 0.0
+        self.entry_speed = 0.0  # Speed the running segment started with
+        self.exit_speed = 0.0   # Speed it is planned to end with
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def _send(self, payload: str):
+        frame = encode_frame(payload)
+        # Serial line time: 10 bits per byte with start and stop bits
+        time.sleep(len(frame) * 10 / self.BAUDRATE)
+        os.write(self.master_fd, frame)
+        self.bytes_sent += len(frame)
+
+    def _run(self):
+        buffer = b""
+        while self._running:
+            now = time.monotonic()
+            timeout = 0.05
+            if self.current is not None:
+                timeout = max(0.0, min(timeout, self.current_end - now))
+            readable, _, _ = select.select([self.master_fd], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.master_fd, 4096)
+                except OSError:
+                    break
+                self.bytes_received += len(data)
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    if line.strip():
+                        self._handle_frame(line)
+            self._update_motion()
+
+    def _handle_frame(self, line: bytes):
+        self.frames_received += 1
+        if self.corruption and random.random() < self.corruption:
+            line = line[:-1] + b"?"
+        fields = decode_frame(line)
+        if fields is None:
+            self.frames_rejected += 1
+            self._send(f"N {self.expected_seq}")
+            return
+
+        if fields == ["R"]:
+            self._reset_queue()
+            self.magnet_state = False
+            self._send("R")
+        elif fields == ["Q"]:
+            self._send(f"D {self.last_done_seq}")
+        elif fields[0] == "S" and len(fields) == 5:
+            seq = int(fields[1]) % 256
+            if seq != self.expected_seq or len(self.queue) >= self.queue_size:
+                # Duplicate of an accepted frame: acknowledge again, anything else: ask for a resend
+                if seq != self.expected_seq and (self.expected_seq - seq) % 256 <= self.queue_size * 2:
+                    self._send(f"A {(self.expected_seq - 1) % 256} {self.queue_size - len(self.queue)}")
+                else:
+                    self.frames_rejected += 1
+                    self._send(f"N {self.expected_seq}")
+                return
+            self.queue.append((seq, int(fields[2]), int(fields[3]), fields[4] != "0"))
+            self.expected_seq = (self.expected_seq + 1) % 256
+            # Like the firmware, the running segment may now hand its speed on instead of braking
+            if self.current is not None:
+                self._plan_current()
+            self._send(f"A {seq} {self.queue_size - len(self.queue)}")
+        else:
+            self.frames_rejected += 1
+            self._send(f"N {self.expected_seq}")
+
+    def _update_motion(self):
+        now = time.monotonic()
+        if self.current is not None and now >= self.current_end:
+            seq, steps1, steps2, _ = self.current
+            self.position[0] += steps1
+            self.position[1] += steps2
+            self.last_done_seq = seq
+            self.segments_done += 1
+            self.motion_time += self.current_duration
+            self.current = None
+            self.entry_speed = self.exit_speed
+            self._send(f"D {seq}")
+        if self.current is None and self.queue:
+            self.current = self.queue.pop(0)
+            self.magnet_state = self.current[3]
+            if not self.entry_speed:
+                self.current_start = time.monotonic()
+            else:
+                # Handed over at speed, the segment starts where the last one ended
+                self.current_start = self.current_end
+            self._plan_current()
+        elif self.current is None:
+            self.entry_speed = 0.0
+
+    def _plan_current(self):
+        # Time the running segment from its entry speed to the exit speed the queue allows
+        _, steps1, steps2, _ = self.current
+        segments = [self.current[1:]] + [segment[1:] for segment in self.queue]
+        length = segment_length(steps1, steps2)
+        planned = exit_speeds(segments, self.max_speed, self.acceleration, self.junction_jump)[0]
+        self.exit_speed = min(planned, math.sqrt(self.entry_speed ** 2 + 2 * self.acceleration * length))
+        self.current_duration = segment_time(length, self.entry_speed, self.exit_speed, self.max_speed,
+                                             self.acceleration)
+        self.current_end = self.current_start + self.current_duration * self.time_scale
+
+
+def benchmark(moves: int = 20, time_scale: float = 0.01):
+    import chess
+    from Control import Control
+
+    emulator = FirmwareEmulator(time_scale=time_scale)
+    emulator.start()
+    control = Control()
+    if not control.connect(emulator.port):
+        print("Error: could not connect to the emulator.")
+        emulator.stop()
+        return
+
+    board = chess.Board()
+    control.update_board_state(board)
+    rng = random.Random(0)
+    move_times = []
+    segments = 0
+    for _ in range(moves):
+        if board.is_game_over():
+            break
+        move = rng.choice(list(board.legal_moves))
+        path = control.get_path(move, board)
+        trajectory = control.calculate_trajectory(path)
+        started = time.perf_counter()
+        if not control.run_trajectory(trajectory):
+            print("Error: move failed:", move)
+            break
+        move_times.append(time.perf_counter() - started)
+        segments += len(trajectory)
+        control.apply_move(board, move)
+        board.push(move)
+
+    emulator.stop()
+    wall = sum(move_times)
+    emulated = emulator.motion_time * time_scale
+    print(f"Moves: {len(move_times)}, segments: {segments}")
+    print(f"Wall-clock move time: {wall:.3f} s total, {wall / max(1, len(move_times)) * 1000:.1f} ms per move")
+    print(f"Emulated motion time: {emulator.motion_time:.2f} s (x{time_scale} = {emulated:.3f} s), "
+          f"link overhead {max(0.0, wall - emulated) * 1000:.1f} ms")
+    print(f"Serial: {emulator.bytes_received} bytes in, {emulator.bytes_sent} bytes out, "
+          f"{emulator.frames_received / wall if wall else 0:.0f} frames/s, "
+          f"{emulator.frames_rejected} rejected, {control.link.retransmissions} resent")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+              float(sys.argv[2]) if len(sys.argv) > 2 else 0.01)
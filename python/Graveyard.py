@@ -0,0 +1,91 @@
+# This file keeps track of captured pieces parked around the board.
+
+# Slots are the roadmap nodes on the lane around the board level with a rank or file
+# (Roadmap.slot_nodes), half a square off the board. They are numbered after the 64 board squares and
+# use the same occupancy bits, so a parked piece is an obstacle for the planner like any piece on the
+# board. A captured piece goes to the free slot its planned path reaches at the least cost. A
+# promotion takes the promoted piece back from the slot that is cheapest to bring it from, when one
+# holds it. When every slot is taken, the overflow point in a corner of the lane is used instead.
+
+import chess
+
+
+class Graveyard:
+    grid: object
+    overflow_position: object
+    parked: dict[int, chess.Piece]
+
+    def __init__(self, grid, overflow_position):
+        self.grid = grid
+        self.overflow_position = overflow_position  # Also holds the spare pieces for promotions
+        self.parked = {}  # Slot -> piece parked there, None when unknown
+
+    def slots(self) -> list[int]:
+        roadmap = self.grid.roadmap
+        return [roadmap.squares[node_id] for node_id in roadmap.slot_nodes]
+
+    def position(self, slot: int):
+        # Gantry position of a slot, the overflow point for -1
+        if slot < 0:
+            return self.overflow_position
+        return self.grid.get_position(self.grid.roadmap.square_nodes[slot])
+
+    def is_free(self, slot: int) -> bool:
+        return slot not in self.parked
+
+    def choose_slot(self, start, taken=()) -> int:
+        # Free slot with the cheapest planned path from `start`, -1 when none is free and reachable
+        free = [slot for slot in self.slots() if slot not in self.parked and slot not in taken]
+        return self._cheapest(free, start)
+
+    def find_piece(self, piece: chess.Piece, target) -> int:
+        # Slot holding `piece` with the cheapest planned path to `target`, -1 when none does
+        if piece is None:
+            return -1
+        holding = [slot for slot, parked_piece in self.parked.items() if parked_piece == piece]
+        return self._cheapest(holding, target)
+
+    def _cheapest(self, slots: list[int], position) -> int:
+        # One search from `position` to the nearest of the slots. Paths cost the same both ways, so a
+        # piece brought from a slot is searched for from its target.
+        grid = self.grid
+        node_id = grid.get_node_id(position)
+        if node_id < 0:
+            return slots[0] if slots else -1
+        square_nodes = grid.roadmap.square_nodes
+        occupancy = grid.occupancy
+        # The piece on `position` is being carried off or replaced, its square is no obstacle
+        square = grid.roadmap.squares[node_id]
+        if square >= 0:
+            grid.set_occupancy(occupancy & ~(1 << square))
+        try:
+            path, _ = grid.search_nearest(position, [square_nodes[slot] for slot in slots])
+        finally:
+            grid.set_occupancy(occupancy)
+        if not path:
+            return -1
+        return grid.roadmap.squares[grid.get_node_id(path[-1])]
+
+    def commit(self, parked: list[tuple[int, chess.Piece]], released: int = -1):
+        # Record pieces that left the board and the slot a promoted piece was taken from
+        occupancy = self.grid.occupancy
+        if released >= 0:
+            self.parked.pop(released, None)
+            occupancy &= ~(1 << released)
+        for slot, piece in parked:
+            if slot >= 0:
+                self.parked[slot] = piece
+                occupancy |= 1 << slot
+        self.grid.set_occupancy(occupancy)
+
+    def clear(self):
+        # The pieces were put back by hand, for a new game
+        self.parked = {}
+        self.grid.set_occupancy(self.grid.occupancy & chess.BB_ALL)
+
+    def print_graveyard(self):
+        for slot in self.slots():
+            piece = self.parked.get(slot)
+            if slot in self.parked:
+                position = self.position(slot)
+                print(f"({position.x}, {position.y}): {piece.symbol() if piece else '?'}")
@@ -0,0 +1,234 @@
+# This file records how long each stage of a move takes: engine search, planning, serial and motion.
+
+# Timings go into HDR-style histograms (log-linear buckets, about 3% relative error, fixed memory)
+# and, while a move is open, into that move's record. The last records are kept in a ring buffer.
+# Both can be written as JSON or in the Prometheus text format, e.g. for the node_exporter
+# textfile collector. Set CNCHESS_METRICS_FILE to write the Prometheus file when the UI exits.
+#
+#   from Metrics import metrics
+#   with metrics.span("planner.compile"):
+#       ...
+#   @metrics.timed("planner.a_star")
+#   def search(...): ...
+
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+SUB_BUCKETS = 32  # Buckets per power of two
+MIN_VALUE_NS = 1000  # Everything below one microsecond lands in the first bucket
+
+
+class Histogram:
+    count: int
+    total: float
+    min: float
+    max: float
+    buckets: dict[int, int]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = {}
+
+    @staticmethod
+    def bucket_index(value_ns: int) -> int:
+        if value_ns < MIN_VALUE_NS:
+            return 0
+        mantissa, exponent = math.frexp(value_ns / MIN_VALUE_NS)  # mantissa in [0.5, 1)
+        sub = int((mantissa * 2 - 1) * SUB_BUCKETS)
+        return (exponent - 1) * SUB_BUCKETS + sub + 1
+
+    @staticmethod
+    def bucket_upper(index: int) -> float:
+        # Upper bound of a bucket in seconds
+        if index == 0:
+            return MIN_VALUE_NS / 1e9
+        exponent, sub = divmod(index - 1, SUB_BUCKETS)
+        return MIN_VALUE_NS * (1 << exponent) * (1 + (sub + 1) / SUB_BUCKETS) / 1e9
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        index = self.bucket_index(int(seconds * 1e9))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = math.ceil(percent / 100 * self.count)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, self.bucket_upper(index))
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> dict:
+        return {"count": self.count, "mean": self.mean(), "min": self.min if self.count else 0.0,
+                "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+                "max": self.max}
+
+
+class MoveRecord:
+    label: str
+    started: float
+    duration: float
+    stages: dict[str, float]
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.time()
+        self.duration = 0.0
+        self.stages = {}  # Stage name -> seconds summed over its spans in this move
+
+    def as_dict(self) -> dict:
+        return {"label": self.label, "started": self.started, "duration": self.duration, "stages": self.stages}
+
+    def __repr__(self):
+        stages = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.stages.items())
+        return f"Move {self.label}: {self.duration * 1000:.1f} ms ({stages})"
+
+
+class Metrics:
+    enabled: bool
+    histograms: dict[str, Histogram]
+    moves: deque
+    current_move: MoveRecord
+    export_path: str
+
+    def __init__(self, history: int = 256):
+        self.enabled = True
+        self.histograms = {}
+        self.moves = deque(maxlen=history)
+        self.current_move = None
+        self.export_path = os.environ.get("CNCHESS_METRICS_FILE")
+        self.lock = threading.Lock()  # Engine, GUI and motion run on different threads
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+            if self.current_move is not None:
+                stages = self.current_move.stages
+                stages[name] = stages.get(name, 0.0) + seconds
+
+    def span(self, name: str) -> '_Span':
+        return _Span(self, name)
+
+    def timed(self, name: str):
+        # Decorator form of span() for whole functions
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def begin_move(self, label: str = ""):
+        # Spans from any thread are added to this move until end_move
+        with self.lock:
+            self.current_move = MoveRecord(label)
+
+    def end_move(self, label: str = None) -> MoveRecord:
+        with self.lock:
+            move = self.current_move
+            self.current_move = None
+            if move is None:
+                return None
+            if label is not None:
+                move.label = label
+            move.duration = time.time() - move.started
+            self.moves.append(move)
+        self.record("move.total", move.duration)
+        return move
+
+    def get_histogram(self, name: str) -> Histogram:
+        with self.lock:
+            return self.histograms.get(name)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.moves.clear()
+            self.current_move = None
+
+    def to_prometheus(self, prefix: str = "cnchess") -> str:
+        # Summaries in seconds, one series per stage
+        lines = [f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                for quantile in (0.5, 0.9, 0.95, 0.99):
+                    lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{quantile}"}} '
+                                 f'{histogram.percentile(quantile * 100):.6g}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {histogram.total:.6g}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"stages": {name: histogram.summary() for name, histogram in self.histograms.items()},
+                    "moves": [move.as_dict() for move in self.moves]}
+
+    def write_prometheus(self, path: str = None):
+        self._write(path or self.export_path, self.to_prometheus())
+
+    def write_json(self, path: str):
+        self._write(path, json.dumps(self.to_dict(), indent=1))
+
+    def _write(self, path: str, text: str):
+        # Readers never see a half-written file
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def print_summary(self):
+        with self.lock:
+            items = sorted(self.histograms.items())
+        for name, histogram in items:
+            summary = histogram.summary()
+            print(f"{name}: {summary['count']} x, mean {summary['mean'] * 1000:.2f} ms, "
+                  f"p50 {summary['p50'] * 1000:.2f} ms, p95 {summary['p95'] * 1000:.2f} ms, "
+                  f"max {summary['max'] * 1000:.2f} ms")
+
+
+class _Span:
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+# Shared by every module of the process
+metrics = Metrics()
@@ -0,0 +1,241 @@
+# This file handles the serial motion protocol between Control and the motor controller.
+
+# Segments are uploaded as numbered frames and acknowledged by the controller, which queues them
+# and reports each one as done. The host keeps up to WINDOW segments queued so the gantry never
+# waits on the serial link between segments.
+#
+# Frame: "<payload>*<checksum>\n", checksum is the XOR of the payload bytes as two hex digits.
+#   Host -> controller:  "R"                              reset queue and sequence numbers
+#                        "S <seq> <steps1> <steps2> <magnet>"   queue one segment
+#                        "Q"                              ask for the last finished segment
+#   Controller -> host:  "R"                              reset done
+#                        "A <seq> <free>"                 frames up to seq accepted, free buffer slots
+#                        "N <seq>"                        bad or out of order frame, resend from seq
+#                        "D <seq>"                        segments up to seq finished moving
+
+import logging
+import time
+
+from Metrics import metrics
+
+log = logging.getLogger(__name__)
+
+SEQ_MODULO = 256
+
+
+def checksum(payload: str) -> str:
+    value = 0
+    for byte in payload.encode('ascii'):
+        value ^= byte
+    return f"{value:02X}"
+
+
+def encode_frame(payload: str) -> bytes:
+    return f"{payload}*{checksum(payload)}\n".encode('ascii')
+
+
+def decode_frame(line: bytes) -> list[str]:
+    # Returns the payload fields, or None when the frame is corrupted
+    try:
+        text = line.decode('ascii').strip()
+    except UnicodeDecodeError:
+        return None
+    payload, sep, received = text.rpartition('*')
+    if not sep or checksum(payload) != received.upper():
+        return None
+    return payload.split()
+
+
+class Segment:
+    steps1: int
+    steps2: int
+    magnet_state: bool
+
+    def __init__(self, steps1: int, steps2: int, magnet_state: bool = False):
+        self.steps1 = steps1
+        self.steps2 = steps2
+        self.magnet_state = magnet_state
+
+    def payload(self, seq: int) -> str:
+        return f"S {seq} {self.steps1} {self.steps2} {1 if self.magnet_state else 0}"
+
+
+class MotionLink:
+    # A full window of segment frames (up to 28 bytes each) arrives at once, the controller's serial
+    # receive buffer must hold it: Embedded/platformio.ini raises it from 64 to 256 bytes
+    WINDOW = 8             # Segments queued on the controller at most (its buffer size)
+    ACK_TIMEOUT = 0.5      # Seconds before unacknowledged frames are sent again
+    MOVE_TIMEOUT = 30.0    # Seconds without any finished segment before giving up
+    MAX_RETRIES = 5        # Resends of the same frame before giving up
+
+    ser: object
+    window: int
+    seq: int
+    synced: bool
+    retransmissions: int
+    segments_done: int
+
+    def __init__(self, ser, window: int = WINDOW):
+        self.ser = ser
+        self.window = min(window, SEQ_MODULO // 2)
+        self.seq = 0
+        self.synced = False
+        self.retransmissions = 0
+        self.segments_done = 0  # Segments of the last run the controller reported done
+
+    def reset(self) -> bool:
+        self.ser.reset_input_buffer()
+        deadline = time.monotonic() + self.MOVE_TIMEOUT
+        while time.monotonic() < deadline:
+            self.ser.write(encode_frame("R"))
+            fields = decode_frame(self.ser.readline())
+            if fields == ["R"]:
+                self.seq = 0
+                self.synced = True
+                return True
+        log.error("No response from motor controller.")
+        return False
+
+    @metrics.timed("motion.run")
+    def run(self, segments: list[Segment]) -> bool:
+        # Blocks until every segment has been reported done
+        self.segments_done = 0
+        if not segments:
+            return True
+        if not self.synced and not self.reset():
+            return False
+
+        transfer = MotionTransfer(segments, self.seq, self.window, self.ser.write)
+        transfer.start(time.monotonic())
+        while not transfer.finished and transfer.error is None:
+            fields = decode_frame(self.ser.readline())
+            if fields:
+                transfer.on_frame(fields, time.monotonic())
+            else:
+                transfer.on_timeout(time.monotonic())
+
+        self.retransmissions += transfer.retransmissions
+        self.segments_done = transfer.done
+        if transfer.error is not None:
+            log.error("Motion upload failed: %s", transfer.error)
+            self.synced = False
+            return False
+        self.seq = transfer.end_seq
+        return True
+
+
+class MotionTransfer:
+    # Upload of one list of segments, as a state machine fed with the controller's frames, so it can
+    # be driven by a blocking loop (MotionLink.run) or by an event loop (ui.serial_transport).
+    # Call on_timeout when nothing valid arrived for a while, at the latest by deadline().
+    segments: list[Segment]
+    window: int
+    count: int
+    next_index: int
+    acked: int
+    done: int
+    retransmissions: int
+    error: str
+
+    def __init__(self, segments: list[Segment], first_seq: int, window: int, write):
+        self.segments = segments
+        self.first_seq = first_seq
+        self.window = window
+        self.write = write
+        self.count = len(segments)
+        self.next_index = 0      # Next segment to send
+        self.acked = 0           # Segments accepted by the controller
+        self.done = 0            # Segments finished moving
+        self.sent_at = 0.0
+        self.retries = 0
+        self.last_progress = 0.0
+        self.last_nack = (-1, 0.0)
+        self.first_sent = [0.0] * self.count  # Last time each segment was sent, for the ack round trip
+        self.uploaded_at = None               # When the controller had accepted every segment
+        self.retransmissions = 0
+        self.error = None
+
+    @property
+    def finished(self) -> bool:
+        return self.done >= self.count
+
+    @property
+    def end_seq(self) -> int:
+        return (self.first_seq + self.count) % SEQ_MODULO
+
+    def start(self, now: float):
+        self.last_progress = now
+        self._fill(now)
+
+    def deadline(self) -> float:
+        # Monotonic time at which on_timeout has something to do
+        return min(self.sent_at + MotionLink.ACK_TIMEOUT, self.last_progress + MotionLink.MOVE_TIMEOUT)
+
+    def _index_of(self, seq: int, base: int) -> int:
+        # Frames in flight never span more than half the sequence space
+        return base + (seq - (self.first_seq + base)) % SEQ_MODULO
+
+    def _fill(self, now: float):
+        # Keep the controller's buffer full
+        while self.next_index < self.count and self.next_index - self.done < self.window:
+            seq = (self.first_seq + self.next_index) % SEQ_MODULO
+            self.write(encode_frame(self.segments[self.next_index].payload(seq)))
+            self.sent_at = now
+            self.first_sent[self.next_index] = now
+            self.next_index += 1
+
+    def on_timeout(self, now: float):
+        if self.acked < self.next_index and now - self.sent_at > MotionLink.ACK_TIMEOUT:
+            # Lost or corrupted frames: go back to the oldest unacknowledged one
+            self.retries += 1
+            if self.retries > MotionLink.MAX_RETRIES:
+                self.error = "Motor controller stopped acknowledging frames."
+                return
+            self.retransmissions += self.next_index - self.acked
+            self.next_index = self.acked
+        elif self.acked == self.next_index and now - self.sent_at > MotionLink.ACK_TIMEOUT:
+            # Everything is queued, poll in case a done report was lost
+            self.write(encode_frame("Q"))
+            self.sent_at = now
+        if now - self.last_progress > MotionLink.MOVE_TIMEOUT:
+            self.error = "No response from motor controller."
+            return
+        self._fill(now)
+
+    def on_frame(self, fields: list[str], now: float):
+        kind = fields[0]
+        if kind == "A" and len(fields) >= 2:
+            index = self._index_of(int(fields[1]), self.acked)
+            if self.acked <= index < self.next_index:
+                for acked_index in range(self.acked, index + 1):
+                    metrics.record("serial.ack", now - self.first_sent[acked_index])
+                self.acked = index + 1
+                self.retries = 0
+        elif kind == "N" and len(fields) >= 2:
+            index = self._index_of(int(fields[1]), self.acked)
+            # Frames already in flight behind a bad one get rejected too, rewind only once for them
+            repeated = self.last_nack[0] == index and now - self.last_nack[1] < MotionLink.ACK_TIMEOUT
+            if self.acked <= index < self.next_index and not repeated:
+                self.last_nack = (index, now)
+                self.retries += 1
+                if self.retries > MotionLink.MAX_RETRIES:
+                    self.error = "Motor controller keeps rejecting frames."
+                    return
+                self.retransmissions += self.next_index - index
+                self.acked = index
+                self.next_index = index
+        elif kind == "D" and len(fields) >= 2:
+            index = self._index_of(int(fields[1]), self.done)
+            if self.done <= index < self.count:
+                self.done = index + 1
+                self.acked = max(self.acked, self.done)
+                self.last_progress = now
+        else:
+            log.warning("Unexpected response from motor controller: %s", " ".join(fields))
+        if self.uploaded_at is None and self.acked == self.count:
+            self.uploaded_at = now
+        if self.finished:
+            # Time the host only waited for the motors, the upload being over
+            metrics.record("motion.wait", now - self.uploaded_at if self.uploaded_at is not None else 0.0)
+            return
+        self._fill(now)
@@ -0,0 +1,60 @@
+# This file models how the motor controller moves through its queued segments.
+
+# Embedded/src/main.cpp does not stop between segments. It looks ahead over its queue and runs
+# each segment into the next one at the highest speed that:
+#   - the corner allows: neither motor may change speed by more than max_jump at once,
+#   - still lets every queued segment brake in time, the last one ending at standstill,
+#   - is reached accelerating from the entry speed.
+# The gantry stops where the magnet switches, pieces are picked up and dropped at standstill.
+# Speeds are steps per second of the busier motor, the other one is scaled to finish with it.
+#
+#   times = segment_times([(400, 400, False), (400, -400, False)], 1000, 500, 200)
+
+import math
+
+
+def segment_length(steps1: float, steps2: float) -> float:
+    # Steps of the busier motor, the unit speeds are counted in
+    return max(abs(steps1), abs(steps2))
+
+
+def junction_speed(a: tuple, b: tuple, max_speed: float, max_jump: float) -> float:
+    # Highest speed at the corner from segment a into segment b, each (steps1, steps2, magnet)
+    length_a = segment_length(a[0], a[1])
+    length_b = segment_length(b[0], b[1])
+    if a[2] != b[2] or length_a == 0 or length_b == 0:
+        return 0.0
+    jump = max(abs(a[0] / length_a - b[0] / length_b), abs(a[1] / length_a - b[1] / length_b))
+    return min(max_speed, max_jump / jump) if jump > 0 else max_speed
+
+
+def exit_speeds(segments: list[tuple], max_speed: float, acceleration: float, max_jump: float) -> list[float]:
+    # Planned speed at the end of each segment; backward pass, the last one ends at standstill
+    exits = [0.0] * len(segments)
+    for i in range(len(segments) - 2, -1, -1):
+        following = segments[i + 1]
+        entry_limit = math.sqrt(exits[i + 1] ** 2 + 2 * acceleration * segment_length(following[0], following[1]))
+        exits[i] = min(junction_speed(segments[i], following, max_speed, max_jump), entry_limit)
+    return exits
+
+
+def segment_time(length: float, entry: float, exit: float, max_speed: float, acceleration: float) -> float:
+    # Seconds to run `length` steps from `entry` to `exit` speed, accelerating and braking at `acceleration`
+    if length <= 0:
+        return 0.0
+    exit = min(exit, math.sqrt(entry * entry + 2 * acceleration * length))
+    peak = min(max_speed, math.sqrt(acceleration * length + (entry * entry + exit * exit) / 2))
+    ramps = (2 * peak * peak - entry * entry - exit * exit) / (2 * acceleration)
+    return (2 * peak - entry - exit) / acceleration + max(0.0, length - ramps) / peak
+
+
+def segment_times(segments: list[tuple], max_speed: float, acceleration: float, max_jump: float) -> list[float]:
+    # Seconds of each segment of a motion that starts and ends at standstill
+    times = []
+    speed = 0.0
+    for (steps1, steps2, _), planned_exit in zip(segments, exit_speeds(segments, max_speed, acceleration, max_jump)):
+        length = segment_length(steps1, steps2)
+        exit = min(planned_exit, math.sqrt(speed * speed + 2 * acceleration * length))
+        times.append(segment_time(length, speed, exit, max_speed, acceleration))
+        speed = exit
+    return times
@@ -0,0 +1,160 @@
+# This file compiles recorded games into motion programs and plays them back on the board.
+
+# A motion program holds every move of a game already planned and converted to motor steps, so a
+# demo replay streams segments to the controller without any planning between moves. The file is
+# memory-mapped by the player, all sections are little-endian and fixed-width:
+#
+#   header   128 bytes   magic "CNMP", version, move count, record count, motion time, start FEN
+#   index    28 bytes    per move: first record, record count, motion time, end position, UCI move
+#   records  12 bytes    per segment: steps of motor 1, steps of motor 2, magnet state (int32 each)
+#
+# Steps are deltas from the home position at the start of the game, as Control.compile_steps
+# produces them. Play a program only after homing the gantry.
+#
+#   python MotionProgram.py compile game.pgn -o game.cnmp [--game 0]
+#   python MotionProgram.py play game.cnmp --port COM3
+
+import argparse
+import mmap
+
+import chess
+import chess.pgn
+import numpy as np
+
+from Control import Control, Position
+
+MAGIC = b"CNMP"
+VERSION = 1
+
+HEADER = np.dtype([("magic", "S4"), ("version", "<u2"), ("reserved", "<u2"), ("moves", "<u4"),
+                   ("records", "<u4"), ("motion_time", "<f4"), ("fen", "S96"), ("padding", "S12")])
+INDEX = np.dtype([("first", "<u4"), ("count", "<u4"), ("motion_time", "<f4"), ("end_x", "<f4"),
+                  ("end_y", "<f4"), ("uci", "S8")])
+RECORD = np.dtype([("steps1", "<i4"), ("steps2", "<i4"), ("magnet", "<i4")])
+
+
+def compile_game(game: chess.pgn.Game, output: str, control: Control = None) -> int:
+    # Plans the main line, starting with the gantry at home; raises ValueError when a move cannot be planned
+    control = control or Control()
+    board = game.board()
+    control.update_board_state(board)
+    index = []
+    records = []
+    first = 0
+    for move in game.mainline_moves():
+        path = control.get_path(move, board)
+        if not path:
+            raise ValueError(f"No path for {move.uci()} in {board.fen()}")
+        steps, magnets = control.compile_steps(path)
+        move_records = np.zeros(len(steps), dtype=RECORD)
+        move_records["steps1"] = steps[:, 0]
+        move_records["steps2"] = steps[:, 1]
+        move_records["magnet"] = magnets
+        records.append(move_records)
+        end = control.current_position
+        index.append((first, len(steps), control.estimated_move_time, end.x, end.y, move.uci().encode("ascii")))
+        first += len(steps)
+        control.apply_move(board, move)
+        board.push(move)
+
+    index = np.array(index, dtype=INDEX)
+    records = np.concatenate(records) if records else np.zeros(0, dtype=RECORD)
+    header = np.zeros(1, dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["moves"] = len(index)
+    header["records"] = len(records)
+    header["motion_time"] = float(index["motion_time"].sum()) if len(index) else 0.0
+    header["fen"] = game.board().fen().encode("ascii")
+    with open(output, "wb") as f:
+        f.write(header.tobytes())
+        f.write(index.tobytes())
+        f.write(records.tobytes())
+    print(f"Motion program: {len(index)} moves, {len(records)} segments, "
+          f"{header['motion_time'][0]:.1f} s of motion written to {output}")
+    return len(index)
+
+
+class MotionProgram:
+    path: str
+    fen: str
+    motion_time: float
+    index: np.ndarray
+    records: np.ndarray
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self.mapping, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            self.mapping.close()
+            raise ValueError(f"{path} is not a version {VERSION} motion program")
+        self.fen = header["fen"].decode("ascii")
+        self.motion_time = float(header["motion_time"])
+        # Views into the mapping, nothing is copied
+        self.index = np.frombuffer(self.mapping, dtype=INDEX, count=int(header["moves"]), offset=HEADER.itemsize)
+        self.records = np.frombuffer(self.mapping, dtype=RECORD, count=int(header["records"]),
+                                     offset=HEADER.itemsize + self.index.nbytes)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def move(self, number: int) -> chess.Move:
+        return chess.Move.from_uci(self.index[number]["uci"].decode("ascii"))
+
+    def segments(self, number: int) -> np.ndarray:
+        entry = self.index[number]
+        return self.records[entry["first"]:entry["first"] + entry["count"]]
+
+    def play(self, control: Control, start: int = 0, stop: int = None, on_move=None) -> bool:
+        # Streams moves start..stop to the controller; on_move(number, move) runs after each one
+        for number in range(start, len(self) if stop is None else min(stop, len(self))):
+            segments = self.segments(number)
+            steps = np.column_stack((segments["steps1"], segments["steps2"]))
+            if not control.run_steps(steps, segments["magnet"]):
+                return False
+            # Keep Control in step with the gantry for moves planned live afterwards
+            entry = self.index[number]
+            control.step_position = control.step_position + steps.sum(axis=0)
+            control.step_target = control.step_position.astype(float)
+            control.current_position = Position(float(entry["end_x"]), float(entry["end_y"]))
+            if on_move is not None:
+                on_move(number, self.move(number))
+        return True
+
+    def close(self):
+        # The arrays above must not be used after this
+        self.index = None
+        self.records = None
+        self.mapping.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile games to motion programs and play them back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_parser = commands.add_parser("compile", help="Plan a PGN game into a motion program")
+    compile_parser.add_argument("pgn")
+    compile_parser.add_argument("-o", "--output", required=True)
+    compile_parser.add_argument("--game", type=int, default=0, help="Game number in the PGN file")
+    play_parser = commands.add_parser("play", help="Stream a motion program to the motor controller")
+    play_parser.add_argument("program")
+    play_parser.add_argument("--port", default="COM3")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        with open(args.pgn, encoding="utf-8", errors="replace") as pgn:
+            for _ in range(args.game):
+                chess.pgn.skip_game(pgn)
+            game = chess.pgn.read_game(pgn)
+        if game is None:
+            parser.error(f"{args.pgn} has no game {args.game}")
+        compile_game(game, args.output)
+    else:
+        program = MotionProgram(args.program)
+        control = Control()
+        if not control.connect(args.port):
+            raise SystemExit(1)
+        print(f"Playing {len(program)} moves, {program.motion_time:.1f} s of motion")
+        program.play(control, on_move=lambda number, move: print(f"{number + 1}: {move}"))
+        program.close()
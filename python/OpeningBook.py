@@ -0,0 +1,105 @@
+# This file builds and reads the opening book used by CNChess.
+
+# The book is written in the polyglot format (16-byte entries sorted by Zobrist key), so it can
+# also be used by other chess tools. It is built from a local PGN archive:
+#
+#   python OpeningBook.py games.pgn [more.pgn ...] -o opening_book.bin --max-ply 16 --min-games 2
+
+import argparse
+import os
+import random
+import struct
+
+import chess
+import chess.polyglot
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn
+
+
+def encode_move(board: chess.Board, move: chess.Move) -> int:
+    # Polyglot encodes castling as the king taking its own rook
+    if board.is_castling(move) and not board.chess960:
+        rook_file = 7 if board.is_kingside_castling(move) else 0
+        move = chess.Move(move.from_square, chess.square(rook_file, chess.square_rank(move.from_square)))
+    promotion = move.promotion - 1 if move.promotion else 0  # knight = 1 ... queen = 4
+    return (chess.square_file(move.to_square)
+            | chess.square_rank(move.to_square) << 3
+            | chess.square_file(move.from_square) << 6
+            | chess.square_rank(move.from_square) << 9
+            | promotion << 12)
+
+
+def build_book(pgn_paths: list[str], output: str, max_ply: int = 16, min_games: int = 2) -> int:
+    # Weight of a move is 2 per win and 1 per draw for the side playing it, over all games
+    import chess.pgn  # Only needed to build books, slow to import
+
+    stats: dict[tuple[int, int], list[int]] = {}
+    games = 0
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding="utf-8", errors="replace") as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    break
+                games += 1
+                result = game.headers.get("Result", "*")
+                board = game.board()
+                for ply, move in enumerate(game.mainline_moves()):
+                    if ply >= max_ply:
+                        break
+                    key = (chess.polyglot.zobrist_hash(board), encode_move(board, move))
+                    entry = stats.setdefault(key, [0, 0])
+                    entry[0] += 1
+                    if result == "1/2-1/2":
+                        entry[1] += 1
+                    elif result == ("1-0" if board.turn == chess.WHITE else "0-1"):
+                        entry[1] += 2
+                    board.push(move)
+
+    entries = [(key, move, count, score) for (key, move), (count, score) in stats.items() if count >= min_games]
+    # Every move seen often enough stays playable, even if it never won
+    top = max((score + 1 for _, _, _, score in entries), default=1)
+    scale = min(1.0, 0xFFFF / top)
+    entries.sort()
+    with open(output, "wb") as f:
+        for key, move, _, score in entries:
+            f.write(ENTRY.pack(key, move, max(1, int((score + 1) * scale)), 0))
+    print(f"Opening book: {len(entries)} entries from {games} games written to {output}")
+    return len(entries)
+
+
+class OpeningBook:
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reader = None
+        if os.path.exists(path):
+            try:
+                self.reader = chess.polyglot.open_reader(path)
+            except OSError as e:
+                print("Warning: could not open opening book:", e)
+
+    def get_move(self, board: chess.Board) -> chess.Move:
+        # Weighted random choice for variety between games, None when out of book
+        if self.reader is None:
+            return None
+        try:
+            return self.reader.weighted_choice(board, random=random).move
+        except IndexError:
+            return None
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a polyglot opening book from PGN files.")
+    parser.add_argument("pgn", nargs="+", help="PGN files to read")
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.dirname(__file__), "opening_book.bin"))
+    parser.add_argument("--max-ply", type=int, default=16, help="Half-moves per game to include")
+    parser.add_argument("--min-games", type=int, default=2, help="Games a move must appear in")
+    args = parser.parse_args()
+    build_book(args.pgn, args.output, args.max_ply, args.min_games)
@@ -0,0 +1,124 @@
+# This file holds the path cache used by Control.
+
+# Paths are keyed by (start node, end node, occupancy bitboard) and evicted in LRU order. Only the
+# occupancy of the squares that matter to a path is kept: the ones it crosses and its corridor, where
+# a shorter path could run. Pieces moving anywhere else still hit, and a path stays valid when pieces
+# only arrive in its corridor, since obstacles off the path can only make the alternatives worse.
+
+import json
+import os
+from collections import OrderedDict
+
+
+class CachedPath:
+    path: tuple[int, ...]
+    occupancy: int
+    path_mask: int
+    corridor_mask: int
+
+    def __init__(self, path: tuple[int, ...], occupancy: int, path_mask: int, corridor_mask: int):
+        self.path = path                    # Roadmap node ids, start to end
+        self.path_mask = path_mask          # Squares the path crosses
+        self.corridor_mask = corridor_mask  # Squares that could host a shorter path
+        self.occupancy = occupancy & (path_mask | corridor_mask)  # Planned under, masked to those squares
+
+    def is_valid_for(self, occupancy: int) -> bool:
+        if occupancy & self.path_mask:
+            return False  # A piece now sits on the path
+        freed = self.occupancy & ~occupancy
+        return (freed & self.corridor_mask) == 0  # No shortcut opened up
+
+
+class PathCache:
+    capacity: int
+    filename: str
+    namespace: str
+    hits: int
+    corridor_hits: int
+    misses: int
+    entries: OrderedDict
+    by_endpoints: dict[tuple[int, int], set[int]]
+
+    def __init__(self, capacity: int = 1024, filename: str = None, namespace: str = ""):
+        self.capacity = capacity
+        self.filename = filename
+        self.namespace = namespace  # Planner objective the paths were optimal for
+        self.hits = 0
+        self.corridor_hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.by_endpoints = {}
+        if filename is not None and os.path.exists(filename):
+            self.load(filename)
+
+    def lookup(self, start: int, end: int, occupancy: int) -> CachedPath:
+        # Every path of the transfer is checked under its own mask, there are only a few per transfer
+        for entry_occupancy in self.by_endpoints.get((start, end), ()):
+            key = (start, end, entry_occupancy)
+            entry = self.entries[key]
+            if entry.is_valid_for(occupancy):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if occupancy & (entry.path_mask | entry.corridor_mask) != entry_occupancy:
+                    self.corridor_hits += 1  # Pieces arrived in the corridor since it was planned
+                return entry
+
+        self.misses += 1
+        return None
+
+    def store(self, start: int, end: int, entry: CachedPath):
+        self._insert(start, end, entry)
+
+    def _insert(self, start: int, end: int, entry: CachedPath):
+        key = (start, end, entry.occupancy)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.by_endpoints.setdefault((start, end), set()).add(entry.occupancy)
+        while len(self.entries) > self.capacity:
+            (old_start, old_end, old_occupancy), _ = self.entries.popitem(last=False)
+            occupancies = self.by_endpoints[(old_start, old_end)]
+            occupancies.discard(old_occupancy)
+            if not occupancies:
+                del self.by_endpoints[(old_start, old_end)]
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.by_endpoints.clear()
+        self.hits = 0
+        self.corridor_hits = 0
+        self.misses = 0
+
+    def save(self, filename: str = None):
+        filename = filename or self.filename
+        if filename is None:
+            return
+        data = [[start, end, entry.occupancy, list(entry.path), entry.path_mask, entry.corridor_mask]
+                for (start, end, _), entry in self.entries.items()]
+        tmp_filename = filename + ".tmp"
+        try:
+            with open(tmp_filename, "w") as f:
+                json.dump({"namespace": self.namespace, "capacity": self.capacity, "entries": data}, f)
+            os.replace(tmp_filename, filename)
+        except OSError as e:
+            print("Warning: could not save path cache:", e)
+
+    def load(self, filename: str):
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Warning: could not load path cache:", e)
+            return
+        if data.get("namespace", "") != self.namespace:
+            return  # Planned for another objective
+        # Oldest entries first so the LRU order survives the round trip
+        for start, end, occupancy, path, path_mask, corridor_mask in data.get("entries", []):
+            self._insert(start, end, CachedPath(tuple(path), occupancy, path_mask, corridor_mask))
+
+    def print_stats(self):
+        print(f"Path cache: {len(self.entries)} entries, {self.hits} hits "
+              f"({self.corridor_hits} corridor), {self.misses} misses, hit rate {self.hit_rate():.0%}")
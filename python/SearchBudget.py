@@ -0,0 +1,120 @@
+# This file turns a response-time target into engine search limits for CNChess.
+
+# The player waits for the search and then for the gantry, so the search gets what is left of
+# latency_target once the expected motion time is taken out, scaled by game phase. Recent response
+# times are kept so the budget shrinks when the p95 drifts above the target.
+
+from collections import deque
+
+import chess
+
+# Material of the pieces that decide the game phase, pawns and kings excluded
+PHASE_VALUES = {chess.KNIGHT: 1, chess.BISHOP: 1, chess.ROOK: 2, chess.QUEEN: 4}
+PHASE_TOTAL = 24
+
+
+class SearchLimits:
+    depth: int
+    movetime_ms: int
+    nodes: int
+
+    def __init__(self, depth: int = None, movetime_ms: int = None, nodes: int = None):
+        self.depth = depth
+        self.movetime_ms = movetime_ms
+        self.nodes = nodes
+
+    def key(self) -> str:
+        # Identifies equivalent searches for the result cache
+        if self.movetime_ms is not None:
+            # Round so nearby budgets share cached results
+            return f"movetime {round(self.movetime_ms, -2)}"
+        if self.nodes is not None:
+            return f"nodes {self.nodes}"
+        return f"depth {self.depth}"
+
+    def __repr__(self):
+        return f"SearchLimits({self.key()})"
+
+
+class SearchStats:
+    source: str
+    depth: int
+    nodes: int
+    nps: int
+    engine_time_ms: int
+    wall_time: float
+
+    def __init__(self, source: str = "engine"):
+        self.source = source  # "engine", "ponder", "cache" or "book"
+        self.depth = 0
+        self.nodes = 0
+        self.nps = 0
+        self.engine_time_ms = 0
+        self.wall_time = 0.0
+
+    def parse_info(self, line: str):
+        # Reads "info depth 12 seldepth 18 ... nodes 123456 nps 789000 ... time 156 pv ..."
+        fields = line.split()
+        for name in ("depth", "nodes", "nps", "time"):
+            if name in fields:
+                index = fields.index(name)
+                if index + 1 < len(fields) and fields[index + 1].isdigit():
+                    setattr(self, "engine_time_ms" if name == "time" else name, int(fields[index + 1]))
+
+    def __repr__(self):
+        return (f"SearchStats({self.source}, depth {self.depth}, nodes {self.nodes}, nps {self.nps}, "
+                f"{self.wall_time * 1000:.0f} ms)")
+
+
+class LatencyBudget:
+    latency_target: float
+    min_movetime: float
+    max_movetime: float
+    expected_motion_time: float
+    scale: float
+    samples: deque
+
+    def __init__(self, latency_target: float = 3.0, min_movetime: float = 0.1, max_movetime: float = 5.0,
+                 history: int = 200):
+        self.latency_target = latency_target  # Seconds from the player's move to the gantry finishing
+        self.min_movetime = min_movetime
+        self.max_movetime = max_movetime
+        self.expected_motion_time = 0.0
+        self.scale = 1.0  # Feedback on the p95, lowered when responses run late
+        self.samples = deque(maxlen=history)
+
+    def phase_factor(self, board: chess.Board) -> float:
+        # Middlegames get the full budget, openings and simple endgames need less
+        material = sum(PHASE_VALUES.get(piece.piece_type, 0) for piece in board.piece_map().values())
+        phase = min(material, PHASE_TOTAL) / PHASE_TOTAL
+        if board.fullmove_number <= 6:
+            return 0.5
+        return 0.6 + 0.4 * phase
+
+    def limits_for(self, board: chess.Board) -> SearchLimits:
+        available = max(0.0, self.latency_target - self.expected_motion_time)
+        movetime = available * self.phase_factor(board) * self.scale
+        movetime = min(self.max_movetime, max(self.min_movetime, movetime))
+        return SearchLimits(movetime_ms=int(movetime * 1000))
+
+    def record(self, stats: SearchStats):
+        # Book and cache answers take microseconds and would hide the search times in the p95
+        if stats.source in ("book", "cache"):
+            return
+        self.samples.append(stats.wall_time)
+        if stats.source != "engine":
+            return
+        # Engine and process overhead on top of movetime shows up here, correct for it on the next searches
+        available = max(self.min_movetime, self.latency_target - self.expected_motion_time)
+        p95 = self.percentile(95)
+        if p95 > available:
+            self.scale = max(0.25, self.scale * 0.9)
+        elif p95 < available * 0.8:
+            self.scale = min(1.0, self.scale * 1.05)
+
+    def percentile(self, percent: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
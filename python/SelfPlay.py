@@ -0,0 +1,180 @@
+# This file plays engine-vs-engine games without the Qt window to soak the whole move pipeline.
+
+# Every move goes through CNChess for the search and through Control.get_path, calculate_trajectory
+# and convert_to_step like a move on the real board. Games run in parallel, one process per core,
+# each with its own engine and Control. Moves that cannot be planned are reported with their FEN.
+# Each process keeps its path cache between games like a session does; its hit rate is reported and
+# the soak fails below --min-hit-rate. Every process warms its own cache, so the same games give a
+# lower rate when they are split over more processes (20 random games: 51.2% on 1, 36.4% on 4).
+#
+#   python SelfPlay.py --games 1000 --depth 4
+#   python SelfPlay.py --games 5000 --random --min-hit-rate 0.4   (random legal moves, no Stockfish needed)
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import chess
+
+from Control import Control, DistanceCost
+
+# Per-process state, set up by init_worker
+_worker = {}
+
+
+def init_worker(random_moves: bool, depth: int, random_plies: int, max_plies: int):
+    control = Control()
+    _worker.update(control=control, distance=DistanceCost(), random_plies=random_plies, max_plies=max_plies,
+                   cn_chess=None)
+    if not random_moves:
+        from CNChess import CNChess
+        from EnginePool import EnginePool
+
+        # One single-threaded engine per process, without book or result file so games stay independent
+        cn_chess = CNChess(EnginePool(size=1, threads=1, path=CNChess.stockfish_path, depth=depth),
+                           book_path="", cache_path="")
+        cn_chess.search_mode = "depth"
+        cn_chess.stockfish_depth = depth
+        _worker["cn_chess"] = cn_chess
+
+
+def play_game(seed: int) -> dict:
+    control = _worker["control"]
+    cn_chess = _worker["cn_chess"]
+    distance = _worker["distance"]
+    rng = random.Random(seed)
+    board = chess.Board()
+    control.graveyard.clear()
+    if cn_chess is not None:
+        cn_chess.engine_pool.new_game(cn_chess)
+    control.update_board_state(board)
+    stats = {"plies": 0, "waypoints": [], "distance": [], "motion_time": [], "plan_time": 0.0,
+             "search_time": 0.0, "failures": [], "result": "*"}
+    cache = control.path_cache
+    hits, misses = cache.hits, cache.misses
+
+    while not board.is_game_over() and stats["plies"] < _worker["max_plies"]:
+        started = time.perf_counter()
+        # A few random opening plies so the games differ
+        if cn_chess is None or stats["plies"] < _worker["random_plies"]:
+            move = rng.choice(list(board.legal_moves))
+        else:
+            move = cn_chess.get_best_move_for(board)
+        stats["search_time"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        path = control.get_path(move, board)
+        if path:
+            for cmd in control.calculate_trajectory(path):
+                control.convert_to_step(cmd.position)
+        stats["plan_time"] += time.perf_counter() - started
+
+        if path:
+            stats["waypoints"].append(len(path))
+            stats["distance"].append(distance.path_cost([cmd.position for cmd in path]))
+            stats["motion_time"].append(control.estimated_move_time)
+        else:
+            stats["failures"].append((board.fen(), move.uci()))
+        control.apply_move(board, move)
+        board.push(move)
+        stats["plies"] += 1
+
+    stats["result"] = board.result(claim_draw=True)
+    stats["cache_hits"] = cache.hits - hits
+    stats["cache_misses"] = cache.misses - misses
+    return stats
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def print_distribution(name: str, values: list[float], unit: str):
+    if not values:
+        print(f"{name}: no samples")
+        return
+    mean = sum(values) / len(values)
+    print(f"{name}: mean {mean:.2f}{unit}, p50 {percentile(values, 50):.2f}{unit}, "
+          f"p95 {percentile(values, 95):.2f}{unit}, max {max(values):.2f}{unit}")
+
+
+def soak(games: int, processes: int = None, random_moves: bool = False, depth: int = 4,
+         random_plies: int = 4, max_plies: int = 300, seed: int = 0, min_hit_rate: float = 0.0) -> int:
+    # Returns the number of failed checks: planning failures, plus one when the path cache hit rate is too low
+    processes = processes or os.cpu_count() or 1
+    started = time.perf_counter()
+    results = Counter()
+    waypoints = []
+    distances = []
+    motion_times = []
+    failures = []
+    plies = 0
+    plan_time = 0.0
+    search_time = 0.0
+    cache_hits = 0
+    cache_misses = 0
+
+    with multiprocessing.Pool(processes, initializer=init_worker,
+                              initargs=(random_moves, depth, random_plies, max_plies)) as pool:
+        for done, stats in enumerate(pool.imap_unordered(play_game, range(seed, seed + games)), 1):
+            results[stats["result"]] += 1
+            plies += stats["plies"]
+            waypoints += stats["waypoints"]
+            distances += stats["distance"]
+            motion_times += stats["motion_time"]
+            failures += stats["failures"]
+            plan_time += stats["plan_time"]
+            search_time += stats["search_time"]
+            cache_hits += stats["cache_hits"]
+            cache_misses += stats["cache_misses"]
+            if done % max(1, games // 10) == 0:
+                print(f"{done}/{games} games, {len(failures)} planning failures", flush=True)
+
+    wall = time.perf_counter() - started
+    print(f"Games: {games} in {wall:.1f} s on {processes} processes, {games / wall:.2f} games/s, "
+          f"{plies / wall:.0f} moves/s")
+    print("Results: " + ", ".join(f"{result} {count}" for result, count in results.most_common()))
+    print(f"Planning: {plan_time / max(1, plies) * 1000:.2f} ms per move, "
+          f"search {search_time / max(1, plies) * 1000:.2f} ms per move (process time summed)")
+    print(f"Planning failures: {len(failures)} of {plies} moves")
+    for fen, move in failures[:10]:
+        print(f"  {move} in {fen}")
+    print_distribution("Waypoints per move", waypoints, "")
+    print_distribution("Path length per move", distances, " squares")
+    print_distribution("Estimated motion time per move", motion_times, " s")
+    print("Waypoint histogram: " + ", ".join(f"{count}: {n}" for count, n in sorted(Counter(waypoints).items())))
+    if motion_times:
+        total = sum(motion_times)
+        print(f"Estimated motion time per game: {total / games:.1f} s, longest move {max(motion_times):.2f} s, "
+              f"{sum(1 for t in motion_times if t > 10) / len(motion_times) * 100:.2f}% over 10 s")
+    lookups = cache_hits + cache_misses
+    hit_rate = cache_hits / lookups if lookups else 0.0
+    print(f"Path cache: {cache_hits} hits of {lookups} lookups, hit rate {hit_rate:.1%}")
+    if hit_rate < min_hit_rate:
+        print(f"Path cache hit rate below {min_hit_rate:.1%}")
+        return len(failures) + 1
+    return len(failures)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless self-play soak test of the search and motion pipeline.")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes, defaults to the core count")
+    parser.add_argument("--random", action="store_true", help="Play random legal moves instead of Stockfish")
+    parser.add_argument("--depth", type=int, default=4, help="Engine search depth")
+    parser.add_argument("--random-plies", type=int, default=4, help="Random opening plies per game")
+    parser.add_argument("--max-plies", type=int, default=300, help="Plies before a game is adjourned")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-hit-rate", type=float, default=0.0,
+                        help="Fail when fewer path lookups hit the cache, e.g. 0.4")
+    args = parser.parse_args()
+    failed = soak(args.games, args.processes, args.random, args.depth, args.random_plies, args.max_plies,
+                  args.seed, args.min_hit_rate)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,327 @@
+# This file talks to a UCI engine process directly, in place of the stockfish wrapper.
+
+# The wrapper sends ucinewgame with every new position, which clears Stockfish's hash table and
+# history, so each search of a game starts cold. UciEngine keeps one process for the whole game:
+# positions go out as the game's start position plus its moves, ucinewgame only when another game
+# starts, and options only when their value changes. UCI has no incremental position command, but
+# the move list only ever grows by the moves played since the last search.
+#
+# Searches run in the background. go() returns a UciSearch that collects the info lines as they
+# arrive, optionally calling on_info(info) for each one, and can be stopped or told ponderhit.
+#
+#   engine = UciEngine("/usr/games/stockfish", {"Threads": 2, "Hash": 64})
+#   engine.set_position(board)
+#   search = engine.go(movetime_ms=500, on_info=print)
+#   best, ponder = search.wait(), search.ponder_move
+
+import subprocess
+import threading
+import time
+
+import chess
+
+# Integer fields of an info line and the UciInfo attribute they go to
+INFO_FIELDS = {"depth": "depth", "seldepth": "seldepth", "multipv": "multipv", "nodes": "nodes", "nps": "nps",
+               "time": "time_ms", "hashfull": "hashfull", "tbhits": "tbhits"}
+
+
+class UciError(Exception):
+    pass
+
+
+class UciInfo:
+    line: str
+    depth: int
+    seldepth: int
+    multipv: int
+    score_cp: int
+    mate: int
+    bound: str
+    nodes: int
+    nps: int
+    time_ms: int
+    hashfull: int
+    tbhits: int
+    pv: list[str]
+
+    def __init__(self, line: str = ""):
+        self.line = line
+        self.depth = 0
+        self.seldepth = 0
+        self.multipv = 1
+        self.score_cp = None  # Centipawns from the side to move, None with a mate score
+        self.mate = None      # Moves to mate, negative when the side to move gets mated
+        self.bound = None     # "lowerbound" or "upperbound" while the score is not exact
+        self.nodes = 0
+        self.nps = 0
+        self.time_ms = 0
+        self.hashfull = 0
+        self.tbhits = 0
+        self.pv = []
+
+    @classmethod
+    def parse(cls, line: str) -> 'UciInfo':
+        # Reads "info depth 12 seldepth 18 multipv 1 score cp 31 nodes 123456 nps 789000 time 156 pv e2e4 ..."
+        info = cls(line)
+        fields = line.split()
+        i = 1
+        while i < len(fields):
+            name = fields[i]
+            if name in INFO_FIELDS and i + 1 < len(fields):
+                try:
+                    setattr(info, INFO_FIELDS[name], int(fields[i + 1]))
+                except ValueError:
+                    pass
+                i += 2
+            elif name == "score" and i + 2 < len(fields):
+                try:
+                    value = int(fields[i + 2])
+                except ValueError:
+                    value = None
+                if fields[i + 1] == "cp":
+                    info.score_cp = value
+                elif fields[i + 1] == "mate":
+                    info.mate = value
+                i += 3
+            elif name in ("lowerbound", "upperbound"):
+                info.bound = name
+                i += 1
+            elif name == "pv":
+                info.pv = fields[i + 1:]
+                break
+            elif name == "string":
+                break
+            else:
+                i += 1
+        return info
+
+    def __repr__(self):
+        score = f"mate {self.mate}" if self.mate is not None else f"cp {self.score_cp}"
+        return f"UciInfo(depth {self.depth}, multipv {self.multipv}, {score}, pv {' '.join(self.pv[:4])})"
+
+
+class UciSearch:
+    # One go command, finished when the engine answers with bestmove
+    best_move: str
+    ponder_move: str
+    last_info: UciInfo
+    lines: dict[int, UciInfo]
+    pondering: bool
+    stopped: bool
+    started: float
+    duration: float
+
+    def __init__(self, engine: 'UciEngine', on_info=None, pondering: bool = False):
+        self.engine = engine
+        self.on_info = on_info
+        self.pondering = pondering
+        self.stopped = False    # Told to stop before its limits were reached
+        self.best_move = None   # UCI string, None when the position has no legal move
+        self.ponder_move = None  # Reply the engine expects, worth pondering on
+        self.last_info = None   # Last info line with a depth, for the search statistics
+        self.lines = {}         # multipv -> latest info with a principal variation
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.finished = threading.Event()
+
+    def _add_info(self, info: UciInfo):
+        if info.depth:
+            self.last_info = info
+        if info.pv:
+            self.lines[info.multipv] = info
+        if self.on_info is not None:
+            self.on_info(info)
+
+    def _finish(self, best_move: str, ponder_move: str):
+        self.best_move = best_move
+        self.ponder_move = ponder_move
+        self.duration = time.perf_counter() - self.started
+        self.finished.set()
+
+    def is_finished(self) -> bool:
+        return self.finished.is_set()
+
+    def wait(self, timeout: float = None) -> str:
+        # Best move once the search is over
+        if not self.finished.wait(timeout):
+            raise UciError("Search did not finish in time")
+        return self.best_move
+
+    def stop(self):
+        self.engine.stop(self)
+
+    def ponderhit(self):
+        self.engine.ponderhit(self)
+
+    def top_lines(self) -> list[UciInfo]:
+        # Latest line of each MultiPV rank, best first
+        return [self.lines[rank] for rank in sorted(self.lines)]
+
+
+class UciEngine:
+    path: str
+    name: str
+    options: dict
+    supported_options: set[str]
+    position: tuple
+    search: UciSearch
+    depth: int
+    positions_sent: int
+    new_games: int
+
+    def __init__(self, path: str, options: dict = None, timeout: float = 10.0):
+        self.path = path
+        self.name = path
+        self.options = {}            # Values sent so far, so unchanged options are not sent again
+        self.supported_options = set()
+        self.position = None         # (start FEN or None for startpos, moves) last sent
+        self.search = None
+        self.depth = None            # Depth of searches given no other limit, set by EnginePool on every checkout
+        self.positions_sent = 0
+        self.new_games = 0
+        self.write_lock = threading.Lock()  # Searches run on the engine thread, stop and quit may come from others
+        self.uciok = threading.Event()
+        self.readyok = threading.Event()
+        self.process = subprocess.Popen([path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.reader = threading.Thread(target=self._read, name=f"UCI {path}", daemon=True)
+        self.reader.start()
+        self._send("uci")
+        if not self.uciok.wait(timeout) or not self.is_alive():
+            self.quit()
+            raise UciError(f"{path} does not speak UCI")
+        for name, value in (options or {}).items():
+            self.set_option(name, value)
+        self.sync(timeout)
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _send(self, command: str):
+        with self.write_lock:
+            try:
+                self.process.stdin.write(command + "\n")
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError, ValueError) as e:
+                raise UciError(f"{self.name} is not running") from e
+
+    def _read(self):
+        # Reader thread: everything the engine prints goes through here
+        for line in self.process.stdout:
+            line = line.strip()
+            if line.startswith("info "):
+                search = self.search
+                if search is not None and not search.is_finished():
+                    search._add_info(UciInfo.parse(line))
+            elif line.startswith("bestmove"):
+                fields = line.split()
+                best_move = fields[1] if len(fields) > 1 and fields[1] not in ("(none)", "0000") else None
+                ponder_move = fields[3] if len(fields) > 3 and fields[2] == "ponder" else None
+                if self.search is not None:
+                    self.search._finish(best_move, ponder_move)
+            elif line == "readyok":
+                self.readyok.set()
+            elif line == "uciok":
+                self.uciok.set()
+            elif line.startswith("id name "):
+                self.name = line[len("id name "):]
+            elif line.startswith("option name "):
+                self.supported_options.add(line[len("option name "):].split(" type ")[0])
+        # The process exited, nothing will answer anymore
+        if self.search is not None and not self.search.is_finished():
+            self.search._finish(None, None)
+        self.uciok.set()
+        self.readyok.set()
+
+    def sync(self, timeout: float = 10.0):
+        # Waits until the engine has processed every command sent so far
+        self.readyok.clear()
+        self._send("isready")
+        if not self.readyok.wait(timeout) or not self.is_alive():
+            raise UciError(f"{self.name} did not answer isready")
+
+    def is_searching(self) -> bool:
+        return self.search is not None and not self.search.is_finished()
+
+    def set_option(self, name: str, value):
+        # Only sent when the value changes, some options (Hash) clear the engine's state
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        value = str(value)
+        if self.options.get(name) == value:
+            return
+        if self.supported_options and name not in self.supported_options:
+            return
+        if self.is_searching():
+            raise UciError(f"Cannot set {name} during a search")
+        self._send(f"setoption name {name} value {value}")
+        self.options[name] = value
+
+    def new_game(self):
+        # Next positions belong to another game: clear the hash and history
+        if self.is_searching():
+            raise UciError("Cannot start a new game during a search")
+        self._send("ucinewgame")
+        self.position = None
+        self.new_games += 1
+        self.sync()
+
+    def set_position(self, board: chess.Board):
+        # Game start plus every move played, so the engine sees repetitions and keeps its history
+        root = board.root()
+        start = None if root.fen() == chess.STARTING_FEN and not board.chess960 else root.fen()
+        moves = tuple(move.uci() for move in board.move_stack)
+        if (start, moves) == self.position:
+            return
+        if self.is_searching():
+            raise UciError("Cannot set the position during a search")
+        command = "position startpos" if start is None else f"position fen {start}"
+        if moves:
+            command += " moves " + " ".join(moves)
+        self._send(command)
+        self.position = (start, moves)
+        self.positions_sent += 1
+
+    def go(self, depth: int = None, movetime_ms: int = None, nodes: int = None, infinite: bool = False,
+           ponder: bool = False, multipv: int = 1, on_info=None) -> UciSearch:
+        # Starts a search of the last position and returns at once
+        if self.is_searching():
+            raise UciError("A search is already running")
+        self.set_option("MultiPV", multipv)
+        command = ["go"]
+        if ponder:
+            command.append("ponder")
+        if depth is not None:
+            command.append(f"depth {depth}")
+        if movetime_ms is not None:
+            command.append(f"movetime {max(1, int(movetime_ms))}")
+        if nodes is not None:
+            command.append(f"nodes {nodes}")
+        if infinite or len(command) == (2 if ponder else 1):
+            command.append("infinite")
+        self.search = UciSearch(self, on_info, ponder)
+        self._send(" ".join(command))
+        return self.search
+
+    def stop(self, search: UciSearch = None):
+        # bestmove still arrives, wait() on the search returns the best move found so far
+        if self.is_searching() and (search is None or search is self.search):
+            self.search.stopped = True
+            self._send("stop")
+
+    def ponderhit(self, search: UciSearch = None):
+        # The expected reply was played, the ponder search goes on as a normal one
+        if self.is_searching() and self.search.pondering and (search is None or search is self.search):
+            self.search.pondering = False
+            self._send("ponderhit")
+
+    def quit(self):
+        try:
+            self._send("quit")
+        except UciError:
+            pass
+        try:
+            self.process.wait(2.0)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
@@ -1,36 +1,91 @@
 # This file contains the main logic to start the CNChess application and manage its components.
+import logging
+import os
 import sys
+import time
+
+started = time.perf_counter()
+
 import chess
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QApplication
 
 from CNChess import CNChess
-from Control import Control
+from Metrics import metrics
 
 from ui.chess_view import ChessView
-from ui.chess_controller import ChessController
+
+# (stage, seconds since start-up) for the start-up report
+startup_stages = []
+
+
+def mark(stage: str):
+    elapsed = time.perf_counter() - started
+    startup_stages.append((stage, elapsed))
+    metrics.record(f"startup.{stage.replace(' ', '_')}", elapsed)
+
+
+def print_startup_report(game: CNChess):
+    previous = 0.0
+    for stage, elapsed in startup_stages:
+        print(f"Start-up: {stage:<12} {elapsed * 1000:7.1f} ms (+{(elapsed - previous) * 1000:.1f} ms)")
+        previous = elapsed
+    pool = game.engine_pool
+    if pool.start_error is not None:
+        print(f"Start-up: engine failed to start: {pool.start_error}")
+    elif pool.started.is_set():
+        print(f"Start-up: engine ready after {pool.start_time * 1000:.1f} ms in the background")
+    else:
+        print("Start-up: engine still starting in the background")
+
 
 if __name__ == "__main__":
 
+    # Per-move records of the controller go to the console
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # Create the Qt application
+    app = QApplication(sys.argv)
+    mark("Qt")
+
+    # The engine starts on its own thread, the first search waits for it only if needed
     game = CNChess()
     game.reset_game()
 
     game.set_player_color(chess.WHITE)
     game.set_elo(1320)
+    mark("game")
 
-    control = Control()
-    control.update_board_state(game.get_board_state())
-
-      # Create the Qt application
-    app = QApplication(sys.argv) 
-    # Create view and controller
+    # Create view
     view = ChessView(game)
-    controller = ChessController(game, view)
-    
-    # Set the controller in the view
-    view.controller = controller
-    
+    mark("window")
+
+    def finish_startup():
+        # Planner, controller and their imports come after the board is on screen
+        from Control import Control
+        from ui.chess_controller import ChessController
+
+        # Planned paths are kept next to the engine cache and reloaded at the next start
+        control = Control(path_cache_file=os.path.join(os.path.dirname(__file__), "path_cache.json"))
+        control.update_board_state(game.get_board())
+        # The controller shares this Control instead of building its own; the motor controller
+        # port is discovered unless CNCHESS_PORT names it
+        controller = ChessController(game, view, control, os.environ.get("CNCHESS_PORT"))
+        # Set the controller in the view
+        view.controller = controller
+        app.aboutToQuit.connect(controller.shutdown)
+        mark("controller")
+        print_startup_report(game)
+
+    def on_first_frame():
+        view.board_widget.painted.disconnect(on_first_frame)
+        mark("first frame")
+        QTimer.singleShot(0, finish_startup)
+
+    view.board_widget.painted.connect(on_first_frame)
+
     # Show the window
     view.show()
-    
+
     # Run the application event loop
     sys.exit(app.exec())
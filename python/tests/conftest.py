@@ -0,0 +1,5 @@
+# This file puts the python/ modules on the import path for the tests.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,99 @@
+# This file tests how Control turns chess moves into ordered gantry legs.
+import chess
+import pytest
+
+from Control import Control, Position
+
+
+def square(name: str) -> Position:
+    return Position(chess.square_file(chess.parse_square(name)) + 1, chess.square_rank(chess.parse_square(name)) + 1)
+
+
+def off_board(position: Position) -> bool:
+    return position.x in (0.0, 9.0) or position.y in (0.0, 9.0)
+
+
+def compile_legs(board: chess.Board, uci: str):
+    control = Control()
+    control.update_board_state(board)
+    occupancy = control.grid.occupancy
+    legs = control.compile_move(chess.Move.from_uci(uci), board)
+    assert control.grid.occupancy == occupancy  # Planning leaves the obstacles as they were
+    for leg in legs:
+        assert leg.path[0] == leg.start and leg.path[-1] == leg.end
+        assert leg.duration > 0
+    return control, legs
+
+
+def transfers(legs) -> list[tuple[Position, Position]]:
+    return [(leg.start, leg.end) for leg in legs]
+
+
+def test_quiet_move_is_one_leg():
+    _, legs = compile_legs(chess.Board(), "g1f3")
+    assert transfers(legs) == [(square("g1"), square("f3"))]
+    assert legs[0].piece == chess.Piece(chess.KNIGHT, chess.WHITE)
+
+
+def test_capture_clears_the_target_first():
+    board = chess.Board("rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2")
+    _, legs = compile_legs(board, "e4d5")
+    assert len(legs) == 2
+    assert legs[0].start == square("d5") and off_board(legs[0].end)
+    assert legs[0].piece == chess.Piece(chess.PAWN, chess.BLACK)
+    assert transfers(legs[1:]) == [(square("e4"), square("d5"))]
+
+
+@pytest.mark.parametrize("fen, uci, king, rook", [
+    ("r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1", "e1g1", ("e1", "g1"), ("h1", "f1")),
+    ("r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1", "e1c1", ("e1", "c1"), ("a1", "d1")),
+    ("r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R b KQkq - 0 1", "e8g8", ("e8", "g8"), ("h8", "f8")),
+])
+def test_castling_moves_king_and_rook(fen, uci, king, rook):
+    _, legs = compile_legs(chess.Board(fen), uci)
+    assert sorted(transfers(legs), key=lambda t: t[0].x) == sorted(
+        [(square(king[0]), square(king[1])), (square(rook[0]), square(rook[1]))], key=lambda t: t[0].x)
+    assert {leg.piece.piece_type for leg in legs} == {chess.KING, chess.ROOK}
+
+
+def test_chess960_castling_given_as_king_takes_rook():
+    board = chess.Board("r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1", chess960=True)
+    _, legs = compile_legs(board, "e1h1")
+    assert set(transfers(legs)) == {(square("e1"), square("g1")), (square("h1"), square("f1"))}
+
+
+def test_en_passant_removes_the_passed_pawn():
+    board = chess.Board("rnbqkbnr/ppp1pppp/8/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3")
+    _, legs = compile_legs(board, "e5d6")
+    assert len(legs) == 2
+    captured = [leg for leg in legs if leg.start == square("d5")]
+    assert len(captured) == 1 and off_board(captured[0].end)
+    assert captured[0].piece == chess.Piece(chess.PAWN, chess.BLACK)
+    assert (square("e5"), square("d6")) in transfers(legs)
+
+
+def test_promotion_brings_a_spare_piece():
+    board = chess.Board("7k/P7/8/8/8/8/8/K7 w - - 0 1")
+    control, legs = compile_legs(board, "a7a8q")
+    assert len(legs) == 2
+    pawn = [leg for leg in legs if leg.start == square("a7")]
+    assert len(pawn) == 1 and off_board(pawn[0].end)
+    assert pawn[0].piece == chess.Piece(chess.PAWN, chess.WHITE)
+    # No white queen in the graveyard: it comes from the overflow point
+    assert (control.graveyard.overflow_position, square("a8")) in transfers(legs)
+    assert chess.Piece(chess.QUEEN, chess.WHITE) in [leg.piece for leg in legs]
+
+
+def test_promotion_takes_a_parked_piece_back():
+    board = chess.Board("1r5k/P7/8/8/8/8/8/K7 w - - 0 1")
+    control = Control()
+    control.update_board_state(board)
+    slot = control.graveyard.choose_slot(square("h1"))
+    control.graveyard.commit([(slot, chess.Piece(chess.QUEEN, chess.WHITE))])
+    legs = control.compile_move(chess.Move.from_uci("a7b8q"), board)
+    assert len(legs) == 3
+    leaving = [leg for leg in legs if leg.start in (square("b8"), square("a7"))]
+    assert len(leaving) == 2 and all(off_board(leg.end) for leg in leaving)
+    # The queen comes back from its slot once the captured rook left b8
+    queen = transfers(legs).index((control.graveyard.position(slot), square("b8")))
+    assert queen > [leg.start for leg in legs].index(square("b8"))
@@ -0,0 +1,73 @@
+# This file tests the engine result cache.
+import random
+
+import chess
+
+from EngineCache import EngineCache
+
+E4 = chess.Move.from_uci("e2e4")
+D4 = chess.Move.from_uci("d2d4")
+
+
+def test_round_trip_in_memory():
+    cache = EngineCache()
+    board = chess.Board()
+    assert cache.get(board, "depth 10", -1) is None
+    cache.put(board, "depth 10", -1, E4)
+    assert cache.get(board, "depth 10", -1) == E4
+    # Other limits, Elo settings and positions are other keys
+    assert cache.get(board, "depth 12", -1) is None
+    assert cache.get(board, "depth 10", 1320) is None
+    board.push(E4)
+    assert cache.get(board, "depth 10", -1) is None
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_round_trip_through_the_file(tmp_path):
+    filename = str(tmp_path / "cache.sqlite")
+    cache = EngineCache(filename=filename)
+    board = chess.Board()
+    cache.put(board, "movetime 500", 1320, E4)
+    cache.put(board, "movetime 500", 1320, E4)
+    cache.put(board, "movetime 500", 1320, D4)
+    cache.close()
+
+    reopened = EngineCache(filename=filename)
+    assert reopened.get(board, "movetime 500", 1320, samples=3) in (E4, D4)
+    assert reopened.entries[next(iter(reopened.entries))] == {"e2e4": 2, "d2d4": 1}
+    reopened.close()
+
+
+def test_samples_hold_back_until_enough_results():
+    cache = EngineCache()
+    board = chess.Board()
+    for _ in range(3):
+        cache.put(board, "depth 10", 1320, E4)
+        assert cache.get(board, "depth 10", 1320, samples=4) is None
+    cache.put(board, "depth 10", 1320, D4)
+    random.seed(3)
+    picks = [cache.get(board, "depth 10", 1320, samples=4) for _ in range(400)]
+    # Replayed as often as the searches found them
+    assert set(picks) == {E4, D4}
+    assert 0.6 < picks.count(E4) / len(picks) < 0.9
+
+
+def test_lru_eviction():
+    cache = EngineCache(capacity=2)
+    boards = [chess.Board(), chess.Board(), chess.Board()]
+    boards[1].push(E4)
+    boards[2].push(D4)
+    cache.put(boards[0], "depth 10", -1, E4)
+    cache.put(boards[1], "depth 10", -1, chess.Move.from_uci("e7e5"))
+    assert cache.get(boards[0], "depth 10", -1) == E4
+    cache.put(boards[2], "depth 10", -1, chess.Move.from_uci("d7d5"))
+    assert cache.get(boards[1], "depth 10", -1) is None
+    assert cache.get(boards[0], "depth 10", -1) == E4
+
+
+def test_illegal_move_is_not_returned():
+    # A hash collision must not hand an illegal move to the game
+    cache = EngineCache()
+    board = chess.Board()
+    cache.put(board, "depth 10", -1, chess.Move.from_uci("e2e5"))
+    assert cache.get(board, "depth 10", -1) is None
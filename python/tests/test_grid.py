@@ -0,0 +1,108 @@
+# This file tests the roadmap search of Grid.
+import math
+import random
+
+import chess
+import pytest
+
+from Control import DIAGONAL_COST, Control, Grid, Position
+
+
+def node_path_ok(grid: Grid, path: list[Position]) -> bool:
+    # Every step goes to a neighboring node and no piece is crossed, the goal may be occupied
+    ids = [grid.get_node_id(position) for position in path]
+    for a, b in zip(ids, ids[1:]):
+        if b not in [neighbor for neighbor, _ in grid.roadmap.neighbors[a]]:
+            return False
+    return not any(grid.blocked[node_id] for node_id in ids[1:-1])
+
+
+def test_search_empty_board_is_diagonal():
+    grid = Grid(8, 8)
+    path, cost = grid.search(Position(1, 1), Position(8, 8))
+    assert path[0] == Position(1, 1)
+    assert path[-1] == Position(8, 8)
+    assert len(path) == 15
+    assert cost == pytest.approx(14 * DIAGONAL_COST)
+    assert cost == pytest.approx(grid.cost_model.path_cost(path))
+
+
+def test_search_off_grid():
+    grid = Grid(8, 8)
+    assert grid.search(Position(1, 1), Position(12, 1)) == ([], math.inf)
+    assert grid.search(Position(-3, 1), Position(1, 1)) == ([], math.inf)
+
+
+def test_search_goes_around_pieces_and_ends_on_occupied_goal():
+    grid = Grid(8, 8)
+    grid.set_occupancy(chess.Board())
+    start = Position(2, 1)  # b1 knight, lifted off its square
+    goal = Position(2, 8)   # b8 knight
+    grid.remove_obstacle(start)
+    path, cost = grid.search(start, goal)
+    assert path[0] == start and path[-1] == goal
+    assert node_path_ok(grid, path)
+    assert cost > 7.0  # The straight line crosses the b2 and b7 pawns
+
+
+def test_search_matches_dijkstra_under_motor_time():
+    # The A* heuristic must never overestimate: same cost as a search without one
+    control = Control()
+    grid = control.grid
+    rng = random.Random(7)
+    for _ in range(30):
+        grid.set_occupancy(rng.getrandbits(64) & rng.getrandbits(64))
+        start = Position(rng.randint(1, 8), rng.randint(1, 8))
+        goal = Position(rng.randint(1, 8), rng.randint(1, 8))
+        path, cost = grid.search(start, goal)
+        _, nearest_cost = grid.search_nearest(start, [grid.get_node_id(goal)])
+        assert cost == pytest.approx(nearest_cost)
+        assert node_path_ok(grid, path)
+
+
+def test_search_nearest_picks_cheapest_goal():
+    grid = Grid(8, 8)
+    goals = [grid.get_node_id(Position(8, 8)), grid.get_node_id(Position(3, 1))]
+    path, cost = grid.search_nearest(Position(1, 1), goals)
+    assert path[-1] == Position(3, 1)
+    assert cost == pytest.approx(grid.search(Position(1, 1), Position(3, 1))[1])
+    assert grid.search_nearest(Position(1, 1), []) == ([], math.inf)
+
+
+def test_smooth_path_collapses_clear_runs():
+    grid = Grid(8, 8)
+    path, _ = grid.search(Position(1, 1), Position(8, 8))
+    assert grid.smooth_path(path) == [Position(1, 1), Position(8, 8)]
+    path, _ = grid.search(Position(1, 1), Position(1, 8))
+    assert grid.smooth_path(path) == [Position(1, 1), Position(1, 8)]
+    assert grid.smooth_path(path[:2]) == path[:2]
+
+
+def test_smooth_path_keeps_clearance():
+    grid = Grid(8, 8)
+    rng = random.Random(11)
+    for _ in range(30):
+        grid.set_occupancy(rng.getrandbits(64) & rng.getrandbits(64))
+        start = Position(rng.randint(1, 8), rng.randint(1, 8))
+        goal = Position(rng.randint(1, 8), rng.randint(1, 8))
+        grid.remove_obstacle(start)
+        path, _ = grid.search(start, goal)
+        smoothed = grid.smooth_path(path)
+        assert smoothed[0] == path[0] and smoothed[-1] == path[-1]
+        assert len(smoothed) <= len(path)
+        # A shortcut keeps the clearance from every piece but the endpoints' own; a single grid
+        # step is kept as it is, even where it cuts a corner
+        ignore = 0
+        for position in (start, goal):
+            ignore |= 1 << grid.roadmap.squares[grid.get_node_id(position)]
+        steps = set(zip(path, path[1:]))
+        for a, b in zip(smoothed, smoothed[1:]):
+            assert (a, b) in steps or grid.has_line_of_sight(a, b, ignore)
+
+
+def test_smooth_path_turns_around_a_blocker():
+    grid = Grid(8, 8)
+    grid.add_obstacle(Position(4, 4))
+    path, _ = grid.search(Position(1, 1), Position(7, 7))
+    smoothed = grid.smooth_path(path)
+    assert len(smoothed) > 2
@@ -0,0 +1,105 @@
+# This file tests the framing and the windowed upload of the serial motion protocol.
+import os
+
+import pytest
+
+from MotionLink import SEQ_MODULO, MotionLink, MotionTransfer, Segment, checksum, decode_frame, encode_frame
+
+
+def test_checksum_is_xor_of_payload_bytes():
+    assert checksum("") == "00"
+    assert checksum("R") == f"{ord('R'):02X}"
+    assert checksum("S 1 2") == f"{ord('S') ^ ord(' ') ^ ord('1') ^ ord(' ') ^ ord('2'):02X}"
+
+
+def test_encode_frame():
+    assert encode_frame("R") == b"R*52\n"
+    assert encode_frame(Segment(-120, 35, True).payload(7)).startswith(b"S 7 -120 35 1*")
+
+
+def test_decode_frame_round_trip():
+    payload = Segment(400, -400, False).payload(255)
+    assert decode_frame(encode_frame(payload)) == ["S", "255", "400", "-400", "0"]
+    assert decode_frame(b"A 3 5*" + checksum("A 3 5").lower().encode() + b"\r\n") == ["A", "3", "5"]
+
+
+@pytest.mark.parametrize("line", [
+    b"",
+    b"A 3 5\n",               # No checksum
+    b"A 3 6*" + checksum("A 3 5").encode() + b"\n",  # Payload changed on the way
+    b"A 3 5*ZZ\n",
+    b"A \xff 5*00\n",          # Not ASCII
+])
+def test_decode_frame_rejects_corrupted_frames(line):
+    assert decode_frame(line) is None
+
+
+def make_transfer(count: int, first_seq: int = 0, window: int = 4):
+    sent = []
+    transfer = MotionTransfer([Segment(i, -i) for i in range(count)], first_seq, window, sent.append)
+    return transfer, sent
+
+
+def sequence_numbers(frames: list[bytes]) -> list[int]:
+    return [int(decode_frame(frame)[1]) for frame in frames]
+
+
+def test_transfer_keeps_the_window_full():
+    transfer, sent = make_transfer(6)
+    transfer.start(0.0)
+    assert sequence_numbers(sent) == [0, 1, 2, 3]
+    transfer.on_frame(["A", "3", "4"], 0.1)
+    assert len(sent) == 4  # Accepted is not done, the controller's queue is still full
+    transfer.on_frame(["D", "1"], 0.2)
+    assert sequence_numbers(sent) == [0, 1, 2, 3, 4, 5]
+    transfer.on_frame(["D", "5"], 0.3)
+    assert transfer.finished and transfer.error is None
+
+
+def test_transfer_resends_from_a_rejected_frame():
+    transfer, sent = make_transfer(4)
+    transfer.start(0.0)
+    transfer.on_frame(["A", "0", "7"], 0.1)
+    transfer.on_frame(["N", "1"], 0.1)
+    transfer.on_frame(["N", "1"], 0.1)  # The frames behind it are rejected too, rewind only once
+    assert sequence_numbers(sent) == [0, 1, 2, 3, 1, 2, 3]
+    assert transfer.retransmissions == 3
+
+
+def test_transfer_resends_after_an_ack_timeout():
+    transfer, sent = make_transfer(2)
+    transfer.start(0.0)
+    transfer.on_timeout(MotionLink.ACK_TIMEOUT + 0.1)
+    assert sequence_numbers(sent) == [0, 1, 0, 1]
+    for attempt in range(MotionLink.MAX_RETRIES):
+        transfer.on_timeout((attempt + 2) * (MotionLink.ACK_TIMEOUT + 0.1))
+    assert transfer.error is not None
+
+
+def test_transfer_wraps_the_sequence_numbers():
+    transfer, sent = make_transfer(4, first_seq=SEQ_MODULO - 2)
+    transfer.start(0.0)
+    assert sequence_numbers(sent) == [254, 255, 0, 1]
+    transfer.on_frame(["D", "1"], 0.1)
+    assert transfer.finished
+    assert transfer.end_seq == 2
+
+
+@pytest.mark.skipif(os.name != "posix", reason="the firmware emulator needs a pty")
+def test_run_against_the_firmware_emulator():
+    import serial
+
+    from FirmwareEmulator import FirmwareEmulator
+
+    emulator = FirmwareEmulator(time_scale=0.001, corruption=0.05)
+    emulator.start()
+    try:
+        link = MotionLink(serial.Serial(emulator.port, 115200, timeout=0.1))
+        assert link.reset()
+        segments = [Segment(40 * (-1) ** i, 40, i % 2 == 0) for i in range(20)]
+        assert link.run(segments)
+        assert link.segments_done == 20
+        assert emulator.position == [0, 800]
+        link.ser.close()
+    finally:
+        emulator.stop()
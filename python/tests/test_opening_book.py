@@ -0,0 +1,75 @@
+# This file tests the polyglot opening book.
+import chess
+import chess.polyglot
+
+from EngineCache import position_key
+from OpeningBook import ENTRY, OpeningBook, build_book, encode_move
+
+# Polyglot key of the start position, from the format's specification
+START_KEY = 0x463B96181691FC9C
+
+PGN = """[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 1-0
+
+[Result "1/2-1/2"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O d6 1/2-1/2
+
+[Result "0-1"]
+
+1. d4 d5 2. c4 e6 0-1
+"""
+
+
+def test_position_key_is_the_polyglot_key():
+    # Keys from the format's specification
+    board = chess.Board()
+    assert chess.polyglot.zobrist_hash(board) == START_KEY
+    assert position_key(board) == START_KEY
+    board.push_san("e4")
+    # Keys of 2^63 and above come back negative so SQLite can store them
+    assert position_key(board) == 0x823C9B50FD114196 - (1 << 64)
+    board.push_san("d5")
+    assert position_key(board) == 0x0756B94461C50FB0
+
+
+def test_encode_move():
+    board = chess.Board()
+    assert encode_move(board, chess.Move.from_uci("e2e4")) == (4 | 3 << 3 | 4 << 6 | 1 << 9)
+    # Castling is the king taking its own rook
+    board = chess.Board("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    assert encode_move(board, chess.Move.from_uci("e1g1")) == (7 | 4 << 6)
+    assert encode_move(board, chess.Move.from_uci("e1c1")) == (0 | 4 << 6)
+    board = chess.Board("8/P6k/8/8/8/8/8/K7 w - - 0 1")
+    assert encode_move(board, chess.Move.from_uci("a7a8q")) >> 12 == 4
+    assert encode_move(board, chess.Move.from_uci("a7a8n")) >> 12 == 1
+
+
+def test_built_book_reads_back(tmp_path):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text(PGN)
+    output = str(tmp_path / "book.bin")
+    assert build_book([str(pgn)], output, max_ply=8, min_games=2) > 0
+    assert (tmp_path / "book.bin").stat().st_size % ENTRY.size == 0
+
+    board = chess.Board()
+    with chess.polyglot.open_reader(output) as reader:
+        # 1. d4 came up once only, under min_games
+        assert [entry.move for entry in reader.find_all(board)] == [chess.Move.from_uci("e2e4")]
+        for san in ("e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5"):
+            board.push_san(san)
+        # python-chess decodes the king-takes-rook entry back into standard castling
+        assert [entry.move for entry in reader.find_all(board)] == [chess.Move.from_uci("e1g1")]
+
+    book = OpeningBook(output)
+    assert book.get_move(board) == chess.Move.from_uci("e1g1")
+    board.push_san("O-O")
+    assert book.get_move(board) is None  # Nf6 and d6 came up once each
+    book.close()
+
+
+def test_missing_book_has_no_moves(tmp_path):
+    book = OpeningBook(str(tmp_path / "missing.bin"))
+    assert book.get_move(chess.Board()) is None
+    assert OpeningBook("").get_move(chess.Board()) is None
@@ -0,0 +1,85 @@
+# This file tests the path cache used by Control.
+import chess
+
+from Control import Control, Position
+from PathCache import CachedPath, PathCache
+
+PATH = 1 << chess.D4
+CORRIDOR = 1 << chess.E4 | 1 << chess.E5
+
+
+def make_entry(occupancy: int) -> CachedPath:
+    return CachedPath((1, 2, 3), occupancy, PATH, CORRIDOR)
+
+
+def test_is_valid_for_ignores_squares_outside_the_masks():
+    entry = make_entry(1 << chess.E4 | 1 << chess.A1)
+    assert entry.occupancy == 1 << chess.E4  # a1 is neither on the path nor in its corridor
+    assert entry.is_valid_for(1 << chess.E4)
+    assert entry.is_valid_for(1 << chess.E4 | 1 << chess.H8)
+
+
+def test_is_valid_for_rejects_a_piece_on_the_path():
+    entry = make_entry(0)
+    assert not entry.is_valid_for(1 << chess.D4)
+
+
+def test_is_valid_for_rejects_a_freed_corridor_square():
+    # A piece leaving the corridor may open a shorter path
+    entry = make_entry(1 << chess.E4)
+    assert not entry.is_valid_for(0)
+
+
+def test_is_valid_for_accepts_pieces_arriving_in_the_corridor():
+    # Obstacles off the path only make the alternatives worse
+    entry = make_entry(1 << chess.E4)
+    assert entry.is_valid_for(1 << chess.E4 | 1 << chess.E5)
+
+
+def test_lookup_and_lru_eviction():
+    cache = PathCache(capacity=2)
+    cache.store(1, 2, make_entry(0))
+    cache.store(3, 4, make_entry(0))
+    assert cache.lookup(1, 2, 0) is not None  # 1 -> 2 is now the most recent
+    cache.store(5, 6, make_entry(0))
+    assert cache.lookup(3, 4, 0) is None
+    assert cache.lookup(1, 2, 0) is not None
+    assert cache.lookup(1, 2, 1 << chess.D4) is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_corridor_hit_is_counted():
+    cache = PathCache()
+    cache.store(1, 2, make_entry(1 << chess.E4))
+    assert cache.lookup(1, 2, 1 << chess.E4 | 1 << chess.E5) is not None
+    assert cache.corridor_hits == 1
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / "paths.json")
+    cache = PathCache(filename=filename, namespace="distance")
+    cache.store(1, 2, make_entry(1 << chess.E4))
+    cache.store(3, 4, make_entry(0))
+    cache.save()
+
+    loaded = PathCache(filename=filename, namespace="distance")
+    assert list(loaded.entries) == list(cache.entries)
+    assert loaded.lookup(1, 2, 1 << chess.E4).path == (1, 2, 3)
+    # Paths planned for another objective are not loaded
+    assert not PathCache(filename=filename, namespace="motor_time").entries
+
+
+def test_cached_path_matches_a_fresh_search():
+    control = Control()
+    board = chess.Board()
+    control.update_board_state(board)
+    start = Position(2, 1)
+    goal = Position(3, 3)
+    control.grid.remove_obstacle(start)
+    first = control.find_path(start, goal)
+    # A piece moving far from the corridor leaves the planned path valid
+    occupancy = control.grid.occupancy & ~(1 << chess.H7) | 1 << chess.H5
+    control.grid.set_occupancy(occupancy)
+    assert control.find_path(start, goal) == first
+    assert control.path_cache.hits == 1
+    assert first == control.grid.search(start, goal)[0]
@@ -0,0 +1,280 @@
+"""Analysis - Infinite MultiPV analysis on its own engine thread, throttled and cached for the coaching view."""
+
+import os
+import threading
+from collections import OrderedDict
+
+import chess
+from PyQt6.QtCore import QObject, Qt, QThread, QTimer, pyqtSignal, pyqtSlot
+
+from UciEngine import UciEngine, UciError
+
+
+def position_key(board):
+    """Identify a position regardless of the move counters, so transpositions share their analysis."""
+    return " ".join(board.fen().split()[:4])
+
+
+class AnalysisLine:
+    """One principal variation with its score from White's point of view."""
+
+    def __init__(self, info, turn):
+        """Build the line from an engine info line of a position with turn to move."""
+        sign = 1 if turn == chess.WHITE else -1
+        self.rank = info.multipv
+        self.depth = info.depth
+        self.score_cp = None if info.score_cp is None else sign * info.score_cp
+        self.mate = None if info.mate is None else sign * info.mate
+        self.pv = info.pv
+
+    def score_text(self):
+        """Score as shown to the player, e.g. +0.31 or #-3."""
+        if self.mate is not None:
+            return f"#{self.mate}"
+        return f"{(self.score_cp or 0) / 100:+.2f}"
+
+    def san(self, board, max_moves=6):
+        """First moves of the line in SAN, played from board."""
+        board = board.copy(stack=False)
+        moves = []
+        for uci in self.pv[:max_moves]:
+            move = chess.Move.from_uci(uci)
+            if not board.is_legal(move):
+                break
+            moves.append(board.san(move))
+            board.push(move)
+        return " ".join(moves)
+
+
+class PositionAnalysis:
+    """Best lines found so far for one position."""
+
+    def __init__(self, board):
+        """Start an empty analysis of board."""
+        self.board = board.copy(stack=False)
+        self.key = position_key(board)
+        self.depth = 0
+        self.lines = {}  # MultiPV rank -> AnalysisLine
+
+    def add(self, info):
+        """Take in an engine info line; bound scores are skipped, they make the bar jump around."""
+        if not info.pv or info.bound is not None:
+            return
+        self.lines[info.multipv] = AnalysisLine(info, self.board.turn)
+        if info.multipv == 1:
+            self.depth = max(self.depth, info.depth)
+
+    def copy(self):
+        """Snapshot to hand to the GUI thread."""
+        analysis = PositionAnalysis.__new__(PositionAnalysis)
+        analysis.board = self.board
+        analysis.key = self.key
+        analysis.depth = self.depth
+        analysis.lines = dict(self.lines)
+        return analysis
+
+    def top_lines(self):
+        """Lines best first."""
+        return [self.lines[rank] for rank in sorted(self.lines)]
+
+    def best_line(self):
+        """Best line, None before the first info arrived."""
+        return self.lines.get(1)
+
+    def hint(self):
+        """Best move, None before the first info arrived."""
+        line = self.best_line()
+        return chess.Move.from_uci(line.pv[0]) if line else None
+
+
+class AnalysisWorker(QObject):
+    """Owns the analysis engine on its own thread and forwards its info lines at most once per frame."""
+
+    updated = pyqtSignal(int, object)  # generation, PositionAnalysis snapshot
+    failed = pyqtSignal(str)
+
+    STOP_TIMEOUT = 2.0  # Seconds for bestmove after stop before the engine is restarted
+
+    def __init__(self, path, threads, line_count, interval_ms):
+        """Remember the engine settings; the engine starts on the analysis thread with start()."""
+        super().__init__()
+        self.path = path
+        self.threads = threads
+        self.line_count = line_count
+        self.interval_ms = interval_ms
+        self.engine = None
+        self.search = None
+        self.analysis = None
+        self.generation = 0
+        self.dirty = False
+        self.lock = threading.Lock()  # Info lines arrive on the engine's reader thread
+        self.flush_timer = None
+
+    @pyqtSlot()
+    def start(self):
+        """Start the engine and the timer that forwards its lines."""
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self._flush)
+        self._start_engine()
+
+    def _start_engine(self):
+        """Start the engine process, reporting why when it cannot run."""
+        try:
+            self.engine = UciEngine(self.path, {"Threads": self.threads, "Hash": 64})
+        except (OSError, UciError) as e:
+            self.engine = None
+            self.failed.emit(f"Analysis engine failed to start: {e}")
+
+    @pyqtSlot(int, object)
+    def analyse(self, generation, board):
+        """Analyse board until stopped, replacing the running analysis."""
+        if self.engine is None:
+            return
+        self._stop_search()
+        analysis = PositionAnalysis(board)
+        with self.lock:
+            self.generation = generation
+            self.analysis = analysis
+            self.dirty = False
+        try:
+            self.engine.set_position(board)
+            self.search = self.engine.go(infinite=True, multipv=self.line_count,
+                                         on_info=lambda info: self._on_info(analysis, info))
+        except UciError as e:
+            self.engine = None
+            self.failed.emit(str(e))
+            return
+        self.flush_timer.start(self.interval_ms)
+
+    @pyqtSlot()
+    def stop(self, restart=True):
+        """Stop analysing, the engine then sleeps."""
+        self._stop_search(restart)
+        if self.flush_timer is not None:
+            self.flush_timer.stop()
+        self._flush()
+
+    @pyqtSlot()
+    def close(self):
+        """Stop analysing and quit the engine."""
+        self.stop(restart=False)
+        if self.engine is not None:
+            self.engine.quit()
+            self.engine = None
+
+    def _stop_search(self, restart=True):
+        """Stop the running search and wait for its bestmove; an engine that does not answer is restarted."""
+        if self.search is not None and not self.search.is_finished():
+            try:
+                self.search.stop()
+                self.search.wait(self.STOP_TIMEOUT)
+            except UciError:
+                # Still searching as far as we know, the next go would be refused
+                self.engine.quit()
+                self.engine = None
+                if restart:
+                    self._start_engine()
+        self.search = None
+
+    def _on_info(self, analysis, info):
+        """Collect an info line; runs on the engine's reader thread."""
+        with self.lock:
+            analysis.add(info)
+            if analysis is self.analysis:
+                self.dirty = True
+
+    def _flush(self):
+        """Send the latest lines to the GUI if they changed since the last frame."""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            generation = self.generation
+            snapshot = self.analysis.copy()
+        self.updated.emit(generation, snapshot)
+
+
+class AnalysisClient(QObject):
+    """GUI-side handle on the analysis thread, with the analysis of every position seen so far."""
+
+    updated = pyqtSignal(object)  # PositionAnalysis of the position being analysed
+    failed = pyqtSignal(str)
+
+    CACHE_SIZE = 512
+    LINE_COUNT = 3
+
+    _start_requested = pyqtSignal()
+    _analyse_requested = pyqtSignal(int, object)
+    _stop_requested = pyqtSignal()
+    _close_requested = pyqtSignal()
+
+    def __init__(self, engine_path, threads=None, interval_ms=16, parent=None):
+        """Start the analysis thread; the engine itself starts on the first analyse()."""
+        # The controller stops the analysis before the computer searches and does not ponder while
+        # coaching, so the engines take turns and the analysis gets as many threads as the playing one
+        super().__init__(parent)
+        self.cache = OrderedDict()  # Position key -> deepest PositionAnalysis, least recently used first
+        self.generation = 0
+        self.key = None             # Position being analysed, None while stopped
+        self.started = False
+        self.thread = QThread()
+        self.worker = AnalysisWorker(engine_path, threads or os.cpu_count() or 1, self.LINE_COUNT, interval_ms)
+        self.worker.moveToThread(self.thread)
+        self._start_requested.connect(self.worker.start)
+        self._analyse_requested.connect(self.worker.analyse)
+        self._stop_requested.connect(self.worker.stop)
+        self._close_requested.connect(self.worker.close, Qt.ConnectionType.BlockingQueuedConnection)
+        self.worker.updated.connect(self._on_updated)
+        self.worker.failed.connect(self.failed)
+        self.thread.start()
+
+    def analyse(self, board):
+        """Show the cached analysis of board at once, then keep deepening it in the background."""
+        if not self.started:
+            self.started = True
+            self._start_requested.emit()
+        key = position_key(board)
+        if key == self.key:
+            return
+        self.key = key
+        self.generation += 1
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.updated.emit(cached)
+        if board.is_game_over():
+            self._stop_requested.emit()
+            return
+        self._analyse_requested.emit(self.generation, board.copy())
+
+    def cached(self, board):
+        """Analysis of board from the cache, None when it was never analysed."""
+        return self.cache.get(position_key(board))
+
+    def stop(self):
+        """Stop analysing, e.g. while the playing engine searches."""
+        if self.key is None:
+            return
+        self.key = None
+        self.generation += 1
+        self._stop_requested.emit()
+
+    def shutdown(self):
+        """Quit the engine and stop the analysis thread."""
+        self.generation += 1
+        if self.started:
+            self._close_requested.emit()
+        self.thread.quit()
+        self.thread.wait()
+
+    def _on_updated(self, generation, analysis):
+        """Cache the lines and forward them, unless the cache already has a deeper analysis."""
+        cached = self.cache.get(analysis.key)
+        if cached is not None and cached.depth > analysis.depth:
+            return
+        self.cache[analysis.key] = analysis
+        self.cache.move_to_end(analysis.key)
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        if generation == self.generation:
+            self.updated.emit(analysis)
@@ -1,29 +1,62 @@
 """Chess Controller - Handles user interactions with CNChess."""
 
+import logging
+
 import chess
-from Control import Control
-from PyQt6.QtCore import QTimer
+from CNChess import BoardSnapshot
+from Control import Command, Control
+from Metrics import metrics
+from ui.engine_worker import EngineClient
+from ui.analysis import AnalysisClient, position_key
+from ui.motion_executor import MotionExecutor, MotionPlan
+
+log = logging.getLogger(__name__)
 
 
 class ChessController:
     """Controller for managing chess game logic and user interactions."""
     
-    def __init__(self, cn_chess, view=None):
-        """Initialize the controller with CNChess instance and optional view."""
+    def __init__(self, cn_chess, view=None, control=None, port=None):
+        """Initialize the controller with CNChess instance, optional view, the shared Control and a preferred port."""
         self.cn_chess = cn_chess
         self.view = view
         self.selected_piece = None
-        self.computer_timer = QTimer()
-        self.computer_timer.timeout.connect(self.handle_computer_move)
+        self.engine = EngineClient(cn_chess)
+        self.engine.move_ready.connect(self.on_computer_move_ready)
+        self.engine.candidates_ready.connect(self.on_candidates_ready)
+        self.engine.search_failed.connect(self.on_search_failed)
+        self.engine.ponder_failed.connect(self.on_ponder_failed)
+        self.searching = False  # The board is locked while the computer's move is being searched
         self.cn_chess.set_player_color(chess.WHITE)
-        self.control = Control()
-        self.control.update_board_state(self.cn_chess.get_board_state())
+        self.control = control if control is not None else Control()
+        self.control.update_board_state(self.cn_chess.get_board())
+        # Motion runs on its own thread and is simulated until a motor controller is connected
+        self.motion = MotionExecutor(port)
+        self.motion.connected.connect(self.on_motion_connected)
+        self.motion.started.connect(self.on_motion_started)
+        self.motion.progress.connect(self.on_motion_progress)
+        self.motion.finished.connect(self.on_motion_finished)
+        self.motion.idle.connect(self.on_motion_idle)
+        # Coaching mode: the analysis engine only starts the first time it is switched on
+        self.coaching = False
+        self.analysis = None
+        self.browse_ply = None  # Ply shown while stepping through the game, None for the live position
+
     def set_view(self, view):
         """Set the view after initialization."""
         self.view = view
     
     def handle_square_click(self, row, col):
         """Handle a user click on a square."""
+        if self.motion.is_connected() and self.motion.is_busy():
+            # Keep hands off the board while the gantry moves pieces
+            return
+        if self.searching:
+            return
+        if self.browse_ply is not None:
+            # Back to the live position first, moves are only played there
+            self.step_through_game(len(self.cn_chess.get_board().move_stack))
+            return
         if self.selected_piece is None:
             # No piece selected - select a piece if there is one
             piece = self._get_piece_at(row, col)
@@ -54,27 +87,23 @@ class ChessController:
     
     def reset_board(self):
         """Reset the chess board to the starting position."""
+        self.engine.cancel()
+        self.searching = False
         self.cn_chess.reset_game()
+        self.control.graveyard.clear()
+        self.control.update_board_state(self.cn_chess.get_board())
         self.selected_piece = None
+        self.browse_ply = None
+        if self.view:
+            self.view.board_widget.show_snapshot(None)
         self._update_view()
+        self._update_analysis()
     
     def _get_piece_at(self, row, col):
-        """Get piece at position from board state."""
+        """Get piece at position from the board snapshot."""
         if 0 <= row < 8 and 0 <= col < 8:
-            fen = self.cn_chess.get_board_state()
-            board_str = fen.split(' ')[0]
-            rows = board_str.split('/')
-            board_row = rows[row]
-            
-            col_index = 0
-            for char in board_row:
-                if char.isdigit():
-                    col_index += int(char)
-                else:
-                    if col_index == col:
-                        return char
-                    col_index += 1
-            return '_'
+            piece = self.cn_chess.get_snapshot().piece_at(chess.square(col, 7 - row))
+            return piece.symbol() if piece else '_'
         return None
     
     def _try_move_piece(self, from_row, from_col, to_row, to_col):
@@ -87,29 +116,17 @@ class ChessController:
         from_square = chess.square(from_col, 7 - from_row)
         to_square = chess.square(to_col, 7 - to_row)
         
-        try:
-            
-            move = chess.Move(from_square, to_square)
-            
-            # Validate move with promotion if needed
-            if self.cn_chess.validate_move(move):
-                self.cn_chess.make_move(move)
-                if self.cn_chess.get_turn() == self.cn_chess.computer_color:
-                    self.computer_timer.start(1000)
-                return True
-            else:
-                # Try as promotion move for pawns
-                for promotion in [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]:
-                    move = chess.Move(from_square, to_square, promotion=promotion)
-                    if self.cn_chess.validate_move(move):
-                        self.cn_chess.make_move(move)
-                        return True
-        except Exception:
-            pass
-        
-        self.control.update_board_state(self.cn_chess.get_board_state())
+        # Legal moves are indexed by from-square, pawns reaching the last rank promote to a queen
+        move = self.cn_chess.get_snapshot().find_move(from_square, to_square, chess.QUEEN)
+        if move is None:
+            return False
 
-        return False
+        # Played by hand, captured pieces are not in the graveyard
+        self.control.apply_move(self.cn_chess.get_board(), move, by_gantry=False)
+        self.cn_chess.make_move(move)
+        if self.cn_chess.get_turn() == self.cn_chess.computer_color:
+            self.handle_computer_move()
+        return True
     
     
     def _update_view(self):
@@ -118,26 +135,168 @@ class ChessController:
             self.view.on_board_changed(self.selected_piece)
 
     def handle_computer_move(self):
-        """Handle the computer's move."""
-        self.computer_timer.stop()
-
+        """Start the computer's search; the move is played when the engine thread answers."""
         if self.cn_chess.check_game_over():
             return
 
-        # Get computer's best move
-        computer_move = self.cn_chess.get_next_best_move()
+        # The search gets the cores the analysis was using
+        self._update_analysis()
+        # Latency of this answer is measured from here to the board update
+        metrics.begin_move()
+        self.searching = True
+        self.engine.request_move(self.cn_chess.get_board().copy())
+
+    def on_candidates_ready(self, candidates):
+        """Send the gantry toward the likely answers while the engine keeps searching."""
+        if self.cn_chess.get_turn() != self.cn_chess.computer_color:
+            return
+        self.control.update_board_state(self.cn_chess.get_board())
+        target = self.control.preplan(candidates, self.cn_chess.get_board())
+        if target != self.control.current_position:
+            self.motion.execute(MotionPlan(self.control, [Command(target, False)]))
+
+    def on_computer_move_ready(self, computer_move):
+        """Play the move found by the engine thread."""
+        self.searching = False
+        if self.cn_chess.get_turn() != self.cn_chess.computer_color:
+            return
 
         if computer_move and self.cn_chess.validate_move(computer_move):
-            self.control.update_board_state(self.cn_chess.get_board_state())
-            path = self.control.get_path(computer_move)
-            self.control.print_path(path)
+            self.control.update_board_state(self.cn_chess.get_board())
+            path = self.control.get_path(computer_move, self.cn_chess.get_board())
+            self.motion.execute(MotionPlan(self.control, path))
+            # Next search budget leaves room for a similar gantry move
+            self.cn_chess.set_expected_motion_time(self.control.estimated_move_time)
+            self.control.apply_move(self.cn_chess.get_board(), computer_move)
             self.cn_chess.make_move(computer_move)
+            # The trajectory stays on the board until the gantry is done with it
             self.view.board_widget.set_trajectory(path)
             self.view.board_widget.set_computer_turn(True)
             # Update the view
             self._update_view()
-            self.view.board_widget.set_computer_turn(False)
+            # One record per computer move: latency by stage, how the move was found and the gantry's share
+            log.info("%s | %s | %d waypoints, %.1f s of motion", metrics.end_move(computer_move.uci()),
+                     self.cn_chess.get_search_stats(), len(path), self.control.estimated_move_time)
             
             # Check if now it's player's turn again
             if self.cn_chess.get_turn() == self.cn_chess.player_color:
-                self.selected_piece = None
\ No newline at end of file
+                self.selected_piece = None
+                # Think on the player's time so the next answer can be instant, unless the coach uses it
+                if not self.cn_chess.check_game_over() and not self.coaching:
+                    self.engine.ponder(self.cn_chess.get_board().copy())
+            self._update_analysis()
+
+    def on_search_failed(self, message):
+        """Report the failed search and unlock the board, the computer's move can then be played by hand."""
+        log.warning(message)
+        self.searching = False
+        self.selected_piece = None
+        if self.view:
+            self.view.show_message(message)
+        self._update_view()
+
+    def on_ponder_failed(self, message):
+        """Pondering only saves time, the next search runs without it."""
+        log.warning(message)
+
+    def set_coaching(self, enabled):
+        """Switch the live analysis of the human's positions on or off."""
+        self.coaching = enabled
+        if enabled and self.analysis is None:
+            # Same threads as the playing engine, the two never search at once
+            self.analysis = AnalysisClient(self.cn_chess.stockfish_path, self.cn_chess.engine_pool.threads)
+            self.analysis.updated.connect(self.on_analysis_updated)
+            self.analysis.failed.connect(self.on_analysis_failed)
+        if enabled:
+            self.engine.stop_ponder()
+        self._update_analysis()
+
+    def step_through_game(self, step):
+        """Show the position step plies earlier or later; stepping past the last move returns to the game."""
+        board = self.cn_chess.get_board()
+        moves = len(board.move_stack)
+        current = moves if self.browse_ply is None else self.browse_ply
+        ply = max(0, min(moves, current + step))
+        self.browse_ply = None if ply == moves else ply
+        snapshot = None
+        if self.browse_ply is not None:
+            # Negative versions never collide with the game's own snapshots
+            snapshot = BoardSnapshot(self._displayed_board(), -1 - ply)
+        self.selected_piece = None
+        if self.view:
+            self.view.board_widget.show_snapshot(snapshot)
+        self._update_view()
+        self._update_analysis()
+
+    def _displayed_board(self):
+        """Board of the position on display."""
+        board = self.cn_chess.get_board()
+        if self.browse_ply is None:
+            return board
+        shown = board.copy()
+        while len(shown.move_stack) > self.browse_ply:
+            shown.pop()
+        return shown
+
+    def _update_analysis(self):
+        """Analyse the displayed position while the human thinks, and stop while the computer does."""
+        if self.analysis is None:
+            return
+        board = self._displayed_board()
+        humans_turn = self.browse_ply is not None or board.turn == self.cn_chess.player_color
+        if self.coaching and humans_turn and not board.is_game_over():
+            self.analysis.analyse(board)
+            return
+        self.analysis.stop()
+        if self.view:
+            self.view.show_analysis(self.analysis.cached(board) if self.coaching and humans_turn else None)
+
+    def on_analysis_updated(self, analysis):
+        """Show the streamed lines if they are about the displayed position."""
+        if self.coaching and self.view and analysis.key == position_key(self._displayed_board()):
+            self.view.show_analysis(analysis)
+
+    def on_analysis_failed(self, message):
+        """Leave the coaching mode when its engine cannot run."""
+        log.warning(message)
+        if self.view and self.view.coach_button:
+            self.view.coach_button.setChecked(False)
+        else:
+            self.set_coaching(False)
+
+    def on_motion_connected(self, port):
+        """Start from home, simulated motion never moved the gantry."""
+        if not self.motion.is_busy():
+            self.control.set_home()
+
+    def on_motion_started(self, plan):
+        """Animate the gantry while it moves."""
+        if self.view:
+            self.view.board_widget.start_gantry_animation(self.motion.gantry_at)
+
+    def on_motion_progress(self, position, magnet, seconds_left):
+        """Show how long the gantry still needs."""
+        if self.view:
+            self.view.on_motion_progress(seconds_left)
+
+    def on_motion_finished(self, plan, ok):
+        """Report motion the controller could not complete."""
+        if not ok:
+            log.warning("Motion failed, re-home the gantry before the next move.")
+
+    def on_motion_idle(self):
+        """Clear the trajectory once the gantry stopped."""
+        if self.view:
+            self.view.board_widget.set_computer_turn(False)
+            self.view.on_motion_progress(None)
+            self._update_view()
+
+    def shutdown(self):
+        """Stop background work before the application exits."""
+        self.engine.shutdown()
+        self.motion.shutdown()
+        self.control.path_cache.save()
+        if self.analysis is not None:
+            self.analysis.shutdown()
+        if metrics.export_path:
+            metrics.write_prometheus()
\ No newline at end of file
@@ -1,12 +1,13 @@
 """Chess View - PyQt-based UI for displaying the chess board."""
 
+import math
 import os
 import sys
+import time
+import chess
 from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QPushButton, QHBoxLayout, QLabel
-from PyQt6.QtCore import Qt, pyqtSignal, QSize, QFile
-from PyQt6.QtGui import QPainter, QColor, QPixmap, QFont, QPen
-from PyQt6 import uic
-from Control import Position, Command
+from PyQt6.QtCore import Qt, pyqtSignal, QSize, QFile, QRect, QRectF, QTimer, QPointF
+from PyQt6.QtGui import QAction, QPainter, QColor, QPixmap, QFont, QPen, QRegion, QPolygonF
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
@@ -16,11 +17,17 @@ class ChessBoardWidget(QWidget):
     """Custom widget for drawing the chess board and handling clicks."""
     
     piece_clicked = pyqtSignal(int, int)  # Signal emitted when a square is clicked
+    painted = pyqtSignal()  # Emitted after every paint, used to time the first frame
     
     # Board colors
     LIGHT_COLOR = QColor(240, 217, 181)
     DARK_COLOR = QColor(181, 136, 99)
     HIGHLIGHT_COLOR = QColor(100, 200, 150, 120)
+    TRAJECTORY_WIDTH = 3
+    GANTRY_COLOR = QColor(30, 90, 200)
+    GANTRY_RADIUS = 9
+    HINT_COLOR = QColor(40, 160, 60, 190)
+    HINT_WIDTH = 8
     
     def __init__(self, cn_chess, parent=None):
         """Initialize the chess board widget."""
@@ -31,12 +38,31 @@ class ChessBoardWidget(QWidget):
         self.square_size = self.board_size // 8
         self.computer_turn = False
         self.trajectory = []
+        self.shown_trajectory = []  # Trajectory captured at the last board change
+        self.gantry = None          # (position, magnet on) drawn while the gantry moves
+        self.gantry_source = None   # Returns the gantry's estimated (position, magnet on), None once it stopped
+        self.hint = None            # Move drawn as an arrow in coaching mode
+        self.display_snapshot = None  # Earlier position shown while stepping through the game, None for the game
+        self.animation_timer = QTimer(self)
+        self.animation_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.animation_timer.timeout.connect(self._animate_gantry)
         
         # Load piece images
         self.piece_images = self._load_piece_images()
+        # Render caches, rebuilt when the square size or device pixel ratio changes
+        self.background = None
+        self.background_key = None
+        self.scaled_pieces = {}
+        # Board as last scheduled for painting, row 0 is rank 8
+        self.version = self._snapshot().version
+        self.squares = self._read_board()
+        # Moves on the live board arrive as the squares they changed, only those are repainted
+        self.cn_chess.add_board_listener(self.on_squares_changed)
         
         # Set widget size
         self.setFixedSize(self.board_size, self.board_size)
+        # Every pixel is painted from the background layer, Qt needs not clear it first
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
         
     
     def _load_piece_images(self):
@@ -62,62 +88,88 @@ class ChessBoardWidget(QWidget):
         
         return images
     
-    def _fen_to_board_array(self, fen: str):
-        """Convert FEN string to 8x8 board array."""
-        board_str = fen.split(' ')[0]
-        rows = board_str.split('/')
-        board = []
-        
-        for row in rows:
-            board_row = []
-            for char in row:
-                if char.isdigit():
-                    board_row.extend(['_'] * int(char))
-                else:
-                    board_row.append(char)
-            board.append(board_row)
-        
+    def _snapshot(self):
+        """Snapshot of the position on display."""
+        return self.display_snapshot if self.display_snapshot is not None else self.cn_chess.get_snapshot()
+
+    def _read_board(self):
+        """Read the displayed position as an 8x8 array from its board snapshot."""
+        board = [['_'] * 8 for _ in range(8)]
+        for square, piece in self._snapshot().pieces.items():
+            board[7 - chess.square_rank(square)][chess.square_file(square)] = piece.symbol()
         return board
+
+    def _background_pixmap(self):
+        """Board squares pre-rendered once per square size and device pixel ratio."""
+        ratio = self.devicePixelRatioF()
+        key = (self.square_size, ratio)
+        if self.background_key != key:
+            pixmap = QPixmap(round(self.board_size * ratio), round(self.board_size * ratio))
+            pixmap.setDevicePixelRatio(ratio)
+            painter = QPainter(pixmap)
+            for row in range(8):
+                for col in range(8):
+                    color = self.LIGHT_COLOR if (row + col) % 2 == 0 else self.DARK_COLOR
+                    painter.fillRect(self._get_square_rect(row, col), color)
+            painter.end()
+            self.background = pixmap
+            self.background_key = key
+        return self.background
+
+    def _scaled_piece(self, piece):
+        """Piece pixmap scaled to the square size, cached per square size and device pixel ratio."""
+        ratio = self.devicePixelRatioF()
+        key = (piece, self.square_size, ratio)
+        scaled = self.scaled_pieces.get(key)
+        if scaled is None:
+            scaled = self.piece_images[piece].scaledToWidth(round(self.square_size * ratio),
+                                                            Qt.TransformationMode.SmoothTransformation)
+            scaled.setDevicePixelRatio(ratio)
+            self.scaled_pieces[key] = scaled
+        return scaled
     
     def paintEvent(self, event):
-        """Paint the chess board and pieces."""
+        """Paint the parts of the board inside the invalidated region."""
         painter = QPainter(self)
+        dirty = event.rect()
         
         # Draw the board squares
-        for row in range(8):
-            for col in range(8):
-                rect = self._get_square_rect(row, col)
-                # Alternate colors
-                if (row + col) % 2 == 0:
-                    painter.fillRect(rect, self.LIGHT_COLOR)
-                else:
-                    painter.fillRect(rect, self.DARK_COLOR)
+        painter.drawPixmap(dirty, self._background_pixmap(), self._device_rect(dirty))
         
         # Draw pieces
-        self._draw_pieces(painter)
+        self._draw_pieces(painter, dirty)
         
         # Draw selection highlight
         self._draw_selection_highlight(painter)
 
-        if self.computer_turn:
-            self.draw_trajectory(self.trajectory, painter)
+        if self.shown_trajectory:
+            self.draw_trajectory(self.shown_trajectory, painter)
+        if self.hint is not None:
+            self.draw_hint(self.hint, painter)
+        if self.gantry is not None:
+            self.draw_gantry(painter)
+        painter.end()
+        self.painted.emit()
+
+    def _device_rect(self, rect):
+        """Map a widget rectangle to pixels of the cached background."""
+        ratio = self.devicePixelRatioF()
+        return QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio).toRect()
     
     def _get_square_rect(self, row, col):
         """Get the rectangle for a square at the given row and column."""
         x = col * self.square_size
         y = row * self.square_size
-        return self.rect().adjusted(x, y, x - self.board_size + self.square_size, 
-                                     y - self.board_size + self.square_size)
+        return QRect(x, y, self.square_size, self.square_size)
     
-    def _draw_pieces(self, painter):
-        """Draw all pieces on the board."""
-        fen = self.cn_chess.get_board_state()
-        board = self._fen_to_board_array(fen)
+    def _draw_pieces(self, painter, dirty=None):
+        """Draw the pieces on squares touched by the dirty rectangle."""
         for row in range(8):
             for col in range(8):
-                piece = board[row][col]
+                piece = self.squares[row][col]
                 if piece != '_' and piece != '':
-                    self._draw_piece(painter, row, col, piece)
+                    if dirty is None or dirty.intersects(self._get_square_rect(row, col)):
+                        self._draw_piece(painter, row, col, piece)
     
     def _draw_piece(self, painter, row, col, piece):
         """Draw a single piece."""
@@ -125,9 +177,7 @@ class ChessBoardWidget(QWidget):
         y = row * self.square_size
         
         if piece in self.piece_images:
-            pixmap = self.piece_images[piece]
-            scaled_pixmap = pixmap.scaledToWidth(self.square_size, Qt.TransformationMode.SmoothTransformation)
-            painter.drawPixmap(x, y, scaled_pixmap)
+            painter.drawPixmap(x, y, self._scaled_piece(piece))
     
     def _draw_selection_highlight(self, painter):
         """Draw highlight on the selected piece."""
@@ -147,25 +197,160 @@ class ChessBoardWidget(QWidget):
             if 0 <= row < 8 and 0 <= col < 8:
                 self.piece_clicked.emit(row, col)
     
+    def on_squares_changed(self, version, changed):
+        """Repaint the squares a change of the live board touched; an earlier position on display stays."""
+        if self.display_snapshot is not None:
+            return
+        pieces = self.cn_chess.get_snapshot().pieces
+        for square in changed:
+            row, col = 7 - chess.square_rank(square), chess.square_file(square)
+            piece = pieces.get(square)
+            self.squares[row][col] = piece.symbol() if piece else '_'
+            self.update(self._get_square_rect(row, col))
+        self.version = version
+
     def on_board_changed(self, selected_piece):
-        """Called when board state changes."""
+        """Called when board state changes; schedules a repaint of the changed squares only."""
+        dirty = QRegion()
+        # The live board is kept up to date by on_squares_changed, this compares the whole board
+        # only when switching to or from an earlier position
+        if self._snapshot().version != self.version:
+            self.version = self._snapshot().version
+            squares = self._read_board()
+            for row in range(8):
+                for col in range(8):
+                    if squares[row][col] != self.squares[row][col]:
+                        dirty += self._get_square_rect(row, col)
+            self.squares = squares
+
+        if selected_piece != self.selected_piece:
+            for square in (self.selected_piece, selected_piece):
+                if square:
+                    dirty += self._get_square_rect(*square)
         self.selected_piece = selected_piece
-        self.repaint()
+
+        shown_trajectory = list(self.trajectory) if self.computer_turn else []
+        if shown_trajectory != self.shown_trajectory:
+            dirty += self._trajectory_rect(self.shown_trajectory)
+            dirty += self._trajectory_rect(shown_trajectory)
+        self.shown_trajectory = shown_trajectory
+
+        if not dirty.isEmpty():
+            self.update(dirty)
+
+    def _trajectory_point(self, position):
+        """Widget coordinates of a gantry position."""
+        return (int(position.x * self.square_size - self.square_size // 2),
+                int((9 - position.y) * self.square_size - self.square_size // 2))
+
+    def _trajectory_rect(self, trajectory):
+        """Bounding rectangle of the drawn trajectory, pen width included."""
+        if not trajectory:
+            return QRect()
+        points = [self._trajectory_point(cmd.position) for cmd in trajectory]
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        margin = self.TRAJECTORY_WIDTH
+        return QRect(min(xs) - margin, min(ys) - margin,
+                     max(xs) - min(xs) + 2 * margin + 1, max(ys) - min(ys) + 2 * margin + 1)
 
     def draw_trajectory(self, trajectory, painter):
-        """Draw trajectory on the board (not implemented)."""
-        pen = QPen(QColor(255, 0, 0), 3, Qt.PenStyle.SolidLine)
+        """Draw the magnet-on segments of a trajectory."""
+        pen = QPen(QColor(255, 0, 0), self.TRAJECTORY_WIDTH, Qt.PenStyle.SolidLine)
 
         painter.setPen(pen)
         
         for i in range(len(trajectory) - 1):
-            x1 = int(trajectory[i].position.x * self.square_size - self.square_size // 2)
-            y1 = int((9 - trajectory[i].position.y) * self.square_size - self.square_size // 2)
-            x2 = int(trajectory[i + 1].position.x * self.square_size - self.square_size // 2)
-            y2 = int((9 - trajectory[i + 1].position.y) * self.square_size - self.square_size // 2)
+            x1, y1 = self._trajectory_point(trajectory[i].position)
+            x2, y2 = self._trajectory_point(trajectory[i + 1].position)
             if trajectory[i].magnet_state:
                 painter.drawLine(x1, y1, x2, y2)
 
+    def show_snapshot(self, snapshot):
+        """Display an earlier position of the game, or the game again with None; call on_board_changed after."""
+        self.display_snapshot = snapshot
+
+    def _square_center(self, square):
+        """Widget coordinates of the center of a chess square."""
+        return (chess.square_file(square) * self.square_size + self.square_size // 2,
+                (7 - chess.square_rank(square)) * self.square_size + self.square_size // 2)
+
+    def _hint_rect(self, move):
+        """Rectangle covered by the hint arrow."""
+        if move is None:
+            return QRect()
+        x1, y1 = self._square_center(move.from_square)
+        x2, y2 = self._square_center(move.to_square)
+        margin = 2 * self.HINT_WIDTH
+        return QRect(min(x1, x2) - margin, min(y1, y2) - margin,
+                     abs(x2 - x1) + 2 * margin + 1, abs(y2 - y1) + 2 * margin + 1)
+
+    def set_hint(self, move):
+        """Show move as an arrow, or remove the arrow with None; repaints only around the arrows."""
+        if move == self.hint:
+            return
+        dirty = QRegion(self._hint_rect(self.hint)) + self._hint_rect(move)
+        self.hint = move
+        self.update(dirty)
+
+    def draw_hint(self, move, painter):
+        """Draw a hint arrow from the piece to its target square."""
+        x1, y1 = self._square_center(move.from_square)
+        x2, y2 = self._square_center(move.to_square)
+        length = math.hypot(x2 - x1, y2 - y1)
+        if length == 0:
+            return
+        ux, uy = (x2 - x1) / length, (y2 - y1) / length
+        head = 2.5 * self.HINT_WIDTH
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(QPen(self.HINT_COLOR, self.HINT_WIDTH, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap))
+        painter.drawLine(QPointF(x1, y1), QPointF(x2 - ux * head, y2 - uy * head))
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.HINT_COLOR)
+        painter.drawPolygon(QPolygonF([QPointF(x2, y2),
+                                       QPointF(x2 - ux * head - uy * head * 0.6, y2 - uy * head + ux * head * 0.6),
+                                       QPointF(x2 - ux * head + uy * head * 0.6, y2 - uy * head - ux * head * 0.6)]))
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+
+    def _gantry_rect(self, gantry):
+        """Rectangle covered by the gantry marker."""
+        if gantry is None:
+            return QRect()
+        x, y = self._trajectory_point(gantry[0])
+        radius = self.GANTRY_RADIUS + 1
+        return QRect(x - radius, y - radius, 2 * radius + 1, 2 * radius + 1)
+
+    def draw_gantry(self, painter):
+        """Draw the gantry as a ring, filled while the magnet holds a piece."""
+        position, magnet = self.gantry
+        x, y = self._trajectory_point(position)
+        painter.setPen(QPen(self.GANTRY_COLOR, 2))
+        painter.setBrush(self.GANTRY_COLOR if magnet else Qt.BrushStyle.NoBrush)
+        painter.drawEllipse(x - self.GANTRY_RADIUS, y - self.GANTRY_RADIUS,
+                            2 * self.GANTRY_RADIUS, 2 * self.GANTRY_RADIUS)
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+
+    def start_gantry_animation(self, source):
+        """Follow the gantry at the display refresh rate, repainting only around the marker."""
+        self.gantry_source = source
+        if not self.animation_timer.isActive():
+            screen = self.screen()
+            refresh_rate = screen.refreshRate() if screen is not None else 60.0
+            self.animation_timer.start(max(1, round(1000 / (refresh_rate or 60.0))))
+        self._animate_gantry()
+
+    def _animate_gantry(self):
+        """Move the marker to the gantry's estimated position, stopping once it is idle."""
+        gantry = self.gantry_source() if self.gantry_source is not None else None
+        if gantry is None:
+            self.animation_timer.stop()
+            self.gantry_source = None
+        dirty = QRegion(self._gantry_rect(self.gantry)) + self._gantry_rect(gantry)
+        self.gantry = gantry
+        if not dirty.isEmpty():
+            self.update(dirty)
+
     def set_computer_turn(self, is_computer_turn):
         """Set whether it's the computer's turn."""
         self.computer_turn = is_computer_turn
@@ -175,6 +360,39 @@ class ChessBoardWidget(QWidget):
         self.trajectory = trajectory
 
 
+class EvalBar(QWidget):
+    """Vertical bar showing White's winning chances from the engine's score."""
+
+    WHITE_COLOR = QColor(245, 245, 245)
+    BLACK_COLOR = QColor(40, 40, 40)
+
+    def __init__(self, parent=None):
+        """Initialize an even bar."""
+        super().__init__(parent)
+        self.fraction = 0.5  # White's share of the bar
+        self.setFixedSize(24, 640)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
+    def set_score(self, score_cp, mate):
+        """Show a score from White's point of view; repaints only when the bar moves by a pixel."""
+        if mate is not None:
+            fraction = 1.0 if mate > 0 else 0.0
+        else:
+            # Winning chances, the same curve as the common analysis boards use
+            fraction = 1.0 / (1.0 + 10 ** (-(score_cp or 0) / 400))
+        if round(fraction * self.height()) != round(self.fraction * self.height()):
+            self.fraction = fraction
+            self.update()
+
+    def paintEvent(self, event):
+        """Paint Black's share on top and White's at the bottom."""
+        painter = QPainter(self)
+        white_height = round(self.fraction * self.height())
+        painter.fillRect(0, 0, self.width(), self.height() - white_height, self.BLACK_COLOR)
+        painter.fillRect(0, self.height() - white_height, self.width(), white_height, self.WHITE_COLOR)
+        painter.end()
+
+
 class ChessView(QMainWindow):
     """Main window for the chess application."""
     
@@ -183,15 +401,12 @@ class ChessView(QMainWindow):
         super().__init__()
         self.cn_chess = cn_chess
         self.controller = controller
+        self.motion_end = None  # Estimated monotonic time the gantry stops, counted down in the status bar
+        self.motion_timer = QTimer(self)
+        self.motion_timer.timeout.connect(self.update_status)
         
-        # Load UI from .ui file
-        ui_file_path = os.path.join(os.path.dirname(__file__), 'chess_main.ui')
-        
-        if not os.path.exists(ui_file_path):
-            raise FileNotFoundError(f"Could not find UI file: {ui_file_path}")
-        
-        # Load the UI file using uic
-        uic.loadUi(ui_file_path, self)
+        # Build the UI from the form compiled by pyuic6, parsing the .ui file is slow at start-up
+        self._setup_ui()
         
         # Set window properties
         self.setWindowTitle('CNChess - PyQt')
@@ -202,6 +417,7 @@ class ChessView(QMainWindow):
         self.status_label = self.findChild(QLabel, 'statusLabel')
         reset_button = self.findChild(QPushButton, 'resetButton')
         quit_button = self.findChild(QPushButton, 'quitButton')
+        self.coach_button = self.findChild(QPushButton, 'coachButton')
         
         # Create chess board widget and add to container
         self.board_widget = ChessBoardWidget(cn_chess)
@@ -212,6 +428,16 @@ class ChessView(QMainWindow):
             if layout:
                 layout.replaceWidget(board_container, self.board_widget)
                 board_container.deleteLater()
+
+        # Evaluation bar of the coaching mode, hidden until it is switched on
+        self.eval_bar = EvalBar()
+        eval_bar_container = self.findChild(QWidget, 'evalBarContainer')
+        if eval_bar_container and eval_bar_container.parent():
+            layout = eval_bar_container.parent().layout()
+            if layout:
+                layout.replaceWidget(eval_bar_container, self.eval_bar)
+                eval_bar_container.deleteLater()
+        self.eval_bar.setVisible(False)
         
         # Connect signals
         self.board_widget.piece_clicked.connect(self.on_board_clicked)
@@ -219,6 +445,29 @@ class ChessView(QMainWindow):
             reset_button.clicked.connect(self.on_reset_clicked)
         if quit_button:
             quit_button.clicked.connect(self.close)
+        if self.coach_button:
+            self.coach_button.toggled.connect(self.on_coach_toggled)
+        back_action = self.findChild(QAction, 'actionBack')
+        forward_action = self.findChild(QAction, 'actionForward')
+        if back_action:
+            back_action.triggered.connect(lambda: self.on_step_clicked(-1))
+        if forward_action:
+            forward_action.triggered.connect(lambda: self.on_step_clicked(1))
+    
+    def _setup_ui(self):
+        """Set up the form compiled from chess_main.ui, or load the .ui file when it is missing."""
+        # Regenerate after editing chess_main.ui: pyuic6 chess_main.ui -o ui_chess_main.py
+        try:
+            from ui.ui_chess_main import Ui_ChessMainWindow
+        except ImportError:
+            ui_file_path = os.path.join(os.path.dirname(__file__), 'chess_main.ui')
+            if not os.path.exists(ui_file_path):
+                raise FileNotFoundError(f"Could not find UI file: {ui_file_path}")
+            from PyQt6 import uic
+            uic.loadUi(ui_file_path, self)
+            return
+        self.form = Ui_ChessMainWindow()
+        self.form.setupUi(self)
     
     def on_board_clicked(self, row, col):
         """Handle board click events."""
@@ -232,11 +481,53 @@ class ChessView(QMainWindow):
             self.controller.reset_board()
         self.update_status()
     
+    def on_coach_toggled(self, checked):
+        """Switch the coaching mode on or off."""
+        self.eval_bar.setVisible(checked)
+        if not checked:
+            self.show_analysis(None)
+        if self.controller:
+            self.controller.set_coaching(checked)
+
+    def on_step_clicked(self, step):
+        """Step back or forward through the moves of the game."""
+        if self.controller:
+            self.controller.step_through_game(step)
+        self.update_status()
+
+    def show_analysis(self, analysis):
+        """Show the evaluation, top lines and hint of an analysis, or clear them with None."""
+        best = analysis.best_line() if analysis is not None else None
+        if best is None:
+            self.board_widget.set_hint(None)
+            self.eval_bar.set_score(0, None)
+            self.statusBar().clearMessage()
+            return
+        self.board_widget.set_hint(analysis.hint())
+        self.eval_bar.set_score(best.score_cp, best.mate)
+        lines = "   ".join(f"{line.score_text()} {line.san(analysis.board, 4)}" for line in analysis.top_lines())
+        self.statusBar().showMessage(f"Depth {analysis.depth}   {lines}")
+
+    def show_message(self, message):
+        """Show a message in the status bar until the next one."""
+        self.statusBar().showMessage(message)
+
     def on_board_changed(self, selected_piece):
         """Called when board state changes from controller."""
         self.board_widget.on_board_changed(selected_piece)
         self.update_status()
     
+    def on_motion_progress(self, seconds_left):
+        """Count down the gantry's estimated time left, None once it stopped."""
+        if seconds_left is None:
+            self.motion_end = None
+            self.motion_timer.stop()
+        else:
+            self.motion_end = time.monotonic() + seconds_left
+            if not self.motion_timer.isActive():
+                self.motion_timer.start(100)
+        self.update_status()
+
     def update_status(self):
         """Update the status label."""
         status_text = "Ready"
@@ -260,5 +551,8 @@ class ChessView(QMainWindow):
                 status_text += " | Game Over"
         except Exception:
             pass
+
+        if self.motion_end is not None:
+            status_text += f" | Gantry moving, {max(0.0, self.motion_end - time.monotonic()):.1f} s left"
         
         self.status_label.setText(status_text)
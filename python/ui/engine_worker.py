@@ -0,0 +1,122 @@
+"""Engine Worker - Runs Stockfish searches off the GUI thread."""
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+
+
+class EngineWorker(QObject):
+    """Runs engine searches in its own thread, one at a time."""
+
+    move_found = pyqtSignal(int, object)  # request id, chess.Move
+    candidates_found = pyqtSignal(int, object)  # request id, list of chess.Move, best first
+    failed = pyqtSignal(int, str)  # request id, 0 for pondering, and what went wrong
+
+    def __init__(self, cn_chess):
+        """Initialize the worker with the CNChess instance owning the engine."""
+        super().__init__()
+        self.cn_chess = cn_chess
+        self.generation = 0       # Bumped by the client to cancel queued work
+
+    @pyqtSlot(int, int, object)
+    def search(self, request_id, generation, board):
+        """Find the best move for board; a ponder search on it is turned into the answer."""
+        if generation != self.generation:
+            return
+        # An exception escaping a slot aborts the application, the engine may not even have started
+        try:
+            move = self.cn_chess.get_best_move_for(
+                board, on_candidates=lambda moves: self.candidates_found.emit(request_id, moves))
+        except Exception as e:
+            self.failed.emit(request_id, f"Engine search failed: {e}")
+            return
+        if generation == self.generation:
+            self.move_found.emit(request_id, move)
+
+    @pyqtSlot(int, object)
+    def ponder(self, generation, board):
+        """Start thinking about the reply the engine expects in board; returns at once."""
+        if generation != self.generation:
+            return
+        try:
+            self.cn_chess.start_ponder(board)
+        except Exception as e:
+            self.failed.emit(0, f"Engine ponder failed: {e}")
+
+    @pyqtSlot()
+    def stop_ponder(self):
+        """Drop the ponder search."""
+        try:
+            self.cn_chess.stop_ponder()
+        except Exception as e:
+            self.failed.emit(0, f"Engine ponder failed: {e}")
+
+
+class EngineClient(QObject):
+    """GUI-side handle on the engine thread; results come back through move_ready."""
+
+    move_ready = pyqtSignal(object)  # chess.Move for the latest request
+    candidates_ready = pyqtSignal(object)  # Likely moves of the running search, best first
+    search_failed = pyqtSignal(str)  # The latest request gets no move
+    ponder_failed = pyqtSignal(str)
+
+    _search_requested = pyqtSignal(int, int, object)
+    _ponder_requested = pyqtSignal(int, object)
+    _stop_ponder_requested = pyqtSignal()
+
+    def __init__(self, cn_chess, parent=None):
+        """Start the engine thread."""
+        super().__init__(parent)
+        self.request_id = 0
+        self.thread = QThread()
+        self.worker = EngineWorker(cn_chess)
+        self.worker.moveToThread(self.thread)
+        self._search_requested.connect(self.worker.search)
+        self._ponder_requested.connect(self.worker.ponder)
+        self._stop_ponder_requested.connect(self.worker.stop_ponder)
+        self.worker.move_found.connect(self._on_move_found)
+        self.worker.candidates_found.connect(self._on_candidates_found)
+        self.worker.failed.connect(self._on_failed)
+        self.thread.start()
+
+    def request_move(self, board):
+        """Ask for the best move in a copy of the game board; the answer arrives through move_ready."""
+        self.request_id += 1
+        self._search_requested.emit(self.request_id, self.worker.generation, board)
+
+    def ponder(self, board):
+        """Think on the human's turn in a copy of the game board so the next answer can be instant."""
+        self._ponder_requested.emit(self.worker.generation, board)
+
+    def stop_ponder(self):
+        """Stop thinking on the human's turn, e.g. to leave the cores to the analysis."""
+        self._stop_ponder_requested.emit()
+
+    def cancel(self):
+        """Drop pending searches and any result still on its way, stopping the running search now."""
+        self.worker.generation += 1
+        self.request_id += 1
+        # Not through the worker, its thread is busy waiting for that search
+        self.worker.cn_chess.stop_search()
+        self._stop_ponder_requested.emit()
+
+    def shutdown(self):
+        """Stop the engine thread, waiting for a running search to finish."""
+        self.cancel()
+        self.thread.quit()
+        self.thread.wait()
+
+    def _on_move_found(self, request_id, move):
+        """Forward the result unless it was cancelled or superseded."""
+        if request_id == self.request_id:
+            self.move_ready.emit(move)
+
+    def _on_candidates_found(self, request_id, moves):
+        """Forward early candidates of the current search."""
+        if request_id == self.request_id:
+            self.candidates_ready.emit(moves)
+
+    def _on_failed(self, request_id, message):
+        """Report a failed search unless it was cancelled or superseded, and every ponder failure."""
+        if request_id == 0:
+            self.ponder_failed.emit(message)
+        elif request_id == self.request_id:
+            self.search_failed.emit(message)
@@ -0,0 +1,261 @@
+"""Motion Executor - Runs gantry motion on its own thread and reports its progress to the view."""
+
+import time
+from collections import deque
+
+from PyQt6.QtCore import QObject, Qt, QThread, QTimer, pyqtSignal, pyqtSlot
+
+from Control import Position
+from ui.serial_transport import SerialTransport
+
+
+class MotionPlan:
+    """One gantry motion: the segments to upload with the waypoints and timings to animate it."""
+
+    def __init__(self, control, path):
+        """Compile path from the gantry's current position; Control then expects the gantry at its end."""
+        self.control = control
+        self.path = path
+        self.waypoints = [control.current_position] + [cmd.position for cmd in path]
+        # Magnet state while moving to each waypoint, as Control.compile_steps sends it
+        self.magnets = [False] + [cmd.magnet_state for cmd in path[:-1]]
+        self.durations = control.motor_model.segment_times(self.waypoints, self.magnets)
+        self.start_state = control.motion_state()
+        self.steps, magnets = control.compile_steps(path)
+        self.segments = control.make_segments(self.steps, magnets)
+        self.plan_id = 0
+        self.done = 0                # Segments finished
+        self.segment_started = None  # Monotonic time the running segment started, None before the motion
+        self.stale = False           # Compiled on top of a plan that failed, so it started from the wrong place
+
+    def __len__(self):
+        """Number of segments."""
+        return len(self.segments)
+
+    def roll_back(self):
+        """Tell Control the gantry stopped after the segments reported done, the rest never ran."""
+        self.control.stopped_after(self.start_state, self.steps, self.waypoints[1:], self.done)
+
+    def remaining_time(self, now):
+        """Estimated seconds until the motion ends."""
+        if self.done >= len(self):
+            return 0.0
+        remaining = sum(self.durations[self.done:])
+        if self.segment_started is not None:
+            remaining -= min(now - self.segment_started, self.durations[self.done])
+        return remaining
+
+    def gantry_at(self, now):
+        """Estimated gantry position and magnet state, between the waypoints of the running segment."""
+        if self.segment_started is None:
+            return self.waypoints[0], False
+        if self.done >= len(self):
+            return self.waypoints[-1], False
+        start = self.waypoints[self.done]
+        end = self.waypoints[self.done + 1]
+        duration = self.durations[self.done]
+        fraction = min(1.0, (now - self.segment_started) / duration) if duration > 0 else 1.0
+        position = Position(start.x + (end.x - start.x) * fraction, start.y + (end.y - start.y) * fraction)
+        return position, self.magnets[self.done]
+
+
+class MotionWorker(QObject):
+    """Owns the serial transport on the motion thread; simulates the motion when no controller is connected."""
+
+    connected = pyqtSignal(str)
+    disconnected = pyqtSignal()
+    segment_done = pyqtSignal(int, int)      # plan id, segments done so far
+    plan_finished = pyqtSignal(int, bool)    # plan id, True when every segment was done
+
+    def __init__(self, port=None):
+        """Remember the preferred port; the transport is created on the motion thread by start()."""
+        super().__init__()
+        self.port = port
+        self.transport = None
+        self.uploading = deque()   # Plan ids handed to the transport, it finishes them in order
+        self.simulated = deque()   # (plan id, segment durations) waiting for the simulation
+        self.simulated_done = 0
+        self.simulation_timer = None
+
+    @pyqtSlot()
+    def start(self):
+        """Create the transport and start looking for the motor controller."""
+        self.transport = SerialTransport(self.port, parent=self)
+        self.transport.connected.connect(self.connected)
+        self.transport.disconnected.connect(self.disconnected)
+        self.transport.progress.connect(self._on_progress)
+        self.transport.finished.connect(self._on_finished)
+        self.simulation_timer = QTimer(self)
+        self.simulation_timer.setSingleShot(True)
+        self.simulation_timer.timeout.connect(self._simulate_segment)
+        self.transport.open()
+
+    @pyqtSlot(int, object, object)
+    def execute(self, plan_id, segments, durations):
+        """Upload segments, or play them on their estimated timings without a controller."""
+        if self.transport.is_connected():
+            self.uploading.append(plan_id)
+            self.transport.run(segments)
+            return
+        self.simulated.append((plan_id, durations))
+        if len(self.simulated) == 1:
+            self._start_simulation()
+
+    @pyqtSlot()
+    def close(self):
+        """Stop the motion and close the port."""
+        self.simulated.clear()
+        if self.simulation_timer is not None:
+            self.simulation_timer.stop()
+        if self.transport is not None:
+            self.transport.close()
+
+    def _on_progress(self, done, count):
+        """Forward the transport's progress for the plan it is uploading."""
+        if self.uploading:
+            self.segment_done.emit(self.uploading[0], done)
+
+    def _on_finished(self, ok):
+        """Forward the end of the uploaded plan."""
+        if self.uploading:
+            self.plan_finished.emit(self.uploading.popleft(), ok)
+
+    def _start_simulation(self):
+        """Start playing the first simulated plan."""
+        plan_id, durations = self.simulated[0]
+        self.simulated_done = 0
+        self.segment_done.emit(plan_id, 0)
+        self._schedule_segment()
+
+    def _schedule_segment(self):
+        """Wait out the running simulated segment, or finish the plan."""
+        plan_id, durations = self.simulated[0]
+        if self.simulated_done < len(durations):
+            self.simulation_timer.start(round(durations[self.simulated_done] * 1000))
+            return
+        self.simulated.popleft()
+        self.plan_finished.emit(plan_id, True)
+        if self.simulated:
+            self._start_simulation()
+
+    def _simulate_segment(self):
+        """Count the simulated segment as done."""
+        if not self.simulated:
+            return
+        self.simulated_done += 1
+        self.segment_done.emit(self.simulated[0][0], self.simulated_done)
+        self._schedule_segment()
+
+
+class MotionExecutor(QObject):
+    """GUI-side handle on the motion thread; execute() never waits for the gantry."""
+
+    connected = pyqtSignal(str)
+    disconnected = pyqtSignal()
+    started = pyqtSignal(object)                # MotionPlan whose first segment is running
+    progress = pyqtSignal(object, bool, float)  # Gantry position after each segment, magnet state, seconds left
+    finished = pyqtSignal(object, bool)         # MotionPlan, True when every segment was done
+    idle = pyqtSignal()                         # Every plan finished
+
+    _start_requested = pyqtSignal()
+    _execute_requested = pyqtSignal(int, object, object)
+    _close_requested = pyqtSignal()
+
+    def __init__(self, port=None, parent=None):
+        """Start the motion thread and look for the motor controller on it."""
+        super().__init__(parent)
+        self.plans = deque()  # Plans handed to the worker, oldest first
+        self.plan_id = 0
+        self.controller_connected = False
+        self.thread = QThread()
+        self.worker = MotionWorker(port)
+        self.worker.moveToThread(self.thread)
+        self._start_requested.connect(self.worker.start)
+        self._execute_requested.connect(self.worker.execute)
+        self._close_requested.connect(self.worker.close, Qt.ConnectionType.BlockingQueuedConnection)
+        self.worker.connected.connect(self._on_connected)
+        self.worker.disconnected.connect(self._on_disconnected)
+        self.worker.segment_done.connect(self._on_segment_done)
+        self.worker.plan_finished.connect(self._on_plan_finished)
+        self.thread.start()
+        self._start_requested.emit()
+
+    def is_connected(self):
+        """True while the motor controller is connected; motion is simulated otherwise."""
+        return self.controller_connected
+
+    def is_busy(self):
+        """True while the gantry has motion left."""
+        return bool(self.plans)
+
+    def execute(self, plan):
+        """Queue a plan on the motion thread."""
+        self.plan_id += 1
+        plan.plan_id = self.plan_id
+        self.plans.append(plan)
+        self._execute_requested.emit(plan.plan_id, plan.segments, plan.durations)
+
+    def gantry_at(self, now=None):
+        """Estimated gantry position and magnet state now, None when nothing is moving."""
+        if not self.plans:
+            return None
+        return self.plans[0].gantry_at(time.monotonic() if now is None else now)
+
+    def remaining_time(self, now=None):
+        """Estimated seconds until every queued plan is done."""
+        now = time.monotonic() if now is None else now
+        return sum(plan.remaining_time(now) for plan in self.plans)
+
+    def shutdown(self):
+        """Stop the motion thread after closing the port."""
+        self._close_requested.emit()
+        self.thread.quit()
+        self.thread.wait()
+
+    def _find_plan(self, plan_id):
+        """Queued plan with plan_id, None once it finished."""
+        for plan in self.plans:
+            if plan.plan_id == plan_id:
+                return plan
+        return None
+
+    def _on_connected(self, port):
+        """Track the controller connection."""
+        self.controller_connected = True
+        self.connected.emit(port)
+
+    def _on_disconnected(self):
+        """Track the controller connection."""
+        self.controller_connected = False
+        self.disconnected.emit()
+
+    def _on_segment_done(self, plan_id, done):
+        """Start timing the next segment and report where the gantry is."""
+        plan = self._find_plan(plan_id)
+        if plan is None:
+            return
+        now = time.monotonic()
+        first = plan.segment_started is None
+        plan.done = done
+        plan.segment_started = now
+        if first:
+            self.started.emit(plan)
+        position = plan.waypoints[min(done, len(plan))]
+        magnet = plan.magnets[done] if done < len(plan) else False
+        self.progress.emit(position, magnet, self.remaining_time(now))
+
+    def _on_plan_finished(self, plan_id, ok):
+        """Drop the finished plan and report it; a failed plan takes back the motion that never ran."""
+        plan = self._find_plan(plan_id)
+        if plan is None:
+            return
+        self.plans.remove(plan)
+        if not ok and not plan.stale:
+            plan.roll_back()
+            # Plans queued behind it fail with it, and were compiled from where it should have ended
+            for later in self.plans:
+                later.stale = True
+        plan.done = len(plan)
+        self.finished.emit(plan, ok)
+        if not self.plans:
+            self.idle.emit()
@@ -0,0 +1,258 @@
+"""Serial Transport - Talks to the motor controller from the Qt event loop without blocking it."""
+
+import logging
+import time
+from collections import deque
+
+import serial
+import serial.tools.list_ports
+from PyQt6.QtCore import QObject, QSocketNotifier, QTimer, pyqtSignal
+
+from Metrics import metrics
+from MotionLink import MotionLink, MotionTransfer, decode_frame, encode_frame
+
+log = logging.getLogger(__name__)
+
+# USB vendor ids of Arduino boards and of the usual USB serial bridges
+KNOWN_VENDORS = {0x2341: "Arduino", 0x2A03: "Arduino", 0x1A86: "CH340", 0x0403: "FTDI", 0x10C4: "CP210x"}
+
+
+def find_ports(preferred=None):
+    """List candidate ports: the preferred one first, then known USB serial boards, then the rest."""
+    ports = serial.tools.list_ports.comports()
+    known = [port.device for port in ports if port.vid in KNOWN_VENDORS]
+    others = [port.device for port in ports if port.vid is not None and port.vid not in KNOWN_VENDORS]
+    candidates = ([preferred] if preferred else []) + known + others
+    return list(dict.fromkeys(candidates))
+
+
+class SerialTransport(QObject):
+    """Runs MotionLink transfers from the event loop; waiting for the motors uses no CPU."""
+
+    connected = pyqtSignal(str)      # Port of the motor controller, after the reset handshake
+    disconnected = pyqtSignal()
+    progress = pyqtSignal(int, int)  # Segments done, segments in the running transfer
+    finished = pyqtSignal(bool)      # Once per run(), True when every segment was done
+
+    RECONNECT_INTERVAL_MS = 2000
+    HANDSHAKE_TIMEOUT = 3.0  # Seconds, the board resets when the port opens
+    POLL_INTERVAL_MS = 20    # Read polling where the port has no file descriptor (Windows)
+
+    def __init__(self, port=None, baudrate=115200, parent=None):
+        """Set up the transport; call open() to start looking for the controller."""
+        super().__init__(parent)
+        self.preferred_port = port
+        self.baudrate = baudrate
+        self.ser = None
+        self.port = None
+        self.synced = False
+        self.seq = 0
+        self.buffer = bytearray()
+        self.candidates = []
+        self.handshake_deadline = 0.0
+        self.transfer = None
+        self.transfer_started = 0.0
+        self.reported_done = -1
+        self.pending = deque()  # Segment lists waiting for the running transfer
+        self.retransmissions = 0
+        self.notifier = None
+
+        self.timer = QTimer(self)  # Retransmission, poll and handshake deadlines
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._on_timer)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self._read)
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.open)
+
+    def is_connected(self):
+        """True once the controller answered the reset handshake."""
+        return self.ser is not None and self.synced
+
+    def open(self):
+        """Look for the motor controller, trying each candidate port in turn."""
+        if self.ser is not None:
+            return
+        self.candidates = find_ports(self.preferred_port)
+        self._try_next_port()
+
+    def close(self):
+        """Close the port and give up on queued motion."""
+        self.reconnect_timer.stop()
+        self._fail_all()
+        self._close_port()
+
+    def run(self, segments):
+        """Queue segments for upload; finished is emitted once they are done or failed."""
+        if self.ser is None:
+            log.warning("Motor controller not connected, motion skipped.")
+            QTimer.singleShot(0, lambda: self.finished.emit(False))
+            return
+        self.pending.append(list(segments))
+        self._start_next()
+
+    def _try_next_port(self):
+        """Open the next candidate port and start the reset handshake on it."""
+        self._close_port()
+        while self.candidates:
+            port = self.candidates.pop(0)
+            try:
+                self.ser = serial.Serial(port, self.baudrate, timeout=0, write_timeout=1)
+            except (serial.SerialException, OSError):
+                continue
+            self.port = port
+            self._watch()
+            self.handshake_deadline = time.monotonic() + self.HANDSHAKE_TIMEOUT
+            self._handshake()
+            return
+        # Nothing answered, keep looking in the background
+        self.reconnect_timer.start(self.RECONNECT_INTERVAL_MS)
+
+    def _watch(self):
+        """Get called when bytes arrive, through the file descriptor where there is one."""
+        try:
+            fd = self.ser.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.poll_timer.start(self.POLL_INTERVAL_MS)
+            return
+        self.notifier = QSocketNotifier(fd, QSocketNotifier.Type.Read, self)
+        self.notifier.activated.connect(self._read)
+
+    def _close_port(self):
+        """Release the port and everything watching it."""
+        self.timer.stop()
+        self.poll_timer.stop()
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.ser = None
+        self.synced = False
+        self.buffer.clear()
+
+    def _handshake(self):
+        """Ask the controller to reset its queue and sequence numbers."""
+        self.synced = False
+        self._write(encode_frame("R"))
+        self.timer.start(int(MotionLink.ACK_TIMEOUT * 1000))
+
+    def _write(self, frame):
+        """Send a frame, treating write errors as a lost connection."""
+        if self.ser is None:
+            return
+        try:
+            self.ser.write(frame)
+        except (serial.SerialException, OSError):
+            self._lost()
+
+    def _read(self):
+        """Read what arrived and handle every complete frame."""
+        if self.ser is None:
+            return
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError):
+            self._lost()
+            return
+        self.buffer += data
+        while self.ser is not None:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(self.buffer[:end + 1])
+            del self.buffer[:end + 1]
+            self._on_line(line)
+
+    def _on_line(self, line):
+        """Feed one line from the controller to the handshake or to the running transfer."""
+        fields = decode_frame(line)
+        if not self.synced:
+            if fields == ["R"]:
+                self.synced = True
+                self.seq = 0
+                self.timer.stop()
+                log.info("Motor controller connected on %s", self.port)
+                self.connected.emit(self.port)
+                self._start_next()
+            return
+        if self.transfer is None:
+            return
+        if fields:
+            self.transfer.on_frame(fields, time.monotonic())
+        else:
+            self.transfer.on_timeout(time.monotonic())
+        self._check_transfer()
+
+    def _on_timer(self):
+        """Resend the handshake, or let the transfer handle its timeouts."""
+        if not self.synced:
+            if time.monotonic() > self.handshake_deadline:
+                self._try_next_port()
+            else:
+                self._handshake()
+            return
+        if self.transfer is not None:
+            self.transfer.on_timeout(time.monotonic())
+            self._check_transfer()
+
+    def _start_next(self):
+        """Start uploading the next queued segments if the link is free."""
+        if self.transfer is not None or not self.is_connected() or not self.pending:
+            return
+        segments = self.pending.popleft()
+        self.transfer = MotionTransfer(segments, self.seq, MotionLink.WINDOW, self._write)
+        self.transfer_started = time.monotonic()
+        self.reported_done = -1
+        self.transfer.start(self.transfer_started)
+        self._check_transfer()
+
+    def _check_transfer(self):
+        """Report progress, completion or failure of the running transfer."""
+        transfer = self.transfer
+        if transfer is None:
+            return
+        if transfer.error is not None:
+            log.error("Motion upload failed: %s", transfer.error)
+            self.retransmissions += transfer.retransmissions
+            self._fail_all()
+            # The controller's queue is in an unknown state, start over with a reset
+            if self.ser is not None:
+                self.handshake_deadline = time.monotonic() + self.HANDSHAKE_TIMEOUT
+                self._handshake()
+            return
+        if transfer.done != self.reported_done:
+            self.reported_done = transfer.done
+            self.progress.emit(transfer.done, transfer.count)
+        if transfer.finished:
+            self.retransmissions += transfer.retransmissions
+            self.seq = transfer.end_seq
+            self.transfer = None
+            self.timer.stop()
+            metrics.record("motion.run", time.monotonic() - self.transfer_started)
+            self.finished.emit(True)
+            self._start_next()
+            return
+        self.timer.start(max(0, int((transfer.deadline() - time.monotonic()) * 1000)))
+
+    def _fail_all(self):
+        """Drop the running and queued transfers, reporting each one as failed."""
+        failed = len(self.pending) + (1 if self.transfer is not None else 0)
+        self.transfer = None
+        self.pending.clear()
+        self.timer.stop()
+        for _ in range(failed):
+            self.finished.emit(False)
+
+    def _lost(self):
+        """Handle an unplugged or failing port: fail queued motion and reconnect later."""
+        log.warning("Lost the motor controller on %s, reconnecting.", self.port)
+        self._fail_all()
+        self._close_port()
+        self.disconnected.emit()
+        self.reconnect_timer.start(self.RECONNECT_INTERVAL_MS)
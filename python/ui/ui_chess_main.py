@@ -0,0 +1,104 @@
+# Form implementation generated from reading ui file 'chess_main.ui'
+#
+# Created by: PyQt6 UI code generator 6.11.0
+#
+# WARNING: Any manual changes made to this file will be lost when pyuic6 is
+# run again.  Do not edit this file unless you know what you are doing.
+
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+
+class Ui_ChessMainWindow(object):
+    def setupUi(self, ChessMainWindow):
+        ChessMainWindow.setObjectName("ChessMainWindow")
+        ChessMainWindow.resize(740, 720)
+        self.centralwidget = QtWidgets.QWidget(parent=ChessMainWindow)
+        self.centralwidget.setObjectName("centralwidget")
+        self.verticalLayout = QtWidgets.QVBoxLayout(self.centralwidget)
+        self.verticalLayout.setObjectName("verticalLayout")
+        self.boardLayout = QtWidgets.QHBoxLayout()
+        self.boardLayout.setObjectName("boardLayout")
+        self.evalBarContainer = QtWidgets.QWidget(parent=self.centralwidget)
+        self.evalBarContainer.setMinimumSize(QtCore.QSize(24, 640))
+        self.evalBarContainer.setMaximumSize(QtCore.QSize(24, 640))
+        self.evalBarContainer.setObjectName("evalBarContainer")
+        self.boardLayout.addWidget(self.evalBarContainer)
+        self.boardContainer = QtWidgets.QWidget(parent=self.centralwidget)
+        self.boardContainer.setMinimumSize(QtCore.QSize(640, 640))
+        self.boardContainer.setMaximumSize(QtCore.QSize(640, 640))
+        self.boardContainer.setObjectName("boardContainer")
+        self.boardLayout.addWidget(self.boardContainer)
+        self.verticalLayout.addLayout(self.boardLayout)
+        self.horizontalLayout = QtWidgets.QHBoxLayout()
+        self.horizontalLayout.setObjectName("horizontalLayout")
+        self.resetButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.resetButton.setObjectName("resetButton")
+        self.horizontalLayout.addWidget(self.resetButton)
+        self.statusLabel = QtWidgets.QLabel(parent=self.centralwidget)
+        font = QtGui.QFont()
+        font.setFamily("Arial")
+        font.setPointSize(10)
+        self.statusLabel.setFont(font)
+        self.statusLabel.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+        self.statusLabel.setObjectName("statusLabel")
+        self.horizontalLayout.addWidget(self.statusLabel)
+        self.coachButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.coachButton.setCheckable(True)
+        self.coachButton.setObjectName("coachButton")
+        self.horizontalLayout.addWidget(self.coachButton)
+        self.quitButton = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.quitButton.setObjectName("quitButton")
+        self.horizontalLayout.addWidget(self.quitButton)
+        self.verticalLayout.addLayout(self.horizontalLayout)
+        ChessMainWindow.setCentralWidget(self.centralwidget)
+        self.menubar = QtWidgets.QMenuBar(parent=ChessMainWindow)
+        self.menubar.setGeometry(QtCore.QRect(0, 0, 740, 22))
+        self.menubar.setObjectName("menubar")
+        self.menuFile = QtWidgets.QMenu(parent=self.menubar)
+        self.menuFile.setObjectName("menuFile")
+        self.menuGame = QtWidgets.QMenu(parent=self.menubar)
+        self.menuGame.setObjectName("menuGame")
+        ChessMainWindow.setMenuBar(self.menubar)
+        self.statusbar = QtWidgets.QStatusBar(parent=ChessMainWindow)
+        self.statusbar.setObjectName("statusbar")
+        ChessMainWindow.setStatusBar(self.statusbar)
+        self.actionReset = QtGui.QAction(parent=ChessMainWindow)
+        self.actionReset.setObjectName("actionReset")
+        self.actionBack = QtGui.QAction(parent=ChessMainWindow)
+        self.actionBack.setObjectName("actionBack")
+        self.actionForward = QtGui.QAction(parent=ChessMainWindow)
+        self.actionForward.setObjectName("actionForward")
+        self.actionQuit = QtGui.QAction(parent=ChessMainWindow)
+        self.actionQuit.setObjectName("actionQuit")
+        self.menuFile.addAction(self.actionReset)
+        self.menuFile.addAction(self.actionQuit)
+        self.menuGame.addAction(self.actionBack)
+        self.menuGame.addAction(self.actionForward)
+        self.menubar.addAction(self.menuFile.menuAction())
+        self.menubar.addAction(self.menuGame.menuAction())
+
+        self.retranslateUi(ChessMainWindow)
+        self.quitButton.clicked.connect(ChessMainWindow.close) # type: ignore
+        self.actionQuit.triggered.connect(ChessMainWindow.close) # type: ignore
+        QtCore.QMetaObject.connectSlotsByName(ChessMainWindow)
+
+    def retranslateUi(self, ChessMainWindow):
+        _translate = QtCore.QCoreApplication.translate
+        ChessMainWindow.setWindowTitle(_translate("ChessMainWindow", "CNChess - PyQt"))
+        self.resetButton.setText(_translate("ChessMainWindow", "Reset"))
+        self.statusLabel.setText(_translate("ChessMainWindow", "Ready"))
+        self.coachButton.setText(_translate("ChessMainWindow", "Coach"))
+        self.coachButton.setShortcut(_translate("ChessMainWindow", "Ctrl+H"))
+        self.coachButton.setToolTip(_translate("ChessMainWindow", "Show the engine\'s evaluation, best lines and a hint while you think"))
+        self.quitButton.setText(_translate("ChessMainWindow", "Quit"))
+        self.menuFile.setTitle(_translate("ChessMainWindow", "&File"))
+        self.menuGame.setTitle(_translate("ChessMainWindow", "&Game"))
+        self.actionReset.setText(_translate("ChessMainWindow", "&Reset Board"))
+        self.actionReset.setShortcut(_translate("ChessMainWindow", "Ctrl+R"))
+        self.actionBack.setText(_translate("ChessMainWindow", "Step &Back"))
+        self.actionBack.setShortcut(_translate("ChessMainWindow", "Left"))
+        self.actionForward.setText(_translate("ChessMainWindow", "Step &Forward"))
+        self.actionForward.setShortcut(_translate("ChessMainWindow", "Right"))
+        self.actionQuit.setText(_translate("ChessMainWindow", "&Quit"))
+        self.actionQuit.setShortcut(_translate("ChessMainWindow", "Ctrl+Q"))